@@ -1,20 +1,39 @@
+import asyncio
+import hmac
+import json
 import os
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from typing import List
 
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+# Load .env before the local modules below read their configuration at import
+load_dotenv()
 
-from glimpse import run_code, run_code_pool
-from containers import ContainerPool
+from glimpse import (
+    LOCAL_SANDBOX,
+    run_batch,
+    run_code,
+    run_code_pool,
+    staging,
+    stop_services,
+    stream_code,
+    validate_submission,
+)
+from containers import collect_metrics, pool_from_env
+from executors import router_from_env
+from utils.admission import AdmissionController, Overloaded
+from utils.job_queue import JobQueue
+from utils.metrics import count_responses, registry
+from utils.profiler import collapsed, profiler, summarize
+from utils.result_cache import ResultCache
+from utils.tracing import trace_requests
 
 app = FastAPI()
-load_dotenv()  # load environment variables on API startup
 
 # TODO: Remove wildcard and replace with valid urls
 # after hosting
@@ -28,66 +47,354 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize the container pool
-container_pool = ContainerPool(pool_size=2, image=os.getenv("DOCKER_IMAGE", "glimpse"))
+# Initialize the container pool; see pool_from_env for configuration
+container_pool = pool_from_env()
+
+# Picks a backend per request for /run-code; see router_from_env for configuration
+router = router_from_env(container_pool)
+
+# Pool size and state are read when /metrics is scraped
+registry.add_collector(collect_metrics(container_pool))
+
+# Count responses by status for /metrics
+app.middleware("http")(count_responses)
+
+# Trace spans per request, when TRACE_EXPORT is set
+app.middleware("http")(trace_requests)
+
+# Queue for /jobs, served by worker.py processes
+job_queue = JobQueue()
 
-# Rate limiting
-limiter = Limiter(key_func=get_remote_address)
+# Longest a GET /jobs/{id} request may wait for its job to finish
+JOB_MAX_WAIT = 30
 
+# Bearer token for the /admin endpoints, which are disabled without one
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-@app.exception_handler(RateLimitExceeded)
-async def rate_limit_handler(request, exc):
-    return PlainTextResponse(str("Rate limit exceeded!"), status_code=429)
+# Longest profile /admin/profile takes
+PROFILE_MAX_SECONDS = 60
+
+# Result memoization (opt-in, enabled by setting RESULT_CACHE_TTL)
+result_cache = ResultCache()
+
+# Cost-weighted rate limiting and load shedding, shared by the API processes on this host
+admission = AdmissionController()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return PlainTextResponse(exc.reason, status_code=exc.status_code, headers=exc.headers)
 
 
 @app.on_event("startup")
 async def start_pool():
     # Start Container pool
     container_pool.warm_up()
-    pass
+    # Clear job directories left behind by a previous process
+    staging.purge(max_age=3600)
 
 
 @app.on_event("shutdown")
 async def clean_pool():
     # Clean out docker containers from container pool
     container_pool.shutdown_pool()
-    pass
+    # Stop the warm workers and JVM compile server, which would otherwise outlive us
+    stop_services()
 
 
 class CodeIn(BaseModel):
     language: str
     code: str
     input: str = None
+    cache: bool = True  # Set to false to bypass the result cache for non-deterministic programs
+
+
+class TestCaseIn(BaseModel):
+    input: str = None
+    expected_output: str = None
+
+
+class BatchIn(BaseModel):
+    language: str
+    code: str
+    cases: List[TestCaseIn]
+    timeout: float = Field(10, gt=0, le=30)  # Per case, in seconds
+
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "").encode()
+    if not hmac.compare_digest(supplied, f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def client_of(request: Request):
+    return request.client.host if request.client else "127.0.0.1"
+
+
+async def admitted(request: Request, language: str, run, runs: int = 1, saturated: bool = False):
+    """
+    Runs `run` once admission control lets the request in, learning the language's compile
+    and run costs from the result. Admission control writes to SQLite, so off the event loop.
+    """
+    ticket = await run_in_threadpool(admission.admit, client_of(request), language, runs, saturated)
+    usage = None
+    try:
+        result = await run()
+        usage = result.get("usage")
+        return result
+    finally:
+        await run_in_threadpool(admission.release, ticket, language, usage)
+
+
+async def memoized(backend: str, code_in: CodeIn, run):
+    """
+    Serves a run from the result cache when the request allows it, coalescing identical
+    in-flight submissions into a single execution.
+    """
+    if not code_in.cache:
+        return await run()
+    key = result_cache.make_key(backend, code_in.language, code_in.code, code_in.input)
+    return await result_cache.get_or_run(key, run)
 
 
 @app.post("/run-code-local")
-async def run_code_endpoint(code_in: CodeIn):
+async def run_code_endpoint(request: Request, code_in: CodeIn, sandbox: bool = None):
     """
     Makes a call to `run_code` with request parameters.
     Requires JWT Bearer Token Authentication (prevents against code being ran from non-authenticated client)
+    `?sandbox=true` runs the program in a process sandbox (default: LOCAL_SANDBOX).
     """
+    if sandbox is None:
+        sandbox = LOCAL_SANDBOX
     try:
-        result = await run_code(code_in.language, code_in.code, code_in.input)
+        result = await admitted(
+            request,
+            code_in.language,
+            lambda: memoized(
+                "sandbox" if sandbox else "local",
+                code_in,
+                lambda: run_code(code_in.language, code_in.code, code_in.input, sandbox=sandbox),
+            ),
+        )
+    except Overloaded:
+        raise
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     return result
 
 
 @app.post("/run-code-pool")
-@limiter.limit("30/minute")
 async def run_code_endpoint(request: Request, code_in: CodeIn):
     """
     Makes a call to `run_code` with request parameters, without authenticated protection.
+    Shed with a 503 and Retry-After while the language's pool has no container to give.
     """
     try:
-        result = await run_code_pool(
-            code_in.language, code_in.code, code_in.input, container_pool=container_pool
+        result = await admitted(
+            request,
+            code_in.language,
+            lambda: memoized(
+                "pool",
+                code_in,
+                lambda: run_code_pool(
+                    code_in.language,
+                    code_in.code,
+                    code_in.input,
+                    container_pool=container_pool,
+                ),
+            ),
+            saturated=container_pool.saturated(code_in.language),
         )
+    except (Overloaded, HTTPException):
+        raise  # Sheds and pool failures keep their status (503, 500)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     return result
 
 
+@app.post("/run-code")
+async def run_code_routed(request: Request, code_in: CodeIn):
+    """
+    Runs the code on whichever backend (ROUTER_BACKENDS) should finish it soonest given its
+    current load and recent latency for the language, spilling over to another backend
+    instead of failing when the container pool is exhausted. The result names the backend.
+    """
+    try:
+        result = await admitted(
+            request,
+            code_in.language,
+            lambda: memoized(
+                "routed",
+                code_in,
+                lambda: router.run(code_in.language, code_in.code, code_in.input),
+            ),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result
+
+
+@app.post("/run-batch")
+async def run_batch_endpoint(request: Request, batch_in: BatchIn, backend: str = "pool"):
+    """
+    Compiles the code once and runs it against every test case in parallel, on the
+    container pool (default), locally with `?backend=local` or in a process sandbox with
+    `?backend=sandbox`. Returns per-case output, verdict, exit code and timing.
+    """
+    if backend not in ("pool", "local", "sandbox"):
+        raise HTTPException(status_code=400, detail="backend must be 'pool', 'local' or 'sandbox'")
+    try:
+        result = await admitted(
+            request,
+            batch_in.language,
+            lambda: run_batch(
+                batch_in.language,
+                batch_in.code,
+                [case.dict() for case in batch_in.cases],
+                container_pool=container_pool if backend == "pool" else None,
+                timeout=batch_in.timeout,
+                sandbox=True if backend == "sandbox" else None,
+            ),
+            runs=max(len(batch_in.cases), 1),
+            saturated=backend == "pool" and container_pool.saturated(batch_in.language),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result
+
+
+@app.post("/run-code-stream")
+async def run_code_stream_endpoint(request: Request, code_in: CodeIn, backend: str = "pool"):
+    """
+    Streams program output as Server-Sent Events while it runs, on the container pool
+    (default), locally with `?backend=local` or in a process sandbox with `?backend=sandbox`.
+    Emits `stdout` / `stderr` events with
+    JSON-encoded text chunks, then a final `exit` (or `error`, on compile failure) event.
+    Each stream is capped at STREAM_MAX_OUTPUT_BYTES, after which the program is killed.
+    """
+    if backend not in ("pool", "local", "sandbox"):
+        raise HTTPException(status_code=400, detail="backend must be 'pool', 'local' or 'sandbox'")
+    try:
+        validate_submission(code_in.language, code_in.code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ticket = await run_in_threadpool(
+        admission.admit,
+        client_of(request),
+        code_in.language,
+        saturated=backend == "pool" and container_pool.saturated(code_in.language),
+    )
+
+    events = stream_code(
+        code_in.language,
+        code_in.code,
+        code_in.input,
+        container_pool=container_pool if backend == "pool" else None,
+        sandbox=True if backend == "sandbox" else None,
+    )
+
+    async def server_sent_events():
+        try:
+            async for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            await run_in_threadpool(admission.release, ticket)
+
+    return StreamingResponse(server_sent_events(), media_type="text/event-stream")
+
+
+@app.post("/jobs")
+async def submit_job(request: Request, code_in: CodeIn, backend: str = "local"):
+    """
+    Queues a submission for a worker (see worker.py) and returns its job id at once, to run
+    locally (default, what workers serve unless WORKER_BACKENDS says otherwise), on the
+    container pool with `?backend=pool` or in a process sandbox with `?backend=sandbox`.
+    """
+    if backend not in ("pool", "local", "sandbox"):
+        raise HTTPException(status_code=400, detail="backend must be 'pool', 'local' or 'sandbox'")
+    try:
+        validate_submission(code_in.language, code_in.code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Workers bound how much runs at once, so a queued job only draws on the client's budget
+    await run_in_threadpool(admission.admit, client_of(request), code_in.language, hold=False)
+    job_id = await run_in_threadpool(
+        job_queue.submit,
+        backend,
+        {"language": code_in.language, "code": code_in.code, "input": code_in.input},
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Returns a job's status, with its result or error once finished. With `?wait=N`, holds the
+    request for up to N seconds (at most JOB_MAX_WAIT) until the job finishes.
+    """
+    job = await job_queue.wait(job_id, min(max(wait, 0), JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/job-stats")
+async def job_stats():
+    return await run_in_threadpool(job_queue.stats)
+
+
+@app.get("/admission-stats")
+async def admission_stats():
+    return admission.stats()
+
+
+@app.get("/router-stats")
+async def router_stats():
+    return router.stats()
+
+
+@app.get("/pool-stats")
+async def pool_stats():
+    return container_pool.stats()
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return result_cache.stats()
+
+
+@app.post("/admin/profile")
+async def profile(request: Request, seconds: float = 10, interval: float = 0.005, format: str = "collapsed"):
+    """
+    Samples the stacks of every thread of this API process for `seconds` (at most
+    PROFILE_MAX_SECONDS) and returns the profile as collapsed stacks for flamegraph.pl or
+    speedscope, or with `?format=json` as the hottest functions. With several uvicorn
+    workers, profiles the one serving the request.
+    Requires `Authorization: Bearer <ADMIN_TOKEN>`.
+    """
+    require_admin(request)
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'json'")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(None, profiler.profile, seconds, max(interval, 0.001))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "json":
+        return summarize(result)
+    return PlainTextResponse(collapsed(result))
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root(request: Request):
     url_list = [
@@ -1,28 +1,25 @@
-import os
 import json
-import boto3
+
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from lambda_invoker import LambdaFunctionError, LambdaInvoker, LambdaThrottled
+from utils.admission import AdmissionController, Overloaded
+from utils.metrics import count_responses, observe_run, registry
+from utils.result_cache import ResultCache
+from utils.tracing import trace_requests
 
 # Load environment variables from .env
 load_dotenv()
 
 app = FastAPI()
 
-# Load Lambda function name from environment
-LAMBDA_FUNCTION_NAME = os.getenv("LAMBDA_FUNCTION_NAME")
-
-# Configure AWS Lambda client
-lambda_client = boto3.client(
-    "lambda", region_name="us-east-1"
-)  # Adjust region as needed
+# Async Lambda client; see LambdaInvoker.from_env for configuration
+lambda_invoker = LambdaInvoker.from_env()
 
 # CORS setup
 origins = ["*"]
@@ -34,58 +31,100 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Rate limiting setup
-limiter = Limiter(key_func=get_remote_address)
+# Count responses by status for /metrics
+app.middleware("http")(count_responses)
+
+# Trace spans per request, when TRACE_EXPORT is set
+app.middleware("http")(trace_requests)
+
+# Result memoization (opt-in, enabled by setting RESULT_CACHE_TTL)
+result_cache = ResultCache()
+
+# Cost-weighted rate limiting, shared by the API processes on this host
+admission = AdmissionController()
 
 
-@app.exception_handler(RateLimitExceeded)
-async def rate_limit_handler(request, exc):
-    return PlainTextResponse(str("Rate limit exceeded!"), status_code=429)
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return PlainTextResponse(exc.reason, status_code=exc.status_code, headers=exc.headers)
 
 
 class CodeIn(BaseModel):
     language: str
     code: str
     input: str = None
+    cache: bool = True  # Set to false to bypass the result cache for non-deterministic programs
 
 
 @app.post("/run-code-lambda")
-@limiter.limit("30/minute")
 async def run_code_lambda(request: Request, code_in: CodeIn):
     """
     Executes user-submitted code using AWS Lambda.
     """
+    # The work runs on Lambda, so only the client's budget applies, not this host's capacity
+    # Admission control writes to SQLite, so off the event loop
+    await run_in_threadpool(
+        admission.admit,
+        request.client.host if request.client else "127.0.0.1",
+        code_in.language,
+        hold=False,
+    )
     payload = {
         "language": code_in.language,
         "code": code_in.code,
         "input": code_in.input,
     }
 
+    async def invoke():
+        result = await lambda_invoker.invoke(payload)
+        if result.get("statusCode") == 200:
+            usage = json.loads(result["body"]).get("usage", {})
+            observe_run("lambda", code_in.language, usage)
+            await run_in_threadpool(admission.release, None, code_in.language, usage)
+        return result
+
     try:
-        # Check if LAMBDA_FUNCTION_NAME is set
-        if not LAMBDA_FUNCTION_NAME:
-            raise HTTPException(
-                status_code=500, detail="LAMBDA_FUNCTION_NAME is not set."
-            )
-
-        # Invoke the Lambda function
-        response = lambda_client.invoke(
-            FunctionName=LAMBDA_FUNCTION_NAME,
-            InvocationType="RequestResponse",
-            Payload=json.dumps(payload),
+        if not code_in.cache:
+            return await invoke()
+        key = result_cache.make_key(
+            "lambda", code_in.language, code_in.code, code_in.input
+        )
+        return await result_cache.get_or_run(
+            key, invoke, cacheable=lambda result: result.get("statusCode") == 200
         )
 
-        # Parse the Lambda response
-        response_payload = json.load(response["Payload"])
-        if response.get("FunctionError"):
-            raise HTTPException(status_code=500, detail=response_payload.get("error"))
-
-        return response_payload
-
+    except LambdaThrottled:
+        raise HTTPException(
+            status_code=429,
+            detail="Lambda is throttling requests, try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+    except LambdaFunctionError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/cache-stats")
+async def cache_stats():
+    return result_cache.stats()
+
+
+@app.get("/admission-stats")
+async def admission_stats():
+    return admission.stats()
+
+
+@app.get("/lambda-stats")
+async def lambda_stats():
+    return lambda_invoker.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root(request: Request):
     return {"message": "Welcome to the Glimpse API with Lambda integration!"}
@@ -0,0 +1,75 @@
+"""
+Compares two benchmark reports written by benchmarks/load.py.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.10
+
+Exits non-zero if any endpoint present in both reports lost more than `threshold` of its
+throughput, got that much slower at p50/p95/p99, or its error rate rose.
+"""
+
+import argparse
+import json
+import sys
+
+PERCENTILES = ("p50", "p95", "p99")
+
+
+def compare(baseline: dict, candidate: dict, threshold: float):
+    """
+    Returns (rows, regressions): a row per endpoint and metric, and the rows that regressed.
+    """
+    before = {result["endpoint"]: result for result in baseline["results"]}
+    rows = []
+    regressions = []
+    for result in candidate["results"]:
+        old = before.get(result["endpoint"])
+        if old is None:
+            continue
+        metrics = [("throughput", old["throughput"], result["throughput"], True)]
+        metrics += [
+            (name, old["latency"][name], result["latency"][name], False) for name in PERCENTILES
+        ]
+        metrics.append(("error_rate", old["error_rate"], result["error_rate"], False))
+        for name, old_value, new_value, higher_is_better in metrics:
+            if old_value is None or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            if name == "error_rate":
+                regressed = new_value > old_value
+            elif higher_is_better:
+                regressed = change < -threshold
+            else:
+                regressed = change > threshold
+            row = (result["endpoint"], name, old_value, new_value, change, regressed)
+            rows.append(row)
+            if regressed:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative change")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline["meta"]["config"] != candidate["meta"]["config"]:
+        print("warning: the reports were run with different configurations", file=sys.stderr)
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{'endpoint':<8} {'metric':<11} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for endpoint, name, old_value, new_value, change, regressed in rows:
+        print(
+            f"{endpoint:<8} {name:<11} {old_value:>10.4f} {new_value:>10.4f} {change:>+7.1%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
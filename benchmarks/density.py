@@ -0,0 +1,173 @@
+"""
+Execution density benchmark for the container pool.
+
+Runs the pool at increasing levels of concurrency, one warm container per concurrent
+execution, with the containers' resource profiles applied (see containers.RESOURCE_PROFILES),
+and reports throughput and latency at each level. The highest level whose p95 latency stays
+within --tolerance of the single-execution p95, without errors, is the number of concurrent
+executions per core the host can take with predictable latency; size POOL_MAX_SIZE from it.
+
+Needs a Docker daemon and the pool images. --fake runs containers as host processes
+(benchmarks/fakes.py) to check the harness, but enforces no limits, so its numbers say
+nothing about density.
+
+    python -m benchmarks.density --image glimpse-py --mix py=1 --levels 1,2,4,8,16 \\
+        --requests 100 --out density.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.load import PROGRAMS, git_revision, make_workload, parse_mix, summarize, wait_for_pool
+
+
+async def run_level(container_pool, workload, concurrency: int):
+    """
+    Runs `workload` on the pool from `concurrency` workers. Returns throughput, latency
+    percentiles and how many outputs were correct.
+    """
+    from glimpse import run_code_pool
+
+    pending = iter(workload)
+    latencies = []
+    ok = 0
+
+    async def worker():
+        nonlocal ok
+        for language, input, expected in pending:
+            started = time.perf_counter()
+            try:
+                result = await run_code_pool(language, PROGRAMS[language], input, container_pool)
+                ok += result["output"].strip() == str(expected)
+            except Exception:
+                pass
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "ok": ok,
+        "error_rate": 1 - ok / len(latencies) if latencies else 0,
+        "throughput": len(latencies) / duration if duration else None,
+        "latency": summarize(latencies),
+    }
+
+
+def max_density(levels, tolerance: float):
+    """
+    The highest concurrency whose p95 is within `tolerance` of the lowest level's, with
+    every output correct; None if not even the lowest level qualifies.
+    """
+    baseline = levels[0]["latency"]["p95"]
+    best = None
+    for level in levels:
+        if level["error_rate"] == 0 and level["latency"]["p95"] <= baseline * (1 + tolerance):
+            best = level["concurrency"]
+    return best
+
+
+async def benchmark(args):
+    from containers import ContainerPool, resource_profile
+
+    weights = parse_mix(args.mix)
+    cores = os.cpu_count() or 1
+    levels = [int(level) for level in args.levels.split(",")] if args.levels else [
+        2**i for i in range(8) if 2**i <= 4 * cores
+    ]
+    profile = None if args.no_limits else resource_profile(weights)
+    if args.fake:
+        from benchmarks import fakes
+
+        fakes.install()
+
+    results = []
+    for index, concurrency in enumerate(levels):
+        container_pool = ContainerPool(
+            pool_size=concurrency,
+            image=args.image,
+            max_size=concurrency,
+            recycle=args.recycle,
+            profile=profile,
+        )
+        container_pool.warm_up()
+        try:
+            await wait_for_pool(container_pool, timeout=120)
+            if args.warmup:
+                await run_level(
+                    container_pool, make_workload(weights, args.warmup, args.input_bytes, args.seed - 1), concurrency
+                )
+            result = await run_level(
+                container_pool, make_workload(weights, args.requests, args.input_bytes, args.seed + index), concurrency
+            )
+        finally:
+            container_pool.shutdown_pool()
+        result = {"concurrency": concurrency, "per_core": concurrency / cores, **result}
+        results.append(result)
+        latency = result["latency"]
+        print(
+            f"{concurrency:>4} concurrent ({result['per_core']:.2f}/core): "
+            f"{result['throughput']:.1f} runs/s, p50 {latency['p50'] * 1000:.1f} ms, "
+            f"p95 {latency['p95'] * 1000:.1f} ms, {result['ok']}/{result['requests']} ok",
+            file=sys.stderr,
+        )
+
+    best = max_density(results, args.tolerance)
+    if best is not None:
+        print(f"Max density within {args.tolerance:.0%} of baseline p95: {best / cores:.2f} per core", file=sys.stderr)
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "cpu_count": cores,
+            "target": "fake" if args.fake else "docker",
+            "config": {
+                "image": args.image,
+                "mix": weights,
+                "levels": levels,
+                "requests": args.requests,
+                "warmup": args.warmup,
+                "input_bytes": args.input_bytes,
+                "recycle": args.recycle,
+                "profile": profile,
+                "tolerance": args.tolerance,
+            },
+        },
+        "results": results,
+        "max_concurrency": best,
+        "max_per_core": best / cores if best is not None else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--image", default=os.getenv("DOCKER_IMAGE", "glimpse"))
+    parser.add_argument("--mix", default="py=1", help="Language weights, e.g. py=3,c=1")
+    parser.add_argument("--levels", help="Comma-separated concurrency levels (default: powers of 2 up to 4 per core)")
+    parser.add_argument("--requests", type=int, default=100, help="Measured runs per level")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured runs per level")
+    parser.add_argument("--input-bytes", type=int, default=64, help="Approximate stdin size per run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed p95 growth over the lowest level")
+    parser.add_argument("--recycle", action="store_true", help="Reset containers in place instead of replacing them")
+    parser.add_argument("--no-limits", action="store_true", help="Start containers without resource profiles, for comparison")
+    parser.add_argument("--fake", action="store_true", help="Use fake containers (checks the harness only)")
+    parser.add_argument("--out", help="Write results as JSON to this file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(benchmark(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import io
+import os
+import shlex
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+import docker
+
+from containers import RESET_SCRIPT
+
+
+class FakeDockerClient:
+    """
+    Stand-in for `docker.from_env()` that runs "containers" as host processes, so the pool
+    backend can be benchmarked without a Docker daemon.
+
+    Each container is a private directory on the host; paths under /tmp in its commands are
+    rewritten into that directory. `start_delay` and `exec_delay` add the latency of starting
+    a container and of an exec round trip, which the host processes don't have.
+    """
+
+    def __init__(self, start_delay: float = 0.0, exec_delay: float = 0.0):
+        self.start_delay = start_delay
+        self.exec_delay = exec_delay
+        self.api = FakeAPI(self)
+        self.containers = FakeContainers(self)
+        self.images = FakeImages()
+        self._containers = {}
+
+
+def install(start_delay: float = 0.0, exec_delay: float = 0.0):
+    """
+    Makes every subsequent `docker.from_env()` return a FakeDockerClient.
+    """
+    docker.from_env = lambda **kwargs: FakeDockerClient(start_delay, exec_delay)
+
+
+class FakeImages:
+    def get(self, image):
+        return _Image(f"sha256:fake-{image}")
+
+
+class _Image:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeContainers:
+    def __init__(self, client):
+        self.client = client
+
+    def run(self, image, detach=True, **kwargs):
+        time.sleep(self.client.start_delay)
+        container = FakeContainer(self.client, image)
+        self.client._containers[container.id] = container
+        return container
+
+
+class ExecResult:
+    def __init__(self, exit_code, output):
+        self.exit_code = exit_code
+        self.output = output
+
+
+class FakeContainer:
+    def __init__(self, client, image):
+        self.client = client
+        self.image = image
+        self.id = uuid4().hex
+        self.root = tempfile.mkdtemp(prefix="glimpse-fake-")
+        os.mkdir(os.path.join(self.root, "tmp"))
+        self.status = "running"
+        self.processes = set()
+
+    def exec_run(self, cmd, **kwargs):
+        if cmd == ["sh", "-c", RESET_SCRIPT]:
+            # The real script kills every process it can see, which on the host is everything
+            return ExecResult(0 if self._reset() else 1, b"")
+        exec_id = self.client.api.exec_create(self.id, cmd)
+        output = self.client.api.exec_start(exec_id)
+        return ExecResult(self.client.api.exec_inspect(exec_id)["ExitCode"], output)
+
+    def put_archive(self, path, data):
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            tar.extractall(self._host_path(path))
+        return True
+
+    def get_archive(self, path):
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as tar:
+            tar.add(self._host_path(path), arcname=os.path.basename(path))
+        return iter([stream.getvalue()]), {}
+
+    def diff(self):
+        return []
+
+    def reload(self):
+        pass
+
+    def kill(self):
+        self._kill_processes()
+        self.status = "exited"
+
+    def remove(self, **kwargs):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _reset(self):
+        self._kill_processes()
+        tmp = os.path.join(self.root, "tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.mkdir(tmp)
+        return True
+
+    def _kill_processes(self):
+        for process in list(self.processes):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _host_path(self, path):
+        return self.root + path if path.startswith("/tmp") else path
+
+    def _argv(self, cmd):
+        if isinstance(cmd, str):
+            cmd = shlex.split(cmd)
+        return [self._host_path(arg) for arg in cmd]
+
+
+class FakeAPI:
+    """
+    The low-level exec API used by glimpse. Socket-mode execs return a socket carrying
+    Docker's multiplexed stdout/stderr frames, like the daemon's attach stream.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._execs = {}
+
+    def exec_create(self, container_id, cmd, stdin=False, **kwargs):
+        exec_id = uuid4().hex
+        self._execs[exec_id] = {
+            "container": self.client._containers[container_id],
+            "cmd": cmd,
+            "exit_code": None,
+        }
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id, socket=False, demux=False, **kwargs):
+        time.sleep(self.client.exec_delay)
+        job = self._execs[_exec_key(exec_id)]
+        container = job["container"]
+        if socket:
+            return self._attach(job, container)
+        stderr = subprocess.PIPE if demux else subprocess.STDOUT
+        process = self._spawn(container, job["cmd"], stdin=subprocess.DEVNULL, stderr=stderr)
+        stdout, stderr = process.communicate()
+        job["exit_code"] = self._reap(container, process)
+        # Like docker-py, demuxed output has None for a stream that wrote nothing
+        return (stdout or None, stderr or None) if demux else stdout
+
+    def exec_inspect(self, exec_id):
+        return {"ExitCode": self._execs[_exec_key(exec_id)]["exit_code"], "Pid": 0}
+
+    def _spawn(self, container, cmd, stdin, stderr):
+        process = subprocess.Popen(
+            container._argv(cmd),
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            start_new_session=True,
+        )
+        container.processes.add(process)
+        return process
+
+    def _reap(self, container, process):
+        exit_code = process.wait()
+        container.processes.discard(process)
+        # Docker reports a signalled exec as 128 + the signal, like a shell
+        return 128 - exit_code if exit_code < 0 else exit_code
+
+    def _attach(self, job, container):
+        ours, theirs = socket.socketpair()
+        process = self._spawn(container, job["cmd"], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        lock = threading.Lock()
+
+        def feed():
+            while True:
+                data = theirs.recv(65536)
+                if not data:
+                    break
+                try:
+                    process.stdin.write(data)
+                    process.stdin.flush()
+                except OSError:
+                    break
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+        def pump(stream, stream_id):
+            while True:
+                data = os.read(stream.fileno(), 65536)
+                if not data:
+                    return
+                with lock:
+                    try:
+                        theirs.sendall(struct.pack(">BxxxL", stream_id, len(data)) + data)
+                    except OSError:
+                        return
+
+        pumps = [
+            threading.Thread(target=pump, args=(process.stdout, 1), daemon=True),
+            threading.Thread(target=pump, args=(process.stderr, 2), daemon=True),
+        ]
+        threading.Thread(target=feed, daemon=True).start()
+        for thread in pumps:
+            thread.start()
+
+        def finish():
+            for thread in pumps:
+                thread.join()
+            job["exit_code"] = self._reap(container, process)
+            try:
+                theirs.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+        threading.Thread(target=finish, daemon=True).start()
+        return socket.SocketIO(ours, "rwb")
+
+
+def _exec_key(exec_id):
+    return exec_id["Id"] if isinstance(exec_id, dict) else exec_id
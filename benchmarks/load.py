@@ -0,0 +1,439 @@
+"""
+Load and latency benchmark for the code execution endpoints.
+
+Drives /run-code-local, /run-code-pool and /run-code-lambda with a mix of languages, a
+fixed concurrency and a chosen input size, and writes throughput and latency percentiles
+as JSON (see benchmarks/compare.py to diff two runs).
+
+By default the APIs run in-process: the pool talks to a fake Docker client that runs
+containers as host processes (benchmarks/fakes.py), and the Lambda API calls
+`lambda_handler` in-process (LAMBDA_TRANSPORT=local), so no daemon or AWS account is
+needed. Pass --url to benchmark a running server instead.
+
+    python -m benchmarks.load --endpoints local,pool --mix py=3,c=1 --concurrency 8 \\
+        --requests 200 --out bench.json
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Endpoint name -> (API module, path)
+ENDPOINTS = {
+    "local": ("api-docker", "/run-code-local"),
+    "pool": ("api-docker", "/run-code-pool"),
+    "sandbox": ("api-docker", "/run-code-local?sandbox=true"),
+    "lambda": ("api-lambda", "/run-code-lambda"),
+    "routed": ("api-docker", "/run-code"),
+}
+
+# Every program prints the sum of the integers on its stdin, so results can be checked
+PROGRAMS = {
+    "py": "import sys\nprint(sum(map(int, sys.stdin.read().split())))\n",
+    "js": (
+        'const data = require("fs").readFileSync(0, "utf8");\n'
+        "console.log(data.split(/\\s+/).filter(Boolean).reduce((a, b) => a + Number(b), 0));\n"
+    ),
+    "c": (
+        "#include <stdio.h>\n"
+        "int main(void) {\n"
+        "    long long x, sum = 0;\n"
+        '    while (scanf("%lld", &x) == 1) sum += x;\n'
+        '    printf("%lld\\n", sum);\n'
+        "    return 0;\n"
+        "}\n"
+    ),
+    "cpp": (
+        "#include <iostream>\n"
+        "int main() {\n"
+        "    long long x, sum = 0;\n"
+        "    while (std::cin >> x) sum += x;\n"
+        "    std::cout << sum << std::endl;\n"
+        "}\n"
+    ),
+    "go": (
+        "package main\n\n"
+        'import (\n\t"bufio"\n\t"fmt"\n\t"os"\n\t"strconv"\n)\n\n'
+        "func main() {\n"
+        "\tscanner := bufio.NewScanner(os.Stdin)\n"
+        "\tscanner.Buffer(make([]byte, 1<<20), 1<<20)\n"
+        "\tscanner.Split(bufio.ScanWords)\n"
+        "\tvar sum int64\n"
+        "\tfor scanner.Scan() {\n"
+        "\t\tx, _ := strconv.ParseInt(scanner.Text(), 10, 64)\n"
+        "\t\tsum += x\n"
+        "\t}\n"
+        "\tfmt.Println(sum)\n"
+        "}\n"
+    ),
+    "java": (
+        "import java.io.*;\n\n"
+        "public class Main {\n"
+        "    public static void main(String[] args) throws IOException {\n"
+        "        StreamTokenizer in = new StreamTokenizer(new BufferedReader(new InputStreamReader(System.in)));\n"
+        "        long sum = 0;\n"
+        "        while (in.nextToken() != StreamTokenizer.TT_EOF) sum += (long) in.nval;\n"
+        "        System.out.println(sum);\n"
+        "    }\n"
+        "}\n"
+    ),
+}
+
+
+def parse_mix(mix: str):
+    """
+    Parses a language mix like "py=3,c=1" into {language: weight}.
+    """
+    weights = {}
+    for part in mix.split(","):
+        language, _, weight = part.strip().partition("=")
+        if language not in PROGRAMS:
+            raise ValueError(f"No benchmark program for {language!r}; choose from {sorted(PROGRAMS)}")
+        weights[language] = float(weight or 1)
+    return weights
+
+
+def make_workload(weights: dict, count: int, input_bytes: int, seed: int):
+    """
+    Returns `count` requests as (language, input, expected_sum) tuples, the same for a
+    given seed.
+    """
+    rng = random.Random(seed)
+    languages = list(weights)
+    workload = []
+    for language in rng.choices(languages, [weights[lang] for lang in languages], k=count):
+        numbers = []
+        size = 0
+        while size < input_bytes:
+            numbers.append(rng.randrange(1000))
+            size += len(str(numbers[-1])) + 1
+        lines = [" ".join(map(str, numbers[i : i + 20])) for i in range(0, len(numbers), 20)]
+        workload.append((language, "\n".join(lines) if numbers else None, sum(numbers)))
+    return workload
+
+
+def percentile(sorted_values, fraction: float):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1],
+    }
+
+
+class AsgiClient:
+    """
+    Sends requests straight to an ASGI app, without a server or sockets in between.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def post(self, path: str, payload: dict):
+        body = json.dumps(payload).encode()
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [
+                (b"host", b"benchmark"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        done = asyncio.Event()
+        request_sent = False
+        status = None
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    done.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            done.set()
+        return status, b"".join(chunks)
+
+
+class HttpClient:
+    """
+    Sends requests to a running server, one blocking call per worker thread.
+    """
+
+    def __init__(self, url: str, concurrency: int):
+        self.url = url.rstrip("/")
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def post(self, path: str, payload: dict):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._post, path, payload)
+
+    def _post(self, path: str, payload: dict):
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def outcome(endpoint: str, status: int, body: bytes, expected: int):
+    """
+    Classifies a response as "ok", "wrong_output" or "http_<status>".
+    """
+    if status != 200:
+        return f"http_{status}"
+    try:
+        result = json.loads(body)
+        if endpoint == "lambda":
+            if result.get("statusCode") != 200:
+                return f"lambda_{result.get('statusCode')}"
+            result = json.loads(result["body"])
+        output = result.get("output", "").strip()
+    except (ValueError, AttributeError, KeyError):
+        return "bad_response"
+    return "ok" if output == str(expected) else "wrong_output"
+
+
+async def run_endpoint(client, endpoint: str, workload, concurrency: int):
+    """
+    Sends every request in `workload` to one endpoint from `concurrency` workers and
+    returns throughput, latency percentiles and outcome counts.
+    """
+    path = ENDPOINTS[endpoint][1]
+    pending = iter(workload)
+    latencies = []
+    by_language = {}
+    outcomes = Counter()
+
+    async def worker():
+        for language, input, expected in pending:
+            payload = {"language": language, "code": PROGRAMS[language], "input": input, "cache": False}
+            started = time.perf_counter()
+            try:
+                status, body = await client.post(path, payload)
+                result = outcome(endpoint, status, body, expected)
+            except Exception as e:
+                result = f"exception_{type(e).__name__}"
+            elapsed = time.perf_counter() - started
+            latencies.append(elapsed)
+            by_language.setdefault(language, []).append(elapsed)
+            outcomes[result] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    return {
+        "endpoint": endpoint,
+        "path": path,
+        "requests": len(latencies),
+        "ok": outcomes["ok"],
+        "error_rate": 1 - outcomes["ok"] / len(latencies) if latencies else 0,
+        "outcomes": dict(outcomes),
+        "duration": duration,
+        "throughput": len(latencies) / duration if duration else None,
+        "latency": summarize(latencies),
+        "by_language": {
+            language: {"requests": len(values), **summarize(values)}
+            for language, values in sorted(by_language.items())
+        },
+    }
+
+
+def load_api(name: str):
+    """
+    Imports one of the API modules (their file names aren't valid module names) with
+    admission control turned off, so it doesn't throttle or shed the benchmark.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, ROOT / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    module.admission.enabled = False
+    return module
+
+
+async def wait_for_pool(container_pool, timeout: float = 60):
+    # Measure a warm pool, not one still starting its first containers
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(pool.stats()["idle"] >= pool.min_size for pool in container_pool.all_pools()):
+            return
+        await asyncio.sleep(0.05)
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args):
+    weights = parse_mix(args.mix)
+    endpoints = [name.strip() for name in args.endpoints.split(",")]
+    for name in endpoints:
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r}; choose from {sorted(ENDPOINTS)}")
+
+    apps = {}
+    if not args.url:
+        os.environ.setdefault("LAMBDA_TRANSPORT", "local")
+        os.environ.setdefault("POOL_MIN_SIZE", str(args.pool_size))
+        os.environ.setdefault("POOL_MAX_SIZE", str(max(args.pool_size, args.concurrency)))
+        from benchmarks import fakes
+
+        fakes.install(start_delay=args.fake_start_delay, exec_delay=args.fake_exec_delay)
+        for name in endpoints:
+            module_name = ENDPOINTS[name][0]
+            if module_name not in apps:
+                module = load_api(module_name)
+                await module.app.router.startup()
+                if hasattr(module, "container_pool"):
+                    await wait_for_pool(module.container_pool)
+                apps[module_name] = module.app
+
+    results = []
+    try:
+        for index, name in enumerate(endpoints):
+            if args.url:
+                client = HttpClient(args.url, args.concurrency)
+            else:
+                client = AsgiClient(apps[ENDPOINTS[name][0]])
+            seed = args.seed + index
+            if args.warmup:
+                await run_endpoint(
+                    client, name, make_workload(weights, args.warmup, args.input_bytes, seed - 1), args.concurrency
+                )
+            result = await run_endpoint(
+                client, name, make_workload(weights, args.requests, args.input_bytes, seed), args.concurrency
+            )
+            results.append(result)
+            latency = result["latency"]
+            print(
+                f"{name:>7}: {result['throughput']:.1f} req/s, "
+                f"p50 {latency['p50'] * 1000:.1f} ms, p95 {latency['p95'] * 1000:.1f} ms, "
+                f"p99 {latency['p99'] * 1000:.1f} ms, {result['ok']}/{result['requests']} ok",
+                file=sys.stderr,
+            )
+    finally:
+        for app in apps.values():
+            await app.router.shutdown()
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": args.url or "in-process",
+            "config": {
+                "endpoints": endpoints,
+                "mix": weights,
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "warmup": args.warmup,
+                "input_bytes": args.input_bytes,
+                "seed": args.seed,
+                "pool_size": args.pool_size,
+                "fake_start_delay": args.fake_start_delay,
+                "fake_exec_delay": args.fake_exec_delay,
+            },
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--endpoints", default="local,pool,lambda", help="Comma-separated: local, pool, lambda, routed")
+    parser.add_argument("--mix", default="py=1", help="Language weights, e.g. py=3,js=1,c=1")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests sent first")
+    parser.add_argument("--input-bytes", type=int, default=64, help="Approximate stdin size per request")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=4, help="Warm containers for the in-process pool")
+    parser.add_argument("--fake-start-delay", type=float, default=0.0, help="Simulated container start time")
+    parser.add_argument("--fake-exec-delay", type=float, default=0.0, help="Simulated docker exec round trip")
+    parser.add_argument("--url", help="Benchmark a running server instead, e.g. http://localhost:8000")
+    parser.add_argument("--out", help="Write results as JSON to this file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(benchmark(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,293 @@
+import asyncio
+import contextvars
 import docker
-from queue import Queue
+import functools
+from queue import Empty, Queue
 from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import os
+import threading
 import time
+from collections import Counter
+from docker.types import DriverConfig, Mount
 from fastapi import HTTPException
+from utils.instructions import supported_languages
+from utils.metrics import registry
+from utils.tracing import tracer
+
+CONTAINER_WAIT = registry.histogram(
+    "glimpse_container_wait_seconds", "Time spent waiting for a pooled container", ["image"]
+)
+CONTAINER_CREATE = registry.histogram(
+    "glimpse_container_create_seconds", "Time to start a new pool container", ["image"]
+)
+POOL_CONTAINERS = registry.gauge(
+    "glimpse_pool_containers", "Pool containers by state", ["image", "state"]
+)
+POOL_WAITING = registry.gauge(
+    "glimpse_pool_waiting", "Requests waiting for a container", ["image"]
+)
+
+# Kills every process but the container's init and wipes /tmp, retrying briefly while killed
+# processes exit. Zombies are ignored since only init can reap them. Exits non-zero if
+# anything survived, in which case the container is considered dirty.
+RESET_SCRIPT = """
+for attempt in 1 2 3 4 5; do
+  busy=0
+  for p in /proc/[0-9]*; do
+    pid=${p#/proc/}
+    [ "$pid" = 1 ] || [ "$pid" = $$ ] && continue
+    read -r _ _ state _ 2>/dev/null < "$p/stat" || continue
+    [ "$state" = Z ] && continue
+    busy=1
+    kill -9 "$pid" 2>/dev/null
+  done
+  [ "$busy" = 0 ] && break
+  sleep 0.02
+done
+rm -rf /tmp/* /tmp/.[!.]* /tmp/..?* 2>/dev/null
+[ "$busy" = 0 ] && [ -z "$(ls -A /tmp)" ]
+"""
+
+# Resource limits of pool containers by language: CPUs, memory in MB (swap included, so no
+# swap), processes, and MB of the tmpfs mounted on /tmp. The rest of the filesystem is
+# read-only unless noted.
+RESOURCE_PROFILES = {
+    "py": {"cpus": 0.5, "memory": 256, "pids": 64, "tmp": 64, "read_only": True},
+    "js": {"cpus": 0.5, "memory": 256, "pids": 64, "tmp": 64, "read_only": True},
+    "c": {"cpus": 1.0, "memory": 256, "pids": 64, "tmp": 128, "read_only": True},
+    "cpp": {"cpus": 1.0, "memory": 512, "pids": 64, "tmp": 128, "read_only": True},
+    # `go build` writes the submission's packages into the image's build cache
+    "go": {"cpus": 1.0, "memory": 512, "pids": 128, "tmp": 128, "read_only": False},
+    # The JVM runs GC and JIT threads alongside the program
+    "java": {"cpus": 1.0, "memory": 768, "pids": 256, "tmp": 128, "read_only": True},
+}
+
+
+def resource_profile(languages):
+    """
+    Limits for containers serving `languages`: the most generous of their profiles, after
+    applying the overrides in POOL_RESOURCE_PROFILES (JSON, e.g. {"py": {"memory": 512}}).
+    """
+    overrides = json.loads(os.getenv("POOL_RESOURCE_PROFILES", "{}"))
+    # Languages without a profile of their own get the most generous one
+    profiles = [
+        {**RESOURCE_PROFILES.get(language, RESOURCE_PROFILES["java"]), **overrides.get(language, {})}
+        for language in languages
+    ]
+    return {
+        "cpus": max(profile["cpus"] for profile in profiles),
+        "memory": max(profile["memory"] for profile in profiles),
+        "pids": max(profile["pids"] for profile in profiles),
+        "tmp": max(profile["tmp"] for profile in profiles),
+        "read_only": all(profile["read_only"] for profile in profiles),
+    }
+
+
+def container_options(profile):
+    """
+    `containers.run` arguments enforcing a resource profile, with networking disabled.
+    """
+    return {
+        "nano_cpus": int(profile["cpus"] * 1e9),
+        "cpu_shares": int(profile["cpus"] * 1024),
+        "mem_limit": f"{profile['memory']}m",
+        "memswap_limit": f"{profile['memory']}m",
+        "pids_limit": profile["pids"],
+        "network_disabled": True,
+        "read_only": profile["read_only"],
+        # A tmpfs-backed anonymous volume rather than a plain tmpfs mount, which the archive
+        # API used to copy submissions in can't write to. Removed with the container.
+        "mounts": [
+            Mount(
+                "/tmp",
+                None,
+                type="volume",
+                driver_config=DriverConfig(
+                    "local",
+                    {"type": "tmpfs", "device": "tmpfs", "o": f"size={profile['tmp']}m,mode=1777"},
+                ),
+            )
+        ],
+    }
 
 
 class ContainerPool:
-    def __init__(self, pool_size, image):
+    def __init__(
+        self,
+        pool_size,
+        image,
+        recycle=False,
+        max_uses=50,
+        max_size=None,
+        scale_interval=1.0,
+        target_wait=0.1,
+        idle_timeout=60,
+        profile=None,
+        max_threads=None,
+    ):
+        """
+        Args:
+            pool_size (int): Minimum number of warm containers to keep available.
+            image (str): Docker image the containers are started from.
+            recycle (bool): Reset used containers in place instead of replacing them.
+            max_uses (int): Number of runs a recycled container serves before being replaced.
+            max_size (int): Upper bound the pool may grow to under load. Defaults to `pool_size`.
+            scale_interval (float): Seconds between autoscaler checks.
+            target_wait (float): Average acquire wait (seconds) above which the pool grows.
+            idle_timeout (float): Seconds without contention before idle containers are retired.
+            profile (dict): Resource limits of the containers (see `resource_profile`), or
+                None for none.
+            max_threads (int): Largest `max_size` the pool may be given later (e.g. by
+                `LanguagePools.rebalance`), which sizes its thread pools. Defaults to `max_size`.
+        """
         self.client = docker.from_env()
-        self.pool_size = pool_size
+        self.min_size = pool_size
+        self.max_size = max(max_size or pool_size, pool_size)
         self.image = image
-        self.pool = Queue(maxsize=pool_size)
-        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.recycle = recycle
+        self.max_uses = max_uses
+        self.scale_interval = scale_interval
+        self.target_wait = target_wait
+        self.idle_timeout = idle_timeout
+        self.profile = profile
+        self.run_options = container_options(profile) if profile else {}
+        self.pool = Queue()  # Unbounded; the pool size is governed by the autoscaler
+        threads = max(max_threads or 0, self.max_size)
+        self.executor = ThreadPoolExecutor(max_workers=max(threads, 8))
+        # Bounded set of threads for blocking Docker calls made on behalf of async callers
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=max(threads * 2, 8), thread_name_prefix="docker-io"
+        )
+        # Async waiters queue on this lock in FIFO order, so containers are handed out fairly
+        self._acquire_lock = asyncio.Lock()
         self.logger = logging.getLogger(__name__)
+        self._image_id = None
+        self._uses = {}
+
+        # Autoscaling state. `_size` counts live containers plus those being created.
+        self._size_lock = threading.Lock()
+        self._size = 0
+        self._creating = 0
+        self._waiting = 0
+        self._wait_ewma = 0.0
+        self._last_busy = time.monotonic()
+        self._stop = threading.Event()
+        self._scaler = None
+
+    def pool_for(self, language):
+        # A single pool serves every language
+        return self
+
+    def all_pools(self):
+        return [self]
+
+    def stats_for(self, language):
+        return self.stats()
+
+    def saturated(self, language=None):
+        # Saturated once more requests are waiting than there are idle, starting and
+        # still-to-be-started containers for them. Until then a new request gets one of those,
+        # or waits in `acquire` for a busy container to come back.
+        stats = self.stats()
+        free = stats["idle"] + stats["creating"] + max(stats["max_size"] - stats["size"], 0)
+        return stats["waiting"] > free
+
+    @property
+    def image_id(self):
+        # Content hash of the pool image, identifying the toolchain baked into it
+        if self._image_id is None:
+            try:
+                self._image_id = self.client.images.get(self.image).id
+            except Exception as e:
+                self.logger.error(f"Failed to inspect image {self.image}: {e}")
+                return self.image
+        return self._image_id
 
     def warm_up(self):
-        # Warm up the pool with running containers
-        if self.pool.qsize() == self.pool_size:
-            return
-        for _ in range(self.pool_size):
+        # Warm up the pool with running containers and start the autoscaler
+        self._grow(self.min_size - self._size)
+        if self._scaler is None:
+            self._scaler = threading.Thread(
+                target=self._autoscale, name=f"autoscale-{self.image}", daemon=True
+            )
+            self._scaler.start()
+
+    def stats(self):
+        idle = self.pool.qsize()
+        return {
+            "image": self.image,
+            "size": self._size,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "idle": idle,
+            "creating": self._creating,
+            "busy": max(self._size - idle - self._creating, 0),
+            "waiting": self._waiting,
+            "wait_ewma": self._wait_ewma,
+        }
+
+    def _grow(self, count):
+        # Start up to `count` new containers without exceeding max_size
+        with self._size_lock:
+            count = min(count, self.max_size - self._size)
+            if count <= 0:
+                return
+            self._size += count
+            self._creating += count
+        for _ in range(count):
             self.executor.submit(self._create_container)
 
+    def _retire(self):
+        # Remove one idle container to shrink the pool
+        try:
+            container = self.pool.get_nowait()
+        except Empty:
+            return
+        with self._size_lock:
+            self._size -= 1
+        self._uses.pop(container.id, None)
+        self.logger.info(f"Retiring idle container: {container.id}")
+        try:
+            container.kill()
+            container.remove(v=True)
+        except Exception as e:
+            self.logger.error(f"Failed to stop/remove container: {container.id}: {e}")
+
+    def _autoscale(self):
+        # Grow on backlog or slow acquisitions, shrink after a quiet period or when over budget
+        while not self._stop.wait(self.scale_interval):
+            idle = self.pool.qsize()
+            backlog = self._waiting - self._creating
+            now = time.monotonic()
+            if self._waiting or idle == 0:
+                self._last_busy = now
+
+            if backlog > 0 or (idle == 0 and self._wait_ewma > self.target_wait):
+                self._grow(max(backlog, 1))
+            elif idle and self._size > self.max_size:
+                self._retire()
+            elif (
+                idle
+                and self._size > self.min_size
+                and now - self._last_busy > self.idle_timeout
+            ):
+                self._retire()
+
+            if not self._waiting:
+                # Let the average decay while nobody is waiting
+                self._wait_ewma *= 0.5
+
     def _create_container(self):
         # Pull the Docker image and start a new container
         try:
-            container = self.client.containers.run(self.image, detach=True)
+            started = time.monotonic()
+            with tracer.span("pool.create_container", image=self.image):
+                container = self.client.containers.run(self.image, detach=True, **self.run_options)
+            CONTAINER_CREATE.observe(time.monotonic() - started, image=self.image)
+            with self._size_lock:
+                self._creating -= 1
             self.pool.put(container)
             self.logger.info(f"Created new container: {container.id}")
         except Exception as e:
@@ -33,28 +295,306 @@ class ContainerPool:
             time.sleep(1)  # wait for a while before retrying
             self._create_container()
 
-    def get_container(self):
+    def get_container(self, timeout=5):
         # Try to get a container from the pool
         try:
-            return self.pool.get(block=True, timeout=5)  # wait for 5 seconds
-        except Exception as e:
-            self.logger.error(f"Failed to get container from the pool: {e}")
+            return self.pool.get(block=True, timeout=timeout)
+        except Empty as e:
+            self.logger.error(f"Failed to get container from the pool: {e!r}")
             raise HTTPException(status_code=503, detail="Service unavailable")
 
+    def _get_container_by(self, deadline):
+        # Like get_container, but counts the time the call queued for a thread against it
+        return self.get_container(max(0, deadline - time.monotonic()))
+
+    async def acquire(self, timeout=5):
+        with tracer.span("pool.acquire", image=self.image, idle=self.pool.qsize()):
+            return await self._acquire(timeout)
+
+    async def _acquire(self, timeout):
+        # Await a container without blocking the event loop. Only the waiter at the head of
+        # the queue holds a thread; the rest wait on the lock in arrival order.
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + timeout
+        self._waiting += 1
+        if self.pool.empty() and self._waiting > self._creating:
+            # React to a burst right away instead of waiting for the next autoscaler tick
+            self._grow(1)
+        try:
+            try:
+                await asyncio.wait_for(self._acquire_lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.logger.error("Timed out waiting in line for a container")
+                raise HTTPException(status_code=503, detail="Service unavailable")
+
+            try:
+                remaining = max(0, deadline - loop.time())
+                future = loop.run_in_executor(
+                    self.io_executor, self._get_container_by, time.monotonic() + remaining
+                )
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), remaining)
+                except asyncio.TimeoutError:
+                    # Still queued for a thread at the deadline; whatever it gets goes back
+                    future.add_done_callback(self._return_unclaimed)
+                    self.logger.error("Timed out waiting for a container")
+                    raise HTTPException(status_code=503, detail="Service unavailable")
+                except asyncio.CancelledError:
+                    # The caller went away; don't leak the container it was about to receive
+                    future.add_done_callback(self._return_unclaimed)
+                    raise
+            finally:
+                self._acquire_lock.release()
+        finally:
+            self._waiting -= 1
+            waited = loop.time() - started
+            self._wait_ewma = 0.8 * self._wait_ewma + 0.2 * waited
+            CONTAINER_WAIT.observe(waited, image=self.image)
+
+    def _return_unclaimed(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.pool.put(future.result())
+
+    async def run_io(self, fn, *args, **kwargs):
+        # Run a blocking Docker call on the I/O executor and await its result, in the
+        # caller's context so its trace spans nest under the caller's
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.io_executor, functools.partial(context.run, fn, *args, **kwargs)
+        )
+
+    def release_container(self, container):
+        # Hand a used container back, recycling it in place when enabled. Never blocks.
+        context = contextvars.copy_context()
+        if not self.recycle:
+            self.executor.submit(context.run, self.replace_container, container)
+            return
+        self.executor.submit(context.run, self._recycle_container, container)
+
+    def _recycle_container(self, container):
+        with tracer.span("pool.recycle", image=self.image, container=container.id[:12]):
+            self._recycle(container)
+
+    def _recycle(self, container):
+        uses = self._uses.pop(container.id, 0) + 1
+        if self._size > self.max_size:
+            self.replace_container(container)  # Shrinks the pool instead of replacing
+            return
+        if uses >= self.max_uses:
+            self.logger.info(f"Container {container.id} reached {uses} uses, replacing")
+            self.replace_container(container)
+            return
+        if not self._reset_container(container):
+            self.logger.warning(f"Container {container.id} is dirty, replacing")
+            self.replace_container(container)
+            return
+        self._uses[container.id] = uses
+        self.pool.put(container)
+
+    def _reset_container(self, container):
+        # Returns True if the container is clean and healthy enough to be reused
+        with tracer.span("pool.reset"):
+            return self._reset(container)
+
+    def _reset(self, container):
+        try:
+            result = container.exec_run(["sh", "-c", RESET_SCRIPT])
+            if result.exit_code != 0:
+                return False
+            # Anything written outside of /tmp survives a reset, so treat it as dirty
+            for change in container.diff() or []:
+                path = change["Path"]
+                if path != "/tmp" and not path.startswith("/tmp/"):
+                    return False
+            container.reload()
+            return container.status == "running"
+        except Exception as e:
+            self.logger.error(f"Failed to reset container {container.id}: {e}")
+            return False
+
     def replace_container(self, container):
+        with tracer.span("pool.replace", image=self.image, container=container.id[:12]):
+            self._replace(container)
+
+    def _replace(self, container):
         # Stop and remove the used container
         try:
             print("Removing container...")
             container.kill()
-            container.remove()
+            container.remove(v=True)
             self.logger.info(f"Removed used container: {container.id}")
         except Exception as e:
             self.logger.error(f"Failed to stop/remove container: {container.id}: {e}")
-        # Create a new container to replace the used one
+        # Create a new container to replace the used one, unless the pool is over budget
+        with self._size_lock:
+            if self._size > self.max_size:
+                self._size -= 1
+                return
+            self._creating += 1
         self.executor.submit(self._create_container)
 
     def shutdown_pool(self):
+        self._stop.set()
         while not self.pool.empty():
             container = self.pool.get()
             container.kill()
-            container.remove()
+            container.remove(v=True)
+
+
+class LanguagePools:
+    """
+    Routes each language to its own ContainerPool, so that e.g. Python-only traffic runs on a
+    slim Python image instead of the full multi-language one. Languages sharing an image share
+    a pool, and anything without a dedicated image falls back to the default pool.
+
+    The combined `max_total` budget is periodically split between the pools in proportion to
+    the traffic mix observed since the last rebalance, so busy languages may grow further.
+    """
+
+    def __init__(
+        self,
+        default_image,
+        images,
+        min_size=1,
+        max_total=8,
+        rebalance_every=100,
+        limit_resources=False,
+        **pool_kwargs,
+    ):
+        """
+        Args:
+            default_image (str): Image for languages without a dedicated one.
+            images (dict): Maps a language to the image its containers are started from.
+            min_size (int): Minimum warm containers per pool.
+            max_total (int): Maximum containers across all pools.
+            rebalance_every (int): Number of requests between budget rebalances.
+            limit_resources (bool): Give each pool the resource profile of the languages it serves.
+            **pool_kwargs: Passed through to each ContainerPool.
+        """
+        by_image = {}
+        all_images = set(images.values()) | {default_image}
+        share = max(max_total // len(all_images), min_size)
+        for image in all_images:
+            languages = [language for language, served_by in images.items() if served_by == image]
+            if image == default_image:
+                languages += [language for language in supported_languages if language not in images]
+            by_image[image] = ContainerPool(
+                pool_size=min_size,
+                image=image,
+                max_size=share,
+                # Rebalancing may give any one pool most of the budget
+                max_threads=max_total,
+                profile=resource_profile(languages) if limit_resources and languages else None,
+                **pool_kwargs,
+            )
+        self.default = by_image[default_image]
+        self.pools = {language: by_image[image] for language, image in images.items()}
+        self.max_total = max_total
+        self.rebalance_every = rebalance_every
+        self._traffic = Counter()
+        self._requests = 0
+        self.logger = logging.getLogger(__name__)
+
+    def all_pools(self):
+        return list({id(pool): pool for pool in [self.default, *self.pools.values()]}.values())
+
+    def pool_for(self, language):
+        pool = self.pools.get(language, self.default)
+        self._traffic[pool.image] += 1
+        self._requests += 1
+        if self._requests % self.rebalance_every == 0:
+            self.rebalance()
+        return pool
+
+    def rebalance(self):
+        # Split the container budget by each image's share of recent traffic
+        total = sum(self._traffic.values())
+        if not total:
+            return
+        pools = self.all_pools()
+        # Every pool keeps its floor; what's left goes out by largest remainder, so the sizes
+        # add up to max_total exactly (or to the floors, if those alone exceed it)
+        sizes = {pool.image: max(pool.min_size, 1) for pool in pools}
+        spare = max(self.max_total - sum(sizes.values()), 0)
+        shares = {pool.image: spare * self._traffic[pool.image] / total for pool in pools}
+        for image, share in shares.items():
+            sizes[image] += int(share)
+        leftover = spare - sum(int(share) for share in shares.values())
+        remainder = {image: share - int(share) for image, share in shares.items()}
+        by_remainder = sorted(remainder, key=remainder.get, reverse=True)
+        for image in by_remainder[:leftover]:
+            sizes[image] += 1
+        for pool in pools:
+            pool.max_size = sizes[pool.image]
+        self.logger.info(
+            "Rebalanced pools: "
+            + ", ".join(f"{p.image}={p.max_size}" for p in self.all_pools())
+        )
+        # Halve the counts so the mix tracks recent traffic rather than all-time totals
+        for image in self._traffic:
+            self._traffic[image] //= 2
+
+    def stats(self):
+        return [pool.stats() for pool in self.all_pools()]
+
+    def stats_for(self, language):
+        # Stats of the pool serving `language`, without counting it as traffic
+        return self.pools.get(language, self.default).stats()
+
+    def saturated(self, language):
+        return self.pools.get(language, self.default).saturated()
+
+    def warm_up(self):
+        for pool in self.all_pools():
+            pool.warm_up()
+
+    def shutdown_pool(self):
+        for pool in self.all_pools():
+            pool.shutdown_pool()
+
+
+def collect_metrics(pools):
+    """
+    Returns a registry collector publishing the size and state of every pool in `pools`
+    (a ContainerPool or LanguagePools).
+    """
+
+    def collect():
+        for stats in (pool.stats() for pool in pools.all_pools()):
+            for state in ("idle", "busy", "creating"):
+                POOL_CONTAINERS.set(stats[state], image=stats["image"], state=state)
+            POOL_WAITING.set(stats["waiting"], image=stats["image"])
+
+    return collect
+
+
+def pool_from_env():
+    """
+    Builds the container pool from the environment. POOL_IMAGES (e.g. {"py": "glimpse-py"})
+    gives languages their own slimmer images and pools; everything else runs on DOCKER_IMAGE.
+    Containers get the resource profiles of their languages unless POOL_RESOURCE_LIMITS=false.
+    """
+    limit_resources = os.getenv("POOL_RESOURCE_LIMITS", "true").lower() == "true"
+    pool_options = {
+        "recycle": os.getenv("POOL_RECYCLE", "false").lower() == "true",
+        "max_uses": int(os.getenv("POOL_MAX_USES", 50)),
+    }
+    pool_images = json.loads(os.getenv("POOL_IMAGES", "{}"))
+    if pool_images:
+        return LanguagePools(
+            default_image=os.getenv("DOCKER_IMAGE", "glimpse"),
+            images=pool_images,
+            min_size=int(os.getenv("POOL_MIN_SIZE", 1)),
+            max_total=int(os.getenv("POOL_MAX_SIZE", 8)),
+            limit_resources=limit_resources,
+            **pool_options,
+        )
+    return ContainerPool(
+        pool_size=int(os.getenv("POOL_MIN_SIZE", 2)),
+        image=os.getenv("DOCKER_IMAGE", "glimpse"),
+        max_size=int(os.getenv("POOL_MAX_SIZE", 8)),
+        profile=resource_profile(supported_languages) if limit_resources else None,
+        **pool_options,
+    )
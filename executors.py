@@ -0,0 +1,277 @@
+import abc
+import json
+import logging
+import os
+import time
+
+from fastapi import HTTPException
+
+from glimpse import LOCAL_SANDBOX, run_code, run_code_pool
+from utils.metrics import registry
+
+ROUTED = registry.counter(
+    "glimpse_router_requests_total", "Requests routed, by backend and outcome", ["backend", "outcome"]
+)
+SPILLOVERS = registry.counter(
+    "glimpse_router_spillovers_total",
+    "Requests moved to another backend because the chosen one was saturated",
+    ["source", "target"],
+)
+
+
+class BackendSaturated(Exception):
+    """Raised by an executor that has no capacity for the request right now."""
+
+
+class Executor(abc.ABC):
+    """
+    Runs submissions on one backend and reports how busy it is.
+
+    `run` returns the same result dict as `glimpse.run_code`. It raises ValueError for
+    problems with the submission itself (compile and runtime errors), BackendSaturated when
+    the backend is out of capacity, and anything else when the backend failed.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.in_flight = 0
+
+    @abc.abstractmethod
+    def load(self, language: str):
+        """
+        How busy the backend is for `language`: 0 when idle, 1 when at capacity.
+        """
+
+    def saturated(self, language: str):
+        return self.load(language) >= 1
+
+    async def run(self, language: str, code: str, input: str = None):
+        self.in_flight += 1
+        try:
+            return await self._run(language, code, input)
+        finally:
+            self.in_flight -= 1
+
+    @abc.abstractmethod
+    async def _run(self, language: str, code: str, input: str = None):
+        pass
+
+
+class LocalExecutor(Executor):
+    name = "local"
+
+    def __init__(self, max_concurrency: int = None, sandbox: bool = None):
+        super().__init__()
+        self.max_concurrency = max_concurrency or 2 * (os.cpu_count() or 1)
+        self.sandbox = sandbox
+        if sandbox:
+            self.name = "sandbox"
+
+    def load(self, language: str):
+        return self.in_flight / self.max_concurrency
+
+    async def _run(self, language, code, input=None):
+        return await run_code(language, code, input, sandbox=self.sandbox)
+
+
+class PoolExecutor(Executor):
+    name = "pool"
+
+    def __init__(self, container_pool):
+        super().__init__()
+        self.container_pool = container_pool
+
+    def load(self, language: str):
+        stats = self.container_pool.stats_for(language)
+        return (stats["busy"] + stats["waiting"]) / max(stats["max_size"], 1)
+
+    def saturated(self, language: str):
+        return self.container_pool.saturated(language)
+
+    async def _run(self, language, code, input=None):
+        try:
+            result = await run_code_pool(language, code, input, self.container_pool)
+        except HTTPException as e:
+            if e.status_code == 503:
+                raise BackendSaturated(e.detail) from e
+            raise RuntimeError(e.detail) from e
+        # The pool reports a failed run in the result; the other backends raise, like run_code
+        if result["limit"] or result["exit_code"] != 0:
+            raise ValueError(result["error"])
+        return result
+
+
+class LambdaExecutor(Executor):
+    name = "lambda"
+
+    def __init__(self, invoker):
+        super().__init__()
+        self.invoker = invoker
+
+    def load(self, language: str):
+        return self.invoker.in_flight / self.invoker.concurrency
+
+    async def _run(self, language, code, input=None):
+        from lambda_invoker import LambdaThrottled
+
+        try:
+            response = await self.invoker.invoke(
+                {"language": language, "code": code, "input": input}
+            )
+        except LambdaThrottled as e:
+            raise BackendSaturated(str(e)) from e
+
+        body = json.loads(response["body"])
+        if response.get("statusCode") == 400:
+            raise ValueError(body.get("error"))
+        if response.get("statusCode") != 200:
+            raise RuntimeError(body.get("error") or "Lambda invocation failed")
+        if body.get("error"):
+            raise ValueError(body["error"])
+        return {
+            "output": body.get("output", ""),
+            "error": "",
+            "language": language,
+            "info": None,
+            "execution_time": body.get("executionTime"),
+            "usage": body.get("usage"),
+            "limit": body.get("limit"),
+            "compile_cache": body.get("compileCache"),
+        }
+
+
+class Router:
+    """
+    Sends each request to the backend expected to finish it soonest, from a running average
+    of its latency for the language, scaled up by how busy it is right now.
+
+    Saturated backends are skipped. A backend that fails `max_failures` times in a row sits
+    out for `cooldown` seconds. When the chosen backend turns out to be saturated (e.g. the
+    pool has no container to give), the request spills over to the next candidate instead
+    of erroring. A request whose backend failed is not retried elsewhere, since the backend
+    may already have run it. Errors in the submission itself are returned as they are.
+    """
+
+    def __init__(self, executors, alpha: float = 0.2, max_failures: int = 3, cooldown: float = 10):
+        self.executors = list(executors)
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._latency = {}
+        self._failures = {executor.name: 0 for executor in self.executors}
+        self._down_until = {executor.name: 0.0 for executor in self.executors}
+        self.logger = logging.getLogger(__name__)
+
+    def candidates(self, language: str):
+        """
+        Healthy backends in the order they should be tried for `language`. Saturated and
+        cooling-down backends go last rather than away, as a last resort.
+        """
+        now = time.monotonic()
+
+        def rank(indexed):
+            index, executor = indexed
+            unavailable = self._down_until[executor.name] > now or executor.saturated(language)
+            # Backends that haven't run this language yet score 0, so they get measured
+            latency = self._latency.get((executor.name, language), 0.0)
+            return unavailable, latency * (1 + executor.load(language)), index
+
+        return [executor for _, executor in sorted(enumerate(self.executors), key=rank)]
+
+    async def run(self, language: str, code: str, input: str = None):
+        """
+        Runs a submission on the best backend, spilling over to the others while they are
+        saturated. The result says which backend ran it.
+
+        Raises:
+            ValueError: If the submission fails to compile or run.
+            HTTPException: 503 if every backend is saturated, 500 if the backend failed.
+        """
+        candidates = self.candidates(language)
+        for attempt, executor in enumerate(candidates):
+            started = time.monotonic()
+            try:
+                result = await executor.run(language, code, input)
+            except ValueError:
+                self._record(executor, language, time.monotonic() - started)
+                ROUTED.inc(backend=executor.name, outcome="user_error")
+                raise
+            except BackendSaturated as e:
+                ROUTED.inc(backend=executor.name, outcome="saturated")
+                self.logger.info(f"{executor.name} is saturated ({e}), spilling over")
+            except Exception as e:
+                ROUTED.inc(backend=executor.name, outcome="failed")
+                self._fail(executor)
+                self.logger.error(f"{executor.name} failed: {e!r}")
+                raise HTTPException(
+                    status_code=500, detail=f"The {executor.name} backend failed"
+                ) from e
+            else:
+                self._record(executor, language, time.monotonic() - started)
+                ROUTED.inc(backend=executor.name, outcome="ok")
+                return {**result, "backend": executor.name}
+            if attempt + 1 < len(candidates):
+                SPILLOVERS.inc(source=executor.name, target=candidates[attempt + 1].name)
+        raise HTTPException(status_code=503, detail="Service unavailable")
+
+    def _record(self, executor, language, elapsed):
+        self._failures[executor.name] = 0
+        key = (executor.name, language)
+        previous = self._latency.get(key)
+        self._latency[key] = elapsed if previous is None else (
+            (1 - self.alpha) * previous + self.alpha * elapsed
+        )
+
+    def _fail(self, executor):
+        self._failures[executor.name] += 1
+        if self._failures[executor.name] >= self.max_failures:
+            self._down_until[executor.name] = time.monotonic() + self.cooldown
+            self._failures[executor.name] = 0
+            self.logger.error(f"{executor.name} keeps failing, skipping it for {self.cooldown}s")
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            executor.name: {
+                "in_flight": executor.in_flight,
+                "latency": {
+                    language: latency
+                    for (name, language), latency in self._latency.items()
+                    if name == executor.name
+                },
+                "healthy": self._down_until[executor.name] <= now,
+            }
+            for executor in self.executors
+        }
+
+
+def router_from_env(container_pool=None):
+    """
+    Builds a router over the backends in ROUTER_BACKENDS (default "pool,sandbox"), in order
+    of preference when they are otherwise tied. "sandbox" runs on this host in the process
+    sandbox. "local" does too, and is only accepted with LOCAL_SANDBOX set, so that
+    submissions never run unsandboxed next to the API. "lambda" is configured like
+    api-lambda.py (see LambdaInvoker.from_env).
+    """
+    executors = []
+    for name in os.getenv("ROUTER_BACKENDS", "pool,sandbox").split(","):
+        name = name.strip()
+        if name == "local":
+            if not LOCAL_SANDBOX:
+                raise ValueError(
+                    "ROUTER_BACKENDS includes 'local', which would run submissions unsandboxed "
+                    "on this host; use 'sandbox' or set LOCAL_SANDBOX=true"
+                )
+            executors.append(LocalExecutor())
+        elif name == "sandbox":
+            executors.append(LocalExecutor(sandbox=True))
+        elif name == "pool":
+            executors.append(PoolExecutor(container_pool))
+        elif name == "lambda":
+            from lambda_invoker import LambdaInvoker
+
+            executors.append(LambdaExecutor(LambdaInvoker.from_env()))
+        else:
+            raise ValueError(f"Unknown backend in ROUTER_BACKENDS: {name}")
+    return Router(executors)
@@ -1,13 +1,122 @@
 import subprocess
 import asyncio
+import atexit
+import codecs
+import io
 import os
-import docker
+import re
+import shlex
+import signal
+import socket as pysocket
+import struct
+import tarfile
+import tempfile
 import time
+from uuid import uuid4
+from docker.utils.socket import STDERR, STDOUT, frames_iter
 from fastapi import HTTPException
 
-from utils.file_manager import create_submission, remove_submission
+from utils.compile_cache import CompileCache, toolchain_version
+from utils.staging import SubmissionStaging, archive, submission_archive
 from utils.instructions import command_map, supported_languages
-from containers import ContainerPool
+from utils.jvm_service import JvmCompileService
+from utils.metrics import EXECUTION_TIMEOUTS, observe_run
+from utils import processes
+from utils.sandbox import ProcessSandbox
+from utils.tracing import tracer
+from utils.warm_workers import WarmWorkers
+from containers import ContainerPool, resource_profile
+
+# Compiled artifacts shared by the local and pool backends, keyed on source + toolchain
+compile_cache = CompileCache()
+
+# Per-job directories for the local backend, on a tmpfs and cleaned up in the background
+staging = SubmissionStaging()
+
+# Pre-forked interpreters for the local backend, enabled per language with WARM_WORKERS
+warm_workers = WarmWorkers.from_env()
+
+# Warm javac for the local backend, enabled with JVM_COMPILE_SERVICE
+jvm_service = JvmCompileService.from_env()
+
+
+def stop_services():
+    """
+    Stops the warm workers and the JVM compile server. Registered with atexit; servers
+    call it from their shutdown hooks too.
+    """
+    warm_workers.stop()
+    if jvm_service:
+        jvm_service.stop()
+
+
+atexit.register(stop_services)
+
+# Namespace/seccomp isolation for local runs, per call (`run_code(sandbox=True)`) or for all
+# of them with LOCAL_SANDBOX. Staged and cached submissions are hidden from the program.
+process_sandbox = ProcessSandbox.from_env(hide=(staging.root, str(compile_cache.root)))
+LOCAL_SANDBOX = os.getenv("LOCAL_SANDBOX", "false").lower() == "true"
+
+# Exit status of the sandbox launcher when it could not set the sandbox up
+SANDBOX_SETUP_FAILED = 125
+
+# Hard limits on every backend: wall-clock seconds to compile and to run a submission, and
+# CPU seconds the run may use (RLIMIT_CPU, set with `ulimit -t` in containers)
+COMPILE_TIMEOUT = float(os.getenv("COMPILE_TIMEOUT", 20))
+RUN_TIMEOUT = float(os.getenv("RUN_TIMEOUT", 30))
+CPU_TIME_LIMIT = int(os.getenv("CPU_TIME_LIMIT", RUN_TIMEOUT))
+
+# Exit status of `timeout` when it had to stop the command
+TIMEOUT_EXIT_CODE = 124
+
+# Extra time given to Docker calls beyond a limit enforced inside the container, before the
+# host gives up on them; the container is reset or replaced afterwards either way
+DOCKER_GRACE_SECONDS = 5
+
+# Largest number of test cases accepted by a single batch run
+BATCH_MAX_CASES = int(os.getenv("BATCH_MAX_CASES", 100))
+
+# Comments and string literals in Java source, and the type declarations in what's left
+JAVA_NOISE = re.compile(
+    r'//[^\n]*|/\*.*?\*/|"""(?:\\.|[^\\])*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'',
+    re.S,
+)
+JAVA_TYPE = re.compile(r"\b(?:class|interface|enum|record)\s+([A-Za-z_$][\w$]*)")
+
+# Per-stream output cap for streamed runs; the program is killed once it is exceeded
+STREAM_MAX_OUTPUT_BYTES = int(os.getenv("STREAM_MAX_OUTPUT_BYTES", 1024 * 1024))
+STREAM_CHUNK_BYTES = 4096
+
+# Wraps commands run in pool containers, which have no Python to collect rusage with. The
+# program runs under a CPU time limit and `timeout`, which stops its whole process group at
+# the deadline. Once it exits, the shell reports its children's CPU time (`times`) and the
+# container's peak memory from the cgroup after a per-run marker line, then exits with the
+# program's status (128 + N when signal N killed it, 124 when the deadline did). The memory
+# figure covers the whole container since it started, not just this program.
+USAGE_SHIM = (
+    'ulimit -t {cpu_hard_limit}; ulimit -S -t {cpu_limit}; timeout -k 1 {timeout} "$@"; code=$?; '
+    'printf "\n%s\n" "{marker}" >&2; times >&2; '
+    "cat /sys/fs/cgroup/memory.peak /sys/fs/cgroup/memory/memory.max_usage_in_bytes "
+    "2>/dev/null | head -n 1 >&2; "
+    "exit $code"
+)
+
+# The same limits for streamed runs, which need no usage report
+LIMIT_SHIM = 'ulimit -t {cpu_hard_limit}; ulimit -S -t {cpu_limit}; exec timeout -k 1 {timeout} "$@"'
+
+
+def validate_submission(language: str, code: str):
+    """
+    Raises:
+        ValueError: If no code is provided or if an unsupported language is specified.
+    """
+    if not code:
+        raise ValueError("No Code found to execute.")
+
+    if language not in supported_languages:
+        raise ValueError(
+            f"Please enter a valid language. The languages currently supported are: {', '.join(supported_languages)}."
+        )
 
 
 async def run_code(
@@ -15,6 +124,7 @@ async def run_code(
     code: str = "",
     input: str = None,
     container_pool: ContainerPool = None,
+    sandbox: bool = None,
 ):
     """
     Asynchronously compiles and executes given source code in a specified language with optional input.
@@ -32,30 +142,31 @@ async def run_code(
         language (str): The programming language of the provided code. Defaults to an empty string.
         code (str): The source code to be compiled and executed. Defaults to an empty string.
         input (str): The input to be supplied to the code during its execution. Defaults to None.
+        sandbox (bool): Run the program in a process sandbox (see utils/sandbox.py) rather than
+            as a plain child process. Defaults to LOCAL_SANDBOX. Compiles run unsandboxed.
 
     Raises:
         ValueError: If no code is provided or if an unsupported language is specified.
         ValueError: If there is an error during the compilation of the code.
         ValueError: If there is an error during the execution of the code.
+        RuntimeError: If the sandbox could not be set up.
 
     Returns:
         dict: A dictionary containing the output of the code execution, any execution errors,
-              the language of the code, and the version info of the compiler/interpreter.
+              the language of the code, the version info of the compiler/interpreter, and
+              whether the compile step was served from the compile cache ("hit" / "miss",
+              None for interpreted languages), and a usage breakdown: wall time spent
+              waiting for a container, staging, compiling and running, plus the
+              program's user/sys CPU time, peak RSS and the signal that ended it.
 
     Usage:
         $ asyncio.run(run_code(language='py', code='print("Hello, world!")'))
         {'output': 'Hello, world!\n', 'error': '', 'language': 'py', 'info': 'python3 --version'}
     """
 
-    timeout = 30
+    timeout = RUN_TIMEOUT
 
-    if not code:
-        raise ValueError("No Code found to execute.")
-
-    if language not in supported_languages:
-        raise ValueError(
-            f"Please enter a valid language. The languages currently supported are: {', '.join(supported_languages)}."
-        )
+    validate_submission(language, code)
 
     # Start timing
     start_time = time.time()
@@ -64,37 +175,44 @@ async def run_code(
         # If a container pool is provided, use it.
         return await run_code_pool(language, code, input, container_pool)
 
-    file_info = await create_submission(language, code)
-    job_id = file_info["jobID"]
-    commands = command_map(job_id, language)
+    clock = time.monotonic()
+    usage = {"queue_wait": 0.0}
+    with tracer.span("stage", language=language, bytes=len(code)):
+        job = staging.new_job(language, code)
+    job_id = job["jobID"]
+    commands = command_map(job_id, language, job["directory"], job["directory"])
+    clock = _phase(usage, "staging", clock)
 
-    if commands.get("compileCodeCommand"):
-        compile_code = await asyncio.create_subprocess_exec(
-            commands["compileCodeCommand"],
-            *commands.get("compilationArgs", []),
-            stderr=subprocess.PIPE,
-        )
-        _, stderr = await compile_code.communicate()
-        if stderr:
-            raise ValueError(stderr.decode())
+    try:
+        with tracer.span("compile", language=language) as span:
+            compile_cache_status = await _compile_local(language, code, job_id, commands)
+            span.set(cache=str(compile_cache_status))
+        clock = _phase(usage, "compile", clock)
 
-    execute_code = await asyncio.create_subprocess_exec(
-        commands["executeCodeCommand"],
-        *commands.get("executionArgs", []),
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
+        if sandbox is None:
+            sandbox = LOCAL_SANDBOX
+        with tracer.span("exec", language=language, sandbox=sandbox) as span:
+            stdout, stderr, exit_code, timed_out, process_usage = await _execute_local(
+                commands, input, timeout, language, sandbox
+            )
+            span.set(exit_code=exit_code, timed_out=timed_out)
+        _phase(usage, "run", clock)
+        usage.update(process_usage)
+    finally:
+        with tracer.span("release_submission"):
+            staging.release(job_id)
 
-    stdout, stderr = await asyncio.wait_for(
-        execute_code.communicate(input.encode() if input else None), timeout=timeout
-    )
+    observe_run("local", language, usage)
+    limit = processes.limit_exceeded(timed_out, process_usage)
+    if limit:
+        EXECUTION_TIMEOUTS.inc(backend="local", language=language)
+        raise ValueError(limit_message(limit, timeout))
 
-    if execute_code.returncode != 0:
+    if sandbox and exit_code == SANDBOX_SETUP_FAILED and stderr.startswith(b"sandbox: "):
+        raise RuntimeError(stderr.decode().strip())
+    if exit_code != 0:
         raise ValueError(stderr.decode())
 
-    await remove_submission(job_id, language, commands.get("outputExt"))
-
     # Calculate execution time before return
     execution_time = time.time() - start_time
 
@@ -104,11 +222,490 @@ async def run_code(
         "language": language,
         "info": commands["compilerInfoCommand"],
         "execution_time": execution_time,
+        "usage": usage,
+        "compile_cache": compile_cache_status,
     }
 
 
-def strip_docker_control_characters(output):
-    return "".join(chr(i) for i in output if (i > 31 and i < 127) or i in (9, 10, 13))
+def limit_message(limit: str, timeout: float = RUN_TIMEOUT):
+    """
+    Describes which deadline stopped a submission, given a limit name from
+    `processes.limit_exceeded` or "compile_time".
+    """
+    if limit == "compile_time":
+        return f"Compilation timed out after {COMPILE_TIMEOUT:g} seconds (compile time limit)."
+    if limit == "cpu_time":
+        return f"Execution exceeded the CPU time limit of {CPU_TIME_LIMIT} seconds."
+    return f"Execution timed out after {timeout:g} seconds (wall-clock limit)."
+
+
+def _phase(usage: dict, name: str, started: float):
+    """
+    Records the monotonic time since `started` as phase `name` in `usage`, and returns the
+    current time to start the next phase from.
+    """
+    now = time.monotonic()
+    usage[name] = now - started
+    return now
+
+
+async def _compile_local(language: str, code: str, job_id: str, commands: dict):
+    """
+    Compiles a submission on the host if its language needs it, reusing a cached artifact for
+    identical code. Points `commands` at the artifact to run and returns the compile cache
+    status ("hit" / "miss", None when nothing was compiled).
+
+    Raises:
+        ValueError: If the compiler exits with an error or runs past COMPILE_TIMEOUT.
+    """
+    if language == "java" and jvm_service:
+        return await _compile_java_service(code, commands)
+
+    if not commands.get("compileCodeCommand"):
+        return None
+
+    cache_key = compile_cache.make_key(
+        language,
+        code,
+        _compile_flags(commands, job_id),
+        toolchain_version(commands["compilerInfoCommand"]),
+    )
+    artifact = compile_cache.get(cache_key)
+    status = "hit"
+    if not artifact:
+        # The compiler's whole process group is killed at the deadline
+        _, stderr, exit_code, timed_out, _ = await asyncio.get_running_loop().run_in_executor(
+            None,
+            processes.run,
+            [commands["compileCodeCommand"], *commands.get("compilationArgs", [])],
+            None,
+            COMPILE_TIMEOUT,
+        )
+        if timed_out:
+            raise ValueError(limit_message("compile_time"))
+        if exit_code != 0:
+            raise ValueError(stderr.decode())
+        artifact = compile_cache.put(cache_key, commands["outputFile"])
+        status = "miss"
+    _use_artifact(commands, str(artifact))
+    return status
+
+
+async def _compile_java_service(code: str, commands: dict):
+    """
+    Compiles a Java submission on the warm compile server instead of launching it from source,
+    and points `commands` at the class directory with the JVM's fast-start options, to run
+    the class the source launcher would. Returns the compile cache status, or None if the
+    submission has no top-level class and is left to the source launcher.
+
+    Raises:
+        ValueError: If the compiler exits with an error or times out.
+    """
+    classes = _java_classes(code)
+    if classes is None:
+        return None
+    main_class, file_class = classes
+    cache_key = compile_cache.make_key(
+        "java", code, ["CompileServer"], toolchain_version("javac -version")
+    )
+    artifact = compile_cache.get(cache_key)
+    status = "hit"
+    if not artifact:
+        with tempfile.TemporaryDirectory() as output_dir:
+            # javac wants the source named after its public class
+            source = os.path.join(output_dir, "src", f"{file_class}.java")
+            os.mkdir(os.path.dirname(source))
+            with open(source, "w") as f:
+                f.write(code)
+            classes_dir = os.path.join(output_dir, "classes")
+            try:
+                exit_code, diagnostics, _ = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    jvm_service.compile,
+                    "java",
+                    source,
+                    classes_dir,
+                    COMPILE_TIMEOUT,
+                )
+            except subprocess.TimeoutExpired:
+                raise ValueError(limit_message("compile_time"))
+            if exit_code != 0:
+                raise ValueError(diagnostics)
+            artifact = compile_cache.put(cache_key, classes_dir)
+        status = "miss"
+    commands["executionArgs"] = [*jvm_service.run_flags(), "-cp", str(artifact), main_class]
+    return status
+
+
+async def _execute_local(
+    commands: dict, input: str = None, timeout: float = 30, language: str = None, sandbox: bool = False
+):
+    """
+    Runs a (compiled) submission on the host once, killing its process group if it exceeds
+    `timeout` and capping its CPU time at CPU_TIME_LIMIT. Runs it in the process sandbox if
+    `sandbox`, else on a warm worker when one is enabled for `language`.
+    Returns a (stdout, stderr, exit_code, timed_out, usage) tuple, with the child's CPU time,
+    peak memory and exit signal in `usage`.
+    """
+    loop = asyncio.get_running_loop()
+    argv = [commands["executeCodeCommand"], *commands.get("executionArgs", [])]
+    if sandbox:
+        return await loop.run_in_executor(
+            None,
+            process_sandbox.run,
+            argv,
+            language,
+            resource_profile([language]),
+            input,
+            timeout,
+            CPU_TIME_LIMIT,
+        )
+    if warm_workers.handles(language):
+        return await loop.run_in_executor(
+            None,
+            warm_workers.run,
+            language,
+            commands["executionArgs"][-1],
+            input,
+            timeout,
+            CPU_TIME_LIMIT,
+        )
+
+    # Spawned and reaped on a worker thread, so the child's rusage can be collected
+    return await loop.run_in_executor(
+        None,
+        processes.run,
+        argv,
+        input,
+        timeout,
+        None,
+        CPU_TIME_LIMIT,
+    )
+
+
+def _container_commands(job_id: str, language: str, commands: dict = None):
+    """
+    Returns the command map for a submission staged in a container's /tmp (or `commands`),
+    along with the compile (None for interpreted languages) and execute commands as shell
+    strings.
+    """
+    commands = commands or command_map(job_id, language, "/tmp", "/tmp")
+    compile_command = None
+    if commands.get("compileCodeCommand"):
+        compile_command = " ".join(
+            [commands["compileCodeCommand"]] + commands.get("compilationArgs", [])
+        )
+    exec_command = " ".join(
+        [commands["executeCodeCommand"]] + commands.get("executionArgs", [])
+    )
+    return commands, compile_command, exec_command
+
+
+def _java_classes(code: str):
+    """
+    Finds the top-level class of a Java submission that the source launcher would run (the
+    first one declared) and the one javac needs its file named after (the public one, if
+    any). Returns (main_class, file_class), or None if there is no top-level class.
+    """
+    text = JAVA_NOISE.sub(" ", code)
+    depth = 0
+    position = 0
+    top_level = []
+    for match in JAVA_TYPE.finditer(text):
+        depth += text.count("{", position, match.start()) - text.count("}", position, match.start())
+        position = match.start()
+        if depth == 0:
+            modifiers = re.split(r"[;{}]", text[: match.start()])[-1]
+            top_level.append((match.group(1), re.search(r"\bpublic\b", modifiers) is not None))
+    if not top_level:
+        return None
+    public = [name for name, is_public in top_level if is_public]
+    return top_level[0][0], public[0] if public else top_level[0][0]
+
+
+def _java_batch_commands(job_id: str, code: str, directory: str):
+    """
+    Returns a command map that compiles a Java submission with javac and runs its classes,
+    for batches, where launching it from source would compile it again for every case. The
+    source goes in `<directory>/<job_id>/`, named after its public class as javac requires,
+    and the classes in `<directory>/<job_id>-classes`. None if no top-level class is found,
+    leaving the source launcher to report the error.
+    """
+    classes = _java_classes(code)
+    if classes is None:
+        return None
+    main_class, file_class = classes
+    output = os.path.join(directory, f"{job_id}-classes")
+    source = os.path.join(directory, job_id, f"{file_class}.java")
+    return {
+        "compileCodeCommand": "javac",
+        "compilationArgs": ["-d", output, source],
+        "executeCodeCommand": "java",
+        "executionArgs": ["-cp", output, main_class],
+        "sourceFile": source,
+        "outputFile": output,
+        "compilerInfoCommand": "javac -version",
+    }
+
+
+async def _compile_in_container(
+    container_pool: ContainerPool,
+    container,
+    language: str,
+    code: str,
+    job_id: str,
+    commands: dict,
+    compile_command: str,
+):
+    """
+    Compiles a submission inside a pool container, or copies in a cached binary for identical
+    code. Returns the compile cache status like `_compile_local`.
+
+    Raises:
+        ValueError: If the compiler exits with an error or runs past COMPILE_TIMEOUT.
+    """
+    if not compile_command:
+        return None
+
+    cache_key = compile_cache.make_key(
+        language,
+        code,
+        _compile_flags(commands, job_id),
+        container_pool.image_id,
+    )
+    with tracer.span("compile_cache.get"):
+        artifact = compile_cache.get(cache_key)
+    if artifact:
+        with tracer.span("put_artifact"):
+            await container_pool.run_io(
+                _put_artifact, container, commands["outputFile"], artifact
+            )
+        return "hit"
+
+    try:
+        with tracer.span("compile.exec"):
+            result = await asyncio.wait_for(
+                container_pool.run_io(
+                    container.exec_run, f"timeout -k 1 {COMPILE_TIMEOUT:g} {compile_command}"
+                ),
+                COMPILE_TIMEOUT + DOCKER_GRACE_SECONDS,
+            )
+    except asyncio.TimeoutError:
+        raise ValueError(limit_message("compile_time"))
+    if result.exit_code == TIMEOUT_EXIT_CODE:
+        raise ValueError(limit_message("compile_time"))
+    if result.exit_code != 0:
+        raise ValueError(f"Compilation error: {result.output.decode()}")
+    with tracer.span("compile_cache.put"):
+        await container_pool.run_io(
+            _cache_artifact, container, commands["outputFile"], cache_key
+        )
+    return "miss"
+
+
+def _compile_flags(commands: dict, job_id: str):
+    """
+    Returns the compiler invocation with job-specific paths reduced to their stable parts,
+    so that identical submissions map to the same compile cache entry.
+    """
+    return [commands["compileCodeCommand"]] + [
+        os.path.basename(arg.replace(job_id, ""))
+        for arg in commands.get("compilationArgs", [])
+    ]
+
+
+def _use_artifact(commands: dict, artifact: str):
+    """
+    Points the execution command at a cached artifact instead of the job's own output file.
+    """
+    output_file = commands["outputFile"]
+    if commands["executeCodeCommand"] == output_file:
+        commands["executeCodeCommand"] = artifact
+    commands["executionArgs"] = [
+        artifact if arg == output_file else arg
+        for arg in commands.get("executionArgs", [])
+    ]
+
+
+def _read_archive_file(bits):
+    """
+    Returns the contents of the single file in a tar stream from `get_archive`.
+    """
+    stream = io.BytesIO(b"".join(bits))
+    with tarfile.open(fileobj=stream, mode="r") as tar:
+        member = next(m for m in tar.getmembers() if m.isfile())
+        return tar.extractfile(member).read()
+
+
+# Header of a frame in Docker's multiplexed attach stream: stream id, 3 bytes of padding and
+# the big-endian payload length
+FRAME_HEADER = struct.Struct(">BxxxL")
+
+
+def demux_docker_stream(data: bytes):
+    """
+    Splits a multiplexed (non-TTY) Docker attach stream into its stdout and stderr bytes.
+    Payloads are sliced out whole, frame by frame, so the cost is a memory copy and
+    multi-byte characters split across frames come out intact. A truncated final frame
+    contributes what it has.
+    """
+    view = memoryview(data)
+    streams = {STDOUT: [], STDERR: []}
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(view):
+        stream_id, length = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+        streams[STDERR if stream_id == STDERR else STDOUT].append(view[offset : offset + length])
+        offset += length
+    return b"".join(streams[STDOUT]), b"".join(streams[STDERR])
+
+
+def _put_submission(container, job_id: str, language: str, code: str):
+    # Copies a submission into the container's /tmp without staging it on the host
+    container.put_archive(path="/tmp", data=submission_archive(job_id, language, code))
+
+
+def _put_source(container, path: str, code: str):
+    # Copies a source file to `path`, somewhere under the container's /tmp
+    data = archive({os.path.relpath(path, "/tmp"): code.encode()})
+    container.put_archive(path="/tmp", data=data)
+
+
+def _put_artifact(container, output_file: str, artifact):
+    # Places a cached binary (or class directory) where the container's compiler would have
+    # written it
+    if artifact.is_dir():
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as tar:
+            tar.add(artifact, arcname=os.path.basename(output_file))
+        data = stream.getvalue()
+    else:
+        data = archive({os.path.basename(output_file): artifact.read_bytes()}, mode=0o755)
+    container.put_archive(path=os.path.dirname(output_file), data=data)
+
+
+def _cache_artifact(container, output_file: str, cache_key: str):
+    # Copies a freshly compiled binary (or class directory) out of the container into the
+    # compile cache
+    bits, _ = container.get_archive(output_file)
+    data = b"".join(bits)
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r") as tar:
+        members = tar.getmembers()
+        if members and members[0].isdir():
+            # Only plain files and directories, and nothing outside the artifact
+            root = members[0].name
+            safe = [
+                member
+                for member in members
+                if (member.isfile() or member.isdir())
+                and (member.name + "/").startswith(root + "/")
+                and ".." not in member.name.split("/")
+            ]
+            with tempfile.TemporaryDirectory() as directory:
+                tar.extractall(directory, members=safe)
+                compile_cache.put(cache_key, os.path.join(directory, root))
+            return
+    compile_cache.put_bytes(cache_key, _read_archive_file([data]))
+
+
+def _exec_in_container(container, exec_command: str, input: str = None, timeout: float = RUN_TIMEOUT):
+    """
+    Runs a command in a container, writing `input` to its stdin when given, under the CPU
+    time limit and killed with its process group after `timeout` seconds.
+    Returns an (output, error, exit_code, usage) tuple: its decoded stdout, its stderr with
+    the usage report stripped, its exit code and the usage parsed from that report. This
+    blocks on Docker I/O, so it is meant to be called through `ContainerPool.run_io`.
+    """
+    marker = f"glimpse-usage-{uuid4()}"
+    shim = USAGE_SHIM.format(marker=marker, timeout=f"{timeout:g}", **_cpu_limits())
+    command = ["sh", "-c", shim, "sh", *shlex.split(exec_command)]
+    api = container.client.api
+    with tracer.span("exec.create"):
+        exec_id = api.exec_create(container.id, command, stdin=input is not None)
+    if input is not None:
+        with tracer.span("exec.io", input_bytes=len(input)):
+            socket = api.exec_start(exec_id, socket=True)
+            _send_stdin(socket, input)
+            data = socket.read()
+            socket.close()
+        with tracer.span("exec.demux", bytes=len(data)):
+            stdout, stderr = demux_docker_stream(data)
+    else:
+        with tracer.span("exec.io"):
+            stdout, stderr = api.exec_start(exec_id, demux=True)
+
+    with tracer.span("exec.inspect"):
+        exit_code = api.exec_inspect(exec_id).get("ExitCode")
+    # Decode each stream whole, so no character is split at a frame boundary
+    with tracer.span("exec.parse_usage"):
+        error, usage = _parse_usage(
+            (stderr or b"").decode(errors="replace"), marker, exit_code
+        )
+    return (stdout or b"").decode(errors="replace"), error, exit_code, usage
+
+
+def _cpu_limits():
+    # Like processes.limit_cpu: SIGXCPU at the limit, SIGKILL a second later
+    return {"cpu_limit": CPU_TIME_LIMIT, "cpu_hard_limit": CPU_TIME_LIMIT + 1}
+
+
+async def _exec_with_deadline(container_pool, container, exec_command, input, timeout):
+    """
+    Runs `_exec_in_container` on the pool's I/O executor, and gives up on Docker if the
+    exec outlives its in-container deadline by more than DOCKER_GRACE_SECONDS.
+    Returns (output, error, exit_code, usage, limit), with the limit that stopped the
+    program as in `processes.limit_exceeded`.
+    """
+    try:
+        output, error, exit_code, usage = await asyncio.wait_for(
+            container_pool.run_io(_exec_in_container, container, exec_command, input, timeout),
+            timeout + DOCKER_GRACE_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        empty = {
+            "user_time": None,
+            "sys_time": None,
+            "max_rss_kb": None,
+            "container_peak_kb": None,
+            "exit_signal": None,
+        }
+        return "", "", None, empty, "wall_time"
+    limit = processes.limit_exceeded(exit_code == TIMEOUT_EXIT_CODE, usage)
+    return output, error, exit_code, usage, limit
+
+
+def _parse_usage(output: str, marker: str, exit_code: int):
+    """
+    Splits the report written by USAGE_SHIM off the end of an exec's stderr.
+    Returns the program's own stderr and its usage.
+
+    The program's own peak memory isn't measured (`max_rss_kb` is None); the container's
+    peak since it started is reported as `container_peak_kb`. The shell's status can't tell
+    a program killed by signal N from one exiting with 128 + N, so the only signal reported
+    is SIGXCPU, and only when the program has used up its CPU time limit.
+    """
+    output, found, report = output.rpartition(f"\n{marker}\n")
+    if not found:
+        output, report = report, ""
+    usage = {
+        "user_time": None,
+        "sys_time": None,
+        "max_rss_kb": None,
+        "container_peak_kb": None,
+        "exit_signal": None,
+    }
+    lines = report.splitlines()
+    # `times` prints the shell's own CPU times, then those of its children
+    if len(lines) >= 2:
+        times = [int(m) * 60 + float(s) for m, s in re.findall(r"(\d+)m\s*([\d.]+)s", lines[1])]
+        if len(times) == 2:
+            usage["user_time"], usage["sys_time"] = times
+    if len(lines) >= 3 and lines[2].strip().isdigit():
+        usage["container_peak_kb"] = int(lines[2]) // 1024
+    cpu_time = (usage["user_time"] or 0) + (usage["sys_time"] or 0)
+    if exit_code == 128 + signal.SIGXCPU and cpu_time >= CPU_TIME_LIMIT:
+        usage["exit_signal"] = int(signal.SIGXCPU)
+    return output, usage
 
 
 async def run_code_pool(
@@ -120,89 +717,70 @@ async def run_code_pool(
     """
     Asynchronously compiles and executes given source code in a specified language with optional input.
     This method assumes that this is being ran inside of a Docker container, which was sourced from a container pool.
+    Waiting for a container and all Docker I/O happen off the event loop, so concurrent requests proceed in parallel.
     """
 
-    if not code:
-        raise ValueError("No Code found to execute.")
-
-    if language not in supported_languages:
-        raise ValueError(
-            f"Please enter a valid language. The languages currently supported are: {', '.join(supported_languages)}."
-        )
+    validate_submission(language, code)
 
     # Start timing
     start_time = time.time()
 
-    # Get a container from the pool
-    container = container_pool.get_container()
+    # Wait for a container from the language's pool without blocking the event loop
+    clock = time.monotonic()
+    usage = {}
+    container_pool = container_pool.pool_for(language)
+    container = await container_pool.acquire()
+    clock = _phase(usage, "queue_wait", clock)
 
-    try:
-        # Create the submission file
-        file_info = await create_submission(language, code)
-        job_id = file_info["jobID"]
-        file_path = file_info["filePath"]
-
-        # Inject the submission file into the container
-        with open(file_path, "r") as file:
-            data = {os.path.basename(file.name): file.read()}
-            tar = docker.utils.create_archive(
-                os.path.dirname(os.path.abspath(file_path)), data
-            )
-            container.put_archive(path="/tmp", data=tar)
+    job_id = str(uuid4())
 
-        # Define the commands
-        commands = command_map(job_id, language)
-        commands["executionArgs"] = [os.path.join("/tmp", os.path.basename(file_path))]
-        compile_command = (
-            [commands.get("compileCodeCommand")] + commands.get("compilationArgs", [])
-            if commands.get("compileCodeCommand")
-            else None
-        )
-        exec_command = [commands["executeCodeCommand"]] + commands.get(
-            "executionArgs", []
-        )
-        compile_command = " ".join(compile_command) if compile_command else None
-        exec_command = " ".join(exec_command)
+    # Define the commands, with paths relative to the container's /tmp
+    commands, compile_command, exec_command = _container_commands(job_id, language)
 
-        # Compile the code if necessary
-        if compile_command:
-            result = container.exec_run(compile_command)
-            if result.exit_code != 0:
-                raise ValueError(f"Compilation error: {result.output.decode()}")
+    try:
+        # Copy the submission into the container, straight from memory
+        with tracer.span("put_submission", language=language, bytes=len(code)):
+            await container_pool.run_io(_put_submission, container, job_id, language, code)
+        clock = _phase(usage, "staging", clock)
 
-        # Execute the code
-        if input is not None:
-            exec_result = container.exec_run(
-                exec_command, stdin=True, socket=True, demux=True
+        # Compile the code if necessary, reusing a cached binary when we have one
+        with tracer.span("compile", language=language) as span:
+            compile_cache_status = await _compile_in_container(
+                container_pool,
+                container,
+                language,
+                code,
+                job_id,
+                commands,
+                compile_command,
             )
-            socket = exec_result.output
-            stdin = socket._sock.makefile("w")
+            span.set(cache=str(compile_cache_status))
+        clock = _phase(usage, "compile", clock)
 
-            stdin.write(input + "\n")
-            stdin.close()
-
-            output = strip_docker_control_characters(socket.read())
-            socket.close()
-
-            error = (
-                ""
-                if exec_result.exit_code == 0 or not exec_result.exit_code
-                else output
+        # Execute the code
+        with tracer.span("exec", language=language) as span:
+            output, error, exit_code, process_usage, limit = await _exec_with_deadline(
+                container_pool, container, exec_command, input, RUN_TIMEOUT
             )
-        else:
-            exec_result = container.exec_run(exec_command)
-            output = exec_result.output.decode()
-            error = "" if exec_result.exit_code == 0 else output
+            span.set(exit_code=str(exit_code), limit=str(limit))
+        _phase(usage, "run", clock)
+        usage.update(process_usage)
 
+    except ValueError:
+        raise  # Compile errors are the submission's fault, not the backend's
     except Exception as e:
         print(f"Failed to execute code: {e}")
         raise HTTPException(status_code=500, detail="Failed to execute code")
 
     finally:
-        # Remove the submission file
-        await remove_submission(job_id, language, commands.get("outputExt"))
-        # Replace the used container
-        container_pool.replace_container(container)
+        # Recycle or replace the used container
+        with tracer.span("release_container"):
+            container_pool.release_container(container)
+
+    observe_run("pool", language, usage)
+    if limit:
+        EXECUTION_TIMEOUTS.inc(backend="pool", language=language)
+        error = limit_message(limit)
 
     # Calculate execution time before return
     execution_time = time.time() - start_time
@@ -214,9 +792,518 @@ async def run_code_pool(
         "language": language,
         "info": commands["compilerInfoCommand"],
         "execution_time": execution_time,
+        "usage": usage,
+        "limit": limit,
+        "exit_code": exit_code,
+        "compile_cache": compile_cache_status,
+    }
+
+
+async def run_batch(
+    language: str = "",
+    code: str = "",
+    cases: list = None,
+    container_pool: ContainerPool = None,
+    timeout: float = 10,
+    sandbox: bool = None,
+):
+    """
+    Compiles a submission once and runs it against many test cases in parallel, judge-style.
+
+    Local runs fan out across the host's cores. Pool runs fan out across the language pool's
+    capacity; after the first compile, every container receives the binary from the compile
+    cache instead of compiling again. Java, which single runs launch from source, is
+    compiled with javac here, so the cases run its classes.
+
+    Args:
+        language (str): The programming language of the provided code.
+        code (str): The source code to be compiled and executed.
+        cases (list[dict]): Test cases, each with an optional "input" and "expected_output".
+        container_pool (ContainerPool): Runs the cases on this pool instead of the host.
+        timeout (float): Wall-clock limit per test case, in seconds.
+        sandbox (bool): Run local cases in the process sandbox. Defaults to LOCAL_SANDBOX.
+
+    Raises:
+        ValueError: If no code, no test cases or too many are provided, or if an unsupported
+                    language is specified.
+
+    Returns:
+        dict: The language, compiler info, compile cache status and compile error (if any),
+              one result per case in input order (output, error, exit code, verdict and
+              execution time), and the number of cases per verdict. Verdicts are "accepted",
+              "wrong_answer", "runtime_error", "time_limit_exceeded", "compilation_error",
+              "internal_error", or "completed" for cases without an expected output.
+    """
+    validate_submission(language, code)
+    if not cases:
+        raise ValueError("No test cases provided.")
+    if len(cases) > BATCH_MAX_CASES:
+        raise ValueError(f"A batch can hold at most {BATCH_MAX_CASES} test cases.")
+
+    start_time = time.time()
+    if container_pool:
+        job_id = str(uuid4())
+        commands = command_map(job_id, language)
+        compile_cache_status, compile_error, results = await _run_batch_pool(
+            language, code, job_id, cases, container_pool, timeout
+        )
+    else:
+        job = staging.new_job(language, code)
+        job_id = job["jobID"]
+        commands = command_map(job_id, language, job["directory"], job["directory"])
+        try:
+            compile_cache_status, compile_error, results = await _run_batch_local(
+                language,
+                code,
+                job_id,
+                commands,
+                cases,
+                timeout,
+                LOCAL_SANDBOX if sandbox is None else sandbox,
+            )
+        finally:
+            staging.release(job_id)
+
+    if compile_error is not None:
+        results = [
+            _case_result(case, "", compile_error, None, "compilation_error", 0)
+            for case in cases
+        ]
+
+    summary = {}
+    for result in results:
+        summary[result["verdict"]] = summary.get(result["verdict"], 0) + 1
+
+    return {
+        "language": language,
+        "info": commands["compilerInfoCommand"],
+        "compile_cache": compile_cache_status,
+        "compile_error": compile_error,
+        "cases": results,
+        "summary": summary,
+        "execution_time": time.time() - start_time,
     }
 
 
+async def _run_batch_local(language, code, job_id, commands, cases, timeout, sandbox=False):
+    if language == "java" and not jvm_service:
+        directory = os.path.dirname(commands["executionArgs"][0])
+        java_commands = _java_batch_commands(job_id, code, directory)
+        if java_commands:
+            commands = java_commands
+            os.mkdir(os.path.dirname(commands["sourceFile"]))
+            with open(commands["sourceFile"], "w") as f:
+                f.write(code)
+    try:
+        compile_cache_status = await _compile_local(language, code, job_id, commands)
+    except ValueError as e:
+        return None, str(e), []
+
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+
+    async def run_case(case):
+        async with semaphore:
+            started = time.time()
+            stdout, stderr, exit_code, timed_out, usage = await _execute_local(
+                commands, case.get("input"), timeout, language, sandbox
+            )
+            output = stdout.decode()
+            timed_out = processes.limit_exceeded(timed_out, usage) is not None
+            if timed_out:
+                EXECUTION_TIMEOUTS.inc(backend="local", language=language)
+            return _case_result(
+                case,
+                output,
+                stderr.decode(),
+                exit_code,
+                _verdict(case, output, exit_code, timed_out),
+                time.time() - started,
+            )
+
+    return compile_cache_status, None, await asyncio.gather(*map(run_case, cases))
+
+
+async def _run_batch_pool(language, code, job_id, cases, container_pool, timeout):
+    container_pool = container_pool.pool_for(language)
+    java_commands = _java_batch_commands(job_id, code, "/tmp") if language == "java" else None
+    commands, compile_command, exec_command = _container_commands(job_id, language, java_commands)
+
+    # Long enough for whoever holds a container (a case or a compile) to give it back, so
+    # cases queue for containers under contention instead of failing
+    acquire_timeout = max(timeout, COMPILE_TIMEOUT) + DOCKER_GRACE_SECONDS
+
+    async def prepared_container():
+        # A container holding the submission, compiled (or copied from the compile cache)
+        container = await container_pool.acquire(timeout=acquire_timeout)
+        try:
+            if commands.get("sourceFile"):
+                await container_pool.run_io(_put_source, container, commands["sourceFile"], code)
+            else:
+                await container_pool.run_io(_put_submission, container, job_id, language, code)
+            status = await _compile_in_container(
+                container_pool,
+                container,
+                language,
+                code,
+                job_id,
+                commands,
+                compile_command,
+            )
+        except BaseException:
+            container_pool.release_container(container)
+            raise
+        return container, status
+
+    # Compile once up front; the first case reuses this container
+    try:
+        first_container, compile_cache_status = await prepared_container()
+    except ValueError as e:
+        return None, str(e), []
+
+    semaphore = asyncio.Semaphore(container_pool.max_size)
+
+    async def run_case(case, container=None):
+        async with semaphore:
+            started = time.time()
+            try:
+                if container is None:
+                    container, _ = await prepared_container()
+            except Exception as e:
+                return _case_result(case, "", str(e), None, "internal_error", 0)
+            try:
+                output, error, exit_code, _, limit = await _exec_with_deadline(
+                    container_pool, container, exec_command, case.get("input"), timeout
+                )
+                if limit:
+                    EXECUTION_TIMEOUTS.inc(backend="pool", language=language)
+                verdict = _verdict(case, output, exit_code, limit is not None)
+            except Exception as e:
+                output, error, exit_code, verdict = "", str(e), None, "internal_error"
+            finally:
+                # A timed out program is killed when the container is recycled or replaced
+                container_pool.release_container(container)
+            return _case_result(
+                case, output, error, exit_code, verdict, time.time() - started
+            )
+
+    return (
+        compile_cache_status,
+        None,
+        await asyncio.gather(
+            run_case(cases[0], first_container), *map(run_case, cases[1:])
+        ),
+    )
+
+
+def _verdict(case: dict, output: str, exit_code: int, timed_out: bool):
+    if timed_out:
+        return "time_limit_exceeded"
+    if exit_code != 0:
+        return "runtime_error"
+    expected = case.get("expected_output")
+    if expected is None:
+        return "completed"
+    if _normalize_output(output) == _normalize_output(expected):
+        return "accepted"
+    return "wrong_answer"
+
+
+def _normalize_output(text: str):
+    # Judges conventionally ignore trailing whitespace on lines and trailing blank lines
+    return "\n".join(line.rstrip() for line in text.rstrip().splitlines())
+
+
+def _case_result(case, output, error, exit_code, verdict, execution_time):
+    return {
+        "input": case.get("input"),
+        "output": output,
+        "error": error,
+        "exit_code": exit_code,
+        "verdict": verdict,
+        "execution_time": execution_time,
+    }
+
+
+class _OutputCap:
+    """
+    Decodes output chunks per stream (stdout / stderr) and enforces a byte cap on each.
+    Multi-byte UTF-8 characters split across chunks are decoded once complete.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.sent = {"stdout": 0, "stderr": 0}
+        self.truncated = []
+        self._decoders = {
+            name: codecs.getincrementaldecoder("utf-8")("replace") for name in self.sent
+        }
+
+    def feed(self, name: str, chunk: bytes):
+        """
+        Returns the decoded text to forward and whether the stream just went over its cap.
+        """
+        remaining = self.max_bytes - self.sent[name]
+        exceeded = len(chunk) > remaining
+        if exceeded:
+            chunk = chunk[: max(remaining, 0)]
+            self.truncated.append(name)
+        self.sent[name] += len(chunk)
+        return self._decoders[name].decode(chunk, final=exceeded), exceeded
+
+    def flush(self, name: str):
+        return self._decoders[name].decode(b"", final=True)
+
+
+async def stream_code(
+    language: str = "",
+    code: str = "",
+    input: str = None,
+    container_pool: ContainerPool = None,
+    max_output_bytes: int = STREAM_MAX_OUTPUT_BYTES,
+    sandbox: bool = None,
+):
+    """
+    Compiles and executes code like `run_code`, but yields output as the program produces it
+    instead of buffering it, so memory stays bounded however much a submission prints.
+
+    Yields (event, data) tuples:
+    - ("stdout", str) / ("stderr", str) for each chunk of output.
+    - ("error", str) if the submission fails to compile; nothing else follows.
+    - ("exit", dict) last, with the exit code, which streams were truncated, whether the
+      run timed out and which limit stopped it, the execution time and the compile cache
+      status.
+
+    A stream that exceeds `max_output_bytes` is cut off there and the program is killed.
+    Closing the generator early (e.g. when the client disconnects) kills the program too.
+    Local runs use the process sandbox if `sandbox` (default: LOCAL_SANDBOX).
+
+    Raises:
+        ValueError: If no code is provided or if an unsupported language is specified.
+    """
+    validate_submission(language, code)
+
+    if container_pool:
+        stream = _stream_pool(language, code, input, container_pool, max_output_bytes)
+    else:
+        sandbox = LOCAL_SANDBOX if sandbox is None else sandbox
+        stream = _stream_local(language, code, input, max_output_bytes, sandbox=sandbox)
+    async for event in stream:
+        yield event
+
+
+async def _stream_local(language, code, input, max_output_bytes, timeout=RUN_TIMEOUT, sandbox=False):
+    start_time = time.time()
+    job = staging.new_job(language, code)
+    job_id = job["jobID"]
+    commands = command_map(job_id, language, job["directory"], job["directory"])
+    process = None
+    try:
+        try:
+            compile_cache_status = await _compile_local(language, code, job_id, commands)
+        except ValueError as e:
+            yield "error", str(e)
+            return
+
+        argv = [commands["executeCodeCommand"], *commands.get("executionArgs", [])]
+        env = None
+        if sandbox:
+            # The launcher applies the CPU limit inside the sandbox
+            argv = process_sandbox.command(argv, language, resource_profile([language]), CPU_TIME_LIMIT)
+            env = process_sandbox.environment()
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            env=env,
+        )
+        if not sandbox:
+            processes.limit_cpu(process.pid, CPU_TIME_LIMIT)
+        if input:
+            process.stdin.write(input.encode())
+        process.stdin.close()
+
+        cap = _OutputCap(max_output_bytes)
+        queue = asyncio.Queue()
+
+        async def pump(name, stream):
+            while True:
+                chunk = await stream.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    await queue.put((name, cap.flush(name)))
+                    break
+                text, exceeded = cap.feed(name, chunk)
+                await queue.put((name, text))
+                if exceeded:
+                    _kill(process)
+                    break
+            await queue.put(None)
+
+        pumps = [
+            asyncio.create_task(pump("stdout", process.stdout)),
+            asyncio.create_task(pump("stderr", process.stderr)),
+        ]
+        timed_out = False
+        try:
+            async for event in _drain(queue, len(pumps), start_time + timeout):
+                yield event
+        except asyncio.TimeoutError:
+            timed_out = True
+            EXECUTION_TIMEOUTS.inc(backend="local", language=language)
+            _kill(process)
+        finally:
+            for task in pumps:
+                task.cancel()
+
+        exit_code = await process.wait()
+        exit_signal = -exit_code if exit_code < 0 else None
+        yield "exit", {
+            "exit_code": exit_code,
+            "truncated": cap.truncated,
+            "timed_out": timed_out,
+            "limit": processes.limit_exceeded(timed_out, {"exit_signal": exit_signal}),
+            "execution_time": time.time() - start_time,
+            "compile_cache": compile_cache_status,
+        }
+    finally:
+        if process and process.returncode is None:
+            _kill(process)
+            await process.wait()
+        staging.release(job_id)
+
+
+async def _stream_pool(language, code, input, container_pool, max_output_bytes, timeout=RUN_TIMEOUT):
+    start_time = time.time()
+    container_pool = container_pool.pool_for(language)
+    container = await container_pool.acquire()
+    sock = None
+    try:
+        job_id = str(uuid4())
+        await container_pool.run_io(_put_submission, container, job_id, language, code)
+
+        commands, compile_command, exec_command = _container_commands(job_id, language)
+        try:
+            compile_cache_status = await _compile_in_container(
+                container_pool,
+                container,
+                language,
+                code,
+                job_id,
+                commands,
+                compile_command,
+            )
+        except ValueError as e:
+            yield "error", str(e)
+            return
+
+        api = container.client.api
+        shim = LIMIT_SHIM.format(timeout=f"{timeout:g}", **_cpu_limits())
+        exec_id = await container_pool.run_io(
+            api.exec_create,
+            container.id,
+            ["sh", "-c", shim, "sh", *shlex.split(exec_command)],
+            stdin=True,
+        )
+        sock = await container_pool.run_io(api.exec_start, exec_id, socket=True)
+        await container_pool.run_io(_send_stdin, sock, input)
+
+        cap = _OutputCap(max_output_bytes)
+        queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        emit = lambda event: loop.call_soon_threadsafe(queue.put_nowait, event)
+        pump = loop.run_in_executor(
+            container_pool.io_executor, _pump_exec_socket, sock, cap, emit
+        )
+
+        timed_out = False
+        try:
+            async for event in _drain(queue, 1, start_time + timeout):
+                yield event
+        except asyncio.TimeoutError:
+            timed_out = True
+            EXECUTION_TIMEOUTS.inc(backend="pool", language=language)
+        finally:
+            # Unblocks the pump if it is still reading; the leftover process is killed when the
+            # container is recycled or replaced.
+            _shutdown_socket(sock)
+            await asyncio.wait([pump])
+
+        info = await container_pool.run_io(api.exec_inspect, exec_id)
+        exit_code = info.get("ExitCode")
+        timed_out = timed_out or exit_code == TIMEOUT_EXIT_CODE
+        exit_signal = exit_code - 128 if exit_code is not None and exit_code > 128 else None
+        yield "exit", {
+            "exit_code": exit_code,
+            "truncated": cap.truncated,
+            "timed_out": timed_out,
+            "limit": processes.limit_exceeded(timed_out, {"exit_signal": exit_signal}),
+            "execution_time": time.time() - start_time,
+            "compile_cache": compile_cache_status,
+        }
+    finally:
+        if sock is not None:
+            _shutdown_socket(sock)
+        container_pool.release_container(container)
+
+
+async def _drain(queue: asyncio.Queue, producers: int, deadline: float):
+    # Yields queued output events until every producer has signalled completion with None
+    done = 0
+    while done < producers:
+        event = await asyncio.wait_for(queue.get(), max(deadline - time.time(), 0))
+        if event is None:
+            done += 1
+        elif event[1]:
+            yield event
+
+
+def _send_stdin(sock, input: str = None):
+    # Writes the program input to an exec socket, then half-closes it to signal EOF
+    raw = sock._sock
+    if input is not None:
+        raw.sendall((input + "\n").encode())
+    raw.shutdown(pysocket.SHUT_WR)
+
+
+def _pump_exec_socket(sock, cap: _OutputCap, emit):
+    """
+    Reads multiplexed frames from an exec socket and emits decoded ("stdout" / "stderr", str)
+    events until the program exits or a stream goes over its cap. Blocking; runs on the
+    pool's I/O executor.
+    """
+    try:
+        for stream_id, data in frames_iter(sock, tty=False):
+            name = "stdout" if stream_id == STDOUT else "stderr"
+            text, exceeded = cap.feed(name, data)
+            emit((name, text))
+            if exceeded:
+                break
+    except OSError:
+        pass  # The socket was shut down from the event loop
+    finally:
+        for name in ("stdout", "stderr"):
+            emit((name, cap.flush(name)))
+        emit(None)
+
+
+def _shutdown_socket(sock):
+    raw = sock._sock
+    if raw is None:
+        return  # Already closed
+    try:
+        raw.shutdown(pysocket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+def _kill(process):
+    # Kills the program and everything it started, in its own session
+    if process.returncode is None:
+        processes.kill_group(process.pid)
+
+
 async def test():
     """
     Basic testing method.
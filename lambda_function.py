@@ -1,7 +1,19 @@
 import json
+import math
 import os
+import shutil
 import subprocess
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.compile_cache import CompileCache, toolchain_version
+from utils.jvm_service import JvmCompileService
+from utils import processes
+from utils.warm_workers import WarmWorkers
+
+# Lives in /tmp, so compiled artifacts survive across warm invocations of this container
+compile_cache = CompileCache()
 
 # Define commands for each language
 LANGUAGE_COMMANDS = {
@@ -11,16 +23,20 @@ LANGUAGE_COMMANDS = {
     },
     "java": {
         "compile": ["javac"],
-        "execute": ["java"],
+        "compile_args": ["-d"],
+        "execute": ["java", "-cp"],
         "file_ext": "java",
+        "output_ext": "classes",
+        "version": "javac -version",
         "env": {"JAVA_OPTS": "-Xmx256m -Xms128m"},
     },
     "cpp": {
         "compile": ["g++"],
-        "compile_args": ["-o", "/tmp/temp_code_cpp.out"],
-        "execute": ["/tmp/temp_code_cpp.out"],
+        "compile_args": ["-o"],
+        "execute": [],
         "file_ext": "cpp",
         "output_ext": "out",
+        "version": "g++ --version",
     },
     "c": {
         "compile": ["gcc"],
@@ -28,29 +44,35 @@ LANGUAGE_COMMANDS = {
         "execute": [],
         "file_ext": "c",
         "output_ext": "out",
+        "version": "gcc --version",
     },
     "js": {
         "execute": ["node"],
         "file_ext": "js",
     },
     "go": {
-        "execute": ["/usr/local/go/bin/go", "run"],
+        "compile": ["/usr/local/go/bin/go", "build"],
+        "compile_args": ["-o"],
+        "execute": [],
         "file_ext": "go",
-        "env": {"GOCACHE": "/tmp/.cache/go-build", "HOME": "/tmp"},
+        "output_ext": "out",
+        "version": "/usr/local/go/bin/go version",
+        "env": {"GOCACHE": "/tmp/.cache/go-build", "HOME": "/tmp", "CGO_ENABLED": "0"},
     },
     "kt": {
         "compile": ["kotlinc"],
         "compile_args": [
             "-include-runtime",
-            "-d",
             "-J-Xmx256m",
             "-J-Xms256m",  # Make initial heap same as max to avoid resizing
             "-J-XX:+TieredCompilation",
             "-J-XX:TieredStopAtLevel=1",  # Faster JVM startup
+            "-d",
         ],
         "execute": ["java", "-jar"],
         "file_ext": "kt",
         "output_ext": "jar",
+        "version": "kotlinc -version",
     },
 }
 
@@ -72,7 +94,99 @@ def get_sanitized_env():
     }
     return base_env
 
+# Hard limits per invocation: wall-clock seconds to compile and to run, and CPU seconds the
+# run may use. Both deadlines kill the whole process group.
+COMPILE_TIMEOUT = float(os.getenv("COMPILE_TIMEOUT", 20))
+RUN_TIMEOUT = float(os.getenv("RUN_TIMEOUT", 30))
+CPU_TIME_LIMIT = int(os.getenv("CPU_TIME_LIMIT", RUN_TIMEOUT))
+
+LIMIT_MESSAGES = {
+    "compile_time": f"Compilation timed out after {COMPILE_TIMEOUT:g} seconds (compile time limit)",
+    "wall_time": f"Execution timed out after {RUN_TIMEOUT:g} seconds (wall-clock limit)",
+    "cpu_time": f"Execution exceeded the CPU time limit of {CPU_TIME_LIMIT} seconds",
+}
+
+# Standard library build cache baked into the image (see utils/go/warm.go)
+GO_CACHE_SEED = os.getenv("GO_CACHE_SEED", "/opt/go-cache")
+
+def seed_go_cache(gocache):
+    """
+    Copies the image's read-only Go build cache into the writable GOCACHE once per execution
+    environment, so `go build` only compiles the submission itself, not the packages it imports.
+    Concurrent callers each copy into a staging directory of their own; the first rename wins.
+    """
+    if os.path.isdir(GO_CACHE_SEED) and not os.path.isdir(gocache):
+        os.makedirs(os.path.dirname(gocache), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix="go-build.seed-", dir=os.path.dirname(gocache))
+        shutil.copytree(GO_CACHE_SEED, staging, dirs_exist_ok=True)
+        try:
+            os.rename(staging, gocache)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+# Warm interpreters (WARM_WORKERS=py,js) outlive the invocation, so later invocations in the
+# same execution environment skip interpreter startup
+warm_workers = WarmWorkers.from_env(env=get_sanitized_env())
+
+# Warm javac / kotlinc (JVM_COMPILE_SERVICE=true), with CDS archives built into the image
+jvm_service = JvmCompileService.from_env()
+
+# Each submission gets its own directory under here, removed when it finishes. Everything
+# else in /tmp (compile cache, Go build cache, HOME) is warm state shared across submissions
+# and kept between invocations.
+SANDBOX_ROOT = os.getenv("LAMBDA_SANDBOX_ROOT", "/tmp/glimpse-sandboxes")
+
+# Most submissions one envelope invocation may carry
+ENVELOPE_MAX_SUBMISSIONS = int(os.getenv("ENVELOPE_MAX_SUBMISSIONS", 32))
+
+def envelope_workers():
+    """
+    Submissions an envelope runs at once: one per vCPU, which Lambda allocates at one per
+    1769 MB of configured memory, and no more than fit with a 256 MB JVM heap each.
+    """
+    if os.getenv("ENVELOPE_WORKERS"):
+        return int(os.getenv("ENVELOPE_WORKERS"))
+    memory = int(os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", 0))
+    if not memory:
+        return os.cpu_count() or 1
+    return max(1, min(math.ceil(memory / 1769), memory // 256))
+
+# Kept across warm invocations, like the interpreters above
+envelope_pool = ThreadPoolExecutor(max_workers=envelope_workers(), thread_name_prefix="submission")
+
 def lambda_handler(event, context):
+    """
+    Runs one submission ({"language", "code", "input"}), or an envelope of them
+    ({"submissions": [...]}) concurrently. Safe to call from several threads at once.
+    """
+    if "submissions" in event:
+        return run_envelope(event["submissions"])
+    return run_submission(event)
+
+def run_envelope(submissions):
+    """
+    Runs a batch of submissions in one invocation, saving an invoke per submission. The body
+    holds a response per submission, in order, each shaped like a single-submission response.
+    """
+    if not isinstance(submissions, list) or not 0 < len(submissions) <= ENVELOPE_MAX_SUBMISSIONS:
+        return {
+            "statusCode": 400,
+            "body": json.dumps(
+                {"error": f"An envelope carries 1 to {ENVELOPE_MAX_SUBMISSIONS} submissions"}
+            ),
+        }
+    responses = list(envelope_pool.map(run_submission, submissions))
+    return {"statusCode": 200, "body": json.dumps({"responses": responses})}
+
+def run_submission(event):
+    os.makedirs(SANDBOX_ROOT, exist_ok=True)
+    sandbox = tempfile.mkdtemp(dir=SANDBOX_ROOT)
+    try:
+        return _run_submission(event, sandbox)
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+def _run_submission(event, sandbox):
     try:
         # Extract code and language from the event
         language = event.get("language")
@@ -85,8 +199,10 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": f"Unsupported language: {language}"}),
             }
 
-        # Start timing
+        # Start timing. Phases are timed on the monotonic clock; there is no queue in here.
         start_time = time.time()
+        clock = time.monotonic()
+        usage = {"queue_wait": 0.0}
 
         # Get language details
         lang_config = LANGUAGE_COMMANDS[language]
@@ -95,80 +211,120 @@ def lambda_handler(event, context):
         lang_specific_env = lang_config.get("env", {})  # e.g., {"GOCACHE": ...} for Go
         env_for_subprocess = {**get_sanitized_env(), **lang_specific_env}
 
-        # Create a temporary file to save the code
-        code_file = (
-            "/tmp/Main.java" if language == "java" else f"/tmp/temp_code.{file_ext}"
+        # Save the code in this submission's sandbox
+        code_file = os.path.join(
+            sandbox, "Main.java" if language == "java" else f"temp_code.{file_ext}"
         )
         with open(code_file, "w") as f:
             f.write(code)
+        usage["staging"] = time.monotonic() - clock
+        clock = time.monotonic()
 
         # Initialize output_file variable for compiled languages
         output_file = None
+        cached_artifact = None
+        compile_cache_status = None
 
-        # Compile code if needed
+        # Compile code if needed, unless an identical build is already cached
         if "compile" in lang_config:
-            compile_command = lang_config["compile"] + [code_file]
+            cache_key = compile_cache.make_key(
+                language,
+                code,
+                lang_config["compile"] + lang_config.get("compile_args", []),
+                toolchain_version(lang_config["version"]),
+            )
+            cached_artifact = compile_cache.get(cache_key)
+
+        if cached_artifact:
+            output_file = str(cached_artifact)
+            compile_cache_status = "hit"
+        elif "compile" in lang_config:
+            # Options go before the source file, as `go build` requires
+            compile_command = list(lang_config["compile"])
             if "compile_args" in lang_config:
-                output_file = f"/tmp/temp_code.{lang_config['output_ext']}"
+                output_file = os.path.join(sandbox, f"temp_code.{lang_config['output_ext']}")
                 compile_command.extend(lang_config["compile_args"])
                 compile_command.append(output_file)
+            compile_command.append(code_file)
+            if language == "go":
+                seed_go_cache(lang_specific_env["GOCACHE"])
 
             # Run the compile command with timeout
             try:
-                compile_result = subprocess.run(
-                    compile_command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=20,
-                    env=env_for_subprocess,
-                )
-                if compile_result.returncode != 0:
+                if jvm_service and language in ("java", "kt"):
+                    returncode, diagnostics, _ = jvm_service.compile(
+                        language, code_file, output_file, timeout=COMPILE_TIMEOUT
+                    )
+                else:
+                    # Kills the compiler's whole process group at the deadline
+                    _, stderr, returncode, timed_out, _ = processes.run(
+                        compile_command, None, timeout=COMPILE_TIMEOUT, env=env_for_subprocess
+                    )
+                    if timed_out:
+                        raise subprocess.TimeoutExpired(compile_command, COMPILE_TIMEOUT)
+                    diagnostics = stderr.decode()
+                if returncode != 0:
                     return {
                         "statusCode": 200,
-                        "body": json.dumps(
-                            {"output": "", "error": compile_result.stderr.decode()}
-                        ),
+                        "body": json.dumps({"output": "", "error": diagnostics}),
                     }
             except subprocess.TimeoutExpired:
                 return {
                     "statusCode": 200,
                     "body": json.dumps(
-                        {"output": "", "error": "Compilation timed out"}
+                        {
+                            "output": "",
+                            "error": LIMIT_MESSAGES["compile_time"],
+                            "limit": "compile_time",
+                        }
                     ),
                 }
 
+            if output_file:
+                output_file = str(compile_cache.put(cache_key, output_file))
+            compile_cache_status = "miss"
+
+        usage["compile"] = time.monotonic() - clock
+        clock = time.monotonic()
+
         # Prepare the execution command
         if output_file:
+            execute = lang_config["execute"]
+            if jvm_service and language in ("java", "kt"):
+                execute = execute[:1] + jvm_service.run_flags() + execute[1:]
             if language == "kt":
-                execute_command = lang_config["execute"] + [output_file]
+                execute_command = execute + [output_file]
+            elif language == "java":
+                execute_command = execute + [output_file, "Main"]
             else:
                 execute_command = [output_file]
         else:
             execute_command = lang_config["execute"] + [code_file]
 
-        # Run the code using subprocess
-        exec_process = subprocess.Popen(
-            execute_command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=env_for_subprocess,
-        )
-
-        # If input is provided, pass it to the process
-        if input_data:
-            stdout, stderr = exec_process.communicate(input=input_data.encode())
+        if warm_workers.handles(language):
+            stdout, stderr, returncode, timed_out, process_usage = warm_workers.run(
+                language, code_file, input_data, RUN_TIMEOUT, CPU_TIME_LIMIT
+            )
         else:
-            stdout, stderr = exec_process.communicate()
-
-        # Wait for the process to complete
-        exec_process.wait()
+            # Run the code, reaping it ourselves to collect its rusage
+            stdout, stderr, returncode, timed_out, process_usage = processes.run(
+                execute_command,
+                input_data,
+                timeout=RUN_TIMEOUT,
+                env=env_for_subprocess,
+                cpu_limit=CPU_TIME_LIMIT,
+            )
+        usage["run"] = time.monotonic() - clock
+        usage.update(process_usage)
+        limit = processes.limit_exceeded(timed_out, process_usage)
+        if limit:
+            stderr = LIMIT_MESSAGES[limit].encode()
 
         # Calculate execution time
         execution_time = time.time() - start_time
 
         # Check for runtime errors
-        if exec_process.returncode != 0:
+        if returncode != 0:
             return {
                 "statusCode": 200,
                 "body": json.dumps(
@@ -176,6 +332,9 @@ def lambda_handler(event, context):
                         "output": "",
                         "error": stderr.decode(),
                         "executionTime": execution_time,
+                        "usage": usage,
+                        "limit": limit,
+                        "compileCache": compile_cache_status,
                     }
                 ),
             }
@@ -187,6 +346,9 @@ def lambda_handler(event, context):
                     "output": stdout.decode(),
                     "error": "",
                     "executionTime": execution_time,
+                    "usage": usage,
+                    "limit": None,
+                    "compileCache": compile_cache_status,
                 }
             ),
         }
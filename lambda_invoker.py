@@ -0,0 +1,313 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from utils.metrics import registry
+
+LAMBDA_INVOKE = registry.histogram(
+    "glimpse_lambda_invoke_seconds",
+    "Latency of each Lambda invocation attempt",
+    ["outcome"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+LAMBDA_THROTTLES = registry.counter(
+    "glimpse_lambda_throttles_total", "Lambda invocations rejected with TooManyRequests"
+)
+LAMBDA_IN_FLIGHT = registry.gauge(
+    "glimpse_lambda_in_flight", "Lambda invocations currently in flight"
+)
+LAMBDA_BATCH_SIZE = registry.histogram(
+    "glimpse_lambda_batch_size",
+    "Submissions sent per Lambda invocation by the batcher",
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+
+
+class LambdaThrottled(Exception):
+    """Raised when Lambda keeps throttling an invocation after all retries."""
+
+
+class LambdaFunctionError(Exception):
+    """Raised when the function itself failed (the response carried a FunctionError)."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        super().__init__(payload.get("error") if isinstance(payload, dict) else payload)
+
+
+class Boto3Transport:
+    """
+    Invokes a Lambda function through boto3. The HTTP connection pool and the threads that
+    run the blocking `invoke` calls are sized together, so every in-flight call has a warm
+    connection and none of them block the event loop.
+    """
+
+    def __init__(self, function_name, region="us-east-1", max_connections=32, read_timeout=60):
+        self.function_name = function_name
+        self.client = boto3.client(
+            "lambda",
+            region_name=region,
+            config=Config(
+                max_pool_connections=max_connections,
+                read_timeout=read_timeout,
+                connect_timeout=5,
+                tcp_keepalive=True,
+                # Throttling is retried by LambdaInvoker, with jitter and outside the concurrency limit
+                retries={"max_attempts": 0},
+            ),
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_connections, thread_name_prefix="lambda-invoke"
+        )
+
+    async def invoke(self, payload: dict):
+        if not self.function_name:
+            raise RuntimeError("LAMBDA_FUNCTION_NAME is not set.")
+
+        loop = asyncio.get_running_loop()
+        try:
+            response = await loop.run_in_executor(
+                self.executor,
+                functools.partial(
+                    self.client.invoke,
+                    FunctionName=self.function_name,
+                    InvocationType="RequestResponse",
+                    Payload=json.dumps(payload),
+                ),
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "TooManyRequestsException":
+                raise LambdaThrottled(str(e)) from e
+            raise
+
+        response_payload = json.loads(
+            await loop.run_in_executor(self.executor, response["Payload"].read)
+        )
+        if response.get("FunctionError"):
+            raise LambdaFunctionError(response_payload)
+        return response_payload
+
+
+class LocalTransport:
+    """
+    Stand-in for Lambda that calls `lambda_function.lambda_handler` in-process on a thread
+    pool, so the gateway can be load-tested without AWS.
+    """
+
+    def __init__(self, max_workers=32):
+        import lambda_function
+
+        self.handler = lambda_function.lambda_handler
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="lambda-local"
+        )
+
+    async def invoke(self, payload: dict):
+        loop = asyncio.get_running_loop()
+        # Round-trip through JSON like the real service does
+        event = json.loads(json.dumps(payload))
+        response = await loop.run_in_executor(self.executor, self.handler, event, None)
+        return json.loads(json.dumps(response))
+
+
+class LambdaInvoker:
+    """
+    Async Lambda invocation layer with a concurrency limit and retries on throttling.
+
+    At most `concurrency` invocations are in flight at once; callers beyond that wait their
+    turn. Throttled invocations are retried up to `max_retries` times with full-jitter
+    exponential backoff, releasing their concurrency slot while they back off.
+    """
+
+    def __init__(self, transport, concurrency=32, max_retries=4, base_delay=0.05, max_delay=2.0):
+        self.transport = transport
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.throttles = 0
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds an invoker from LAMBDA_TRANSPORT ("boto3" or "local"), LAMBDA_FUNCTION_NAME,
+        AWS_REGION, LAMBDA_CONCURRENCY and LAMBDA_MAX_RETRIES. With LAMBDA_BATCH_WINDOW_MS
+        set, it is wrapped in a LambdaBatcher.
+        """
+        concurrency = int(os.getenv("LAMBDA_CONCURRENCY", 32))
+        if os.getenv("LAMBDA_TRANSPORT", "boto3") == "local":
+            transport = LocalTransport(max_workers=concurrency)
+        else:
+            transport = Boto3Transport(
+                os.getenv("LAMBDA_FUNCTION_NAME"),
+                region=os.getenv("AWS_REGION", "us-east-1"),
+                max_connections=concurrency,
+            )
+        invoker = cls(
+            transport,
+            concurrency=concurrency,
+            max_retries=int(os.getenv("LAMBDA_MAX_RETRIES", 4)),
+        )
+        window = float(os.getenv("LAMBDA_BATCH_WINDOW_MS", 0)) / 1000
+        if window > 0:
+            return LambdaBatcher(invoker, window, int(os.getenv("LAMBDA_BATCH_SIZE", 16)))
+        return invoker
+
+    async def invoke(self, payload: dict):
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                self.in_flight += 1
+                LAMBDA_IN_FLIGHT.set(self.in_flight)
+                started = time.monotonic()
+                outcome = "error"
+                try:
+                    result = await self.transport.invoke(payload)
+                    outcome = "ok"
+                    return result
+                except LambdaThrottled:
+                    outcome = "throttled"
+                    self.throttles += 1
+                    LAMBDA_THROTTLES.inc()
+                    if attempt >= self.max_retries:
+                        raise
+                finally:
+                    self.in_flight -= 1
+                    LAMBDA_IN_FLIGHT.set(self.in_flight)
+                    LAMBDA_INVOKE.observe(time.monotonic() - started, outcome=outcome)
+
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+            self.logger.warning(f"Lambda throttled, retrying in {delay:.3f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "throttles": self.throttles,
+        }
+
+
+class LambdaBatcher:
+    """
+    Coalesces concurrent submissions into envelope invocations ({"submissions": [...]}, see
+    `lambda_function.run_envelope`), saving the invoke latency and billing granularity of
+    many small ones. Has the same interface as LambdaInvoker, which it sends batches through.
+
+    A batch goes out `window` seconds after its first submission arrives, or as soon as it
+    holds `max_size`. Each caller gets its own submission's response. Submissions fail
+    independently: if the envelope as a whole fails (e.g. one submission crashed the
+    function), each of them is retried in an invocation of its own.
+    """
+
+    def __init__(self, invoker: LambdaInvoker, window: float = 0.005, max_size: int = 16):
+        self.invoker = invoker
+        self.window = window
+        self.max_size = max_size
+        self.batches = 0
+        self.batched = 0
+        self._pending = []
+        self._timer = None
+        self._sending = set()
+        self._sent = 0
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def concurrency(self):
+        # Each invocation may carry a whole batch
+        return self.invoker.concurrency * self.max_size
+
+    @property
+    def in_flight(self):
+        # Submissions waiting for their batch to go out count too
+        return len(self._pending) + self._sent
+
+    async def invoke(self, payload: dict):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch):
+        LAMBDA_BATCH_SIZE.observe(len(batch))
+        self.batches += 1
+        self.batched += len(batch)
+        self._sent += len(batch)
+        try:
+            await self._send_batch(batch)
+        finally:
+            self._sent -= len(batch)
+
+    async def _send_batch(self, batch):
+        if len(batch) == 1:
+            await self._send_one(*batch[0])
+            return
+        try:
+            response = await self.invoker.invoke({"submissions": [payload for payload, _ in batch]})
+            if response.get("statusCode") != 200:
+                raise LambdaFunctionError(json.loads(response["body"]))
+            responses = json.loads(response["body"])["responses"]
+        except LambdaThrottled as e:
+            for _, future in batch:
+                _resolve(future, exception=e)
+            return
+        except Exception as e:
+            self.logger.warning(f"Batch of {len(batch)} failed ({e!r}), invoking them one by one")
+            await asyncio.gather(*(self._send_one(payload, future) for payload, future in batch))
+            return
+        for (_, future), result in zip(batch, responses):
+            _resolve(future, result=result)
+
+    async def _send_one(self, payload, future):
+        try:
+            result = await self.invoker.invoke(payload)
+        except Exception as e:
+            _resolve(future, exception=e)
+        else:
+            _resolve(future, result=result)
+
+    def stats(self):
+        return {
+            **self.invoker.stats(),
+            "batch_window": self.window,
+            "batch_size": self.max_size,
+            "batches": self.batches,
+            "mean_batch_size": self.batched / self.batches if self.batches else None,
+        }
+
+
+def _resolve(future, result=None, exception=None):
+    # The caller may have gone away (e.g. the client disconnected) while its batch was out
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
@@ -0,0 +1,247 @@
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+from utils.metrics import registry
+
+ADMISSIONS = registry.counter(
+    "glimpse_admission_decisions_total",
+    "Admission decisions, by outcome (admitted, client_limited, shed, saturated, unavailable)",
+    ["outcome"],
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS costs (
+    language TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (language, phase)
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id TEXT PRIMARY KEY,
+    cost REAL NOT NULL,
+    started REAL NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# Starting estimates, in seconds, until timings have been observed for a language
+DEFAULT_COSTS = {
+    "compile": {"java": 1.5, "kt": 4.0, "cpp": 1.0, "c": 0.3, "go": 1.0},
+    "run": {"java": 0.3, "kt": 0.3},
+}
+DEFAULT_RUN_COST = 0.1
+
+# Every request costs at least this much, for the work around the program itself
+MIN_COST = 0.05
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is not admitted. `status_code` is 429 when the client is over its
+    budget and 503 when the host is out of capacity; `retry_after` is in seconds.
+    """
+
+    def __init__(self, status_code: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def headers(self):
+        return {"Retry-After": str(max(math.ceil(self.retry_after), 1))}
+
+
+class AdmissionController:
+    """
+    Admits requests by their expected cost, in seconds of work, rather than counting them.
+
+    Each language's compile and run phases have a cost learned from observed timings, so a
+    Kotlin compile weighs more than a Python `print`. Two budgets are enforced:
+
+    - per client, a token bucket refilled at `client_rate` seconds of work per minute, up
+      to `client_burst`; over it, requests get a 429.
+    - per host, `capacity` seconds of admitted work in flight; past it, or when the backend
+      a request needs is saturated, requests are shed with a 503.
+
+    Both carry a Retry-After estimate. The state lives in a SQLite database at
+    ADMISSION_STATE_PATH, so every API worker process on the host shares one set of budgets.
+    Its calls block on SQLite, so async callers run them on a thread. If the database stays
+    locked for `busy_timeout` seconds, requests are let through rather than failed.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        capacity: float = None,
+        client_rate: float = None,
+        client_burst: float = None,
+        lease: float = 120,
+        alpha: float = 0.2,
+        busy_timeout: float = 1,
+    ):
+        self.path = path or os.getenv("ADMISSION_STATE_PATH") or os.path.join(
+            tempfile.gettempdir(), "glimpse-admission.db"
+        )
+        self.capacity = capacity if capacity is not None else float(
+            os.getenv("ADMISSION_CAPACITY", 4 * (os.cpu_count() or 1))
+        )
+        self.client_rate = client_rate if client_rate is not None else float(
+            os.getenv("ADMISSION_CLIENT_RATE", 30)
+        )
+        self.client_burst = client_burst if client_burst is not None else float(
+            os.getenv("ADMISSION_CLIENT_BURST", self.client_rate)
+        )
+        # Tickets of a process that died without releasing them expire after this long
+        self.lease = lease
+        self.alpha = alpha
+        self.enabled = True
+        self.logger = logging.getLogger(__name__)
+        self._db = sqlite3.connect(
+            self.path, timeout=busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def estimate(self, language: str, runs: int = 1):
+        """
+        Expected seconds of work to compile `language` once and run it `runs` times.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT phase, seconds FROM costs WHERE language = ?", (language,)
+            ).fetchall()
+        learned = dict(rows)
+        compile = learned.get("compile", DEFAULT_COSTS["compile"].get(language, 0.0))
+        run = learned.get("run", DEFAULT_COSTS["run"].get(language, DEFAULT_RUN_COST))
+        return max(compile + run * runs, MIN_COST)
+
+    def admit(self, client: str, language: str, runs: int = 1, saturated: bool = False, hold: bool = True):
+        """
+        Charges a request to `client` and, if `hold`, to the host's capacity until it is
+        released. Returns a ticket to pass to `release`. Queued work that doesn't run here
+        (e.g. /jobs) passes `hold=False`.
+
+        Raises:
+            Overloaded: If the client is over budget, the host is at capacity, or
+                `saturated` (the backend the request needs has nothing free).
+        """
+        if not self.enabled:
+            return None
+        cost = self.estimate(language, runs)
+        if saturated:
+            ADMISSIONS.inc(outcome="saturated")
+            raise Overloaded(503, cost, "Backend is saturated")
+
+        ticket = str(uuid4()) if hold else None
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                # Fail open: a stuck state database shouldn't take the API down with it
+                self.logger.warning(f"Admitting without admission control: {e}")
+                ADMISSIONS.inc(outcome="unavailable")
+                return None
+            try:
+                self._db.execute("DELETE FROM tickets WHERE expires < ?", (now,))
+                self._charge(client, cost, now)
+                if hold:
+                    self._reserve(ticket, cost, now)
+            except Overloaded as e:
+                self._db.execute("ROLLBACK")
+                ADMISSIONS.inc(outcome="client_limited" if e.status_code == 429 else "shed")
+                raise
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        ADMISSIONS.inc(outcome="admitted")
+        return ticket
+
+    def _charge(self, client, cost, now):
+        row = self._db.execute(
+            "SELECT tokens, updated FROM buckets WHERE client = ?", (client,)
+        ).fetchone()
+        tokens = self.client_burst
+        if row is not None:
+            tokens = min(self.client_burst, row[0] + (now - row[1]) * self.client_rate / 60)
+        # A request bigger than the whole burst needs a full bucket rather than never fitting
+        cost = min(cost, self.client_burst)
+        if tokens < cost:
+            raise Overloaded(429, (cost - tokens) * 60 / self.client_rate, "Rate limit exceeded")
+        self._db.execute(
+            "INSERT INTO buckets (client, tokens, updated) VALUES (?, ?, ?)"
+            " ON CONFLICT (client) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+            (client, tokens - cost, now),
+        )
+
+    def _reserve(self, ticket, cost, now):
+        in_flight, soonest = self._db.execute(
+            "SELECT COALESCE(SUM(cost), 0), MIN(started + cost) FROM tickets"
+        ).fetchone()
+        # A lone request is always let through, however large
+        if in_flight and in_flight + cost > self.capacity:
+            raise Overloaded(503, soonest - now, "Server is at capacity")
+        self._db.execute(
+            "INSERT INTO tickets (id, cost, started, expires) VALUES (?, ?, ?, ?)",
+            (ticket, cost, now, now + self.lease),
+        )
+
+    def release(self, ticket: str, language: str = None, usage: dict = None):
+        """
+        Returns a ticket's capacity and learns from the run's usage breakdown, if given.
+        """
+        with self._lock:
+            try:
+                if ticket is not None:
+                    self._db.execute("DELETE FROM tickets WHERE id = ?", (ticket,))
+                if language is not None and usage:
+                    for phase in ("compile", "run"):
+                        if usage.get(phase) is not None:
+                            self._learn(language, phase, usage[phase])
+            except sqlite3.OperationalError as e:
+                # The ticket expires after `lease` seconds instead
+                self.logger.warning(f"Failed to release admission ticket: {e}")
+
+    def _learn(self, language, phase, seconds):
+        self._db.execute(
+            "INSERT INTO costs (language, phase, seconds, samples) VALUES (?, ?, ?, 1)"
+            " ON CONFLICT (language, phase) DO UPDATE SET"
+            " seconds = (1 - ?) * seconds + ? * excluded.seconds, samples = samples + 1",
+            (language, phase, seconds, self.alpha, self.alpha),
+        )
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            in_flight, tickets = self._db.execute(
+                "SELECT COALESCE(SUM(cost), 0), COUNT(*) FROM tickets WHERE expires >= ?", (now,)
+            ).fetchone()
+            costs = self._db.execute("SELECT language, phase, seconds, samples FROM costs").fetchall()
+        learned = {}
+        for language, phase, seconds, samples in costs:
+            learned.setdefault(language, {})[phase] = {"seconds": seconds, "samples": samples}
+        return {
+            "enabled": self.enabled,
+            "capacity": self.capacity,
+            "in_flight": in_flight,
+            "requests": tickets,
+            "client_rate": self.client_rate,
+            "client_burst": self.client_burst,
+            "costs": learned,
+        }
@@ -0,0 +1,156 @@
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "GLIMPSE_COMPILE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "glimpse-compile-cache"),
+)
+DEFAULT_MAX_BYTES = int(os.getenv("GLIMPSE_COMPILE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+@functools.lru_cache(maxsize=None)
+def toolchain_version(command: str):
+    """
+    Runs a version command (e.g. "g++ --version") once per process and returns its output,
+    so that artifacts built by one compiler release are never served for another.
+    Falls back to the command itself if the toolchain cannot be queried.
+    """
+    try:
+        result = subprocess.run(
+            command.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10
+        )
+    except (OSError, subprocess.SubprocessError):
+        return command
+    return (result.stdout or result.stderr).decode(errors="replace").strip() or command
+
+
+class CompileCache:
+    """
+    Content-addressed, size-bounded store for compiled artifacts (binaries, jars, class directories).
+
+    Entries are keyed on a hash of (language, source, compiler flags, toolchain version) and
+    stored as `<root>/<key>`. The modification time of an entry doubles as its LRU timestamp:
+    it is bumped on every hit and the oldest entries are evicted once the cache grows past
+    `max_bytes`. Writes go through a temporary name followed by an atomic rename, so several
+    processes can safely share one cache directory.
+
+    Handing out a path (from `get` or `put`) leases the entry for `lease` seconds, long
+    enough to copy or run it: eviction skips entries used more recently than that, in this
+    or any other process, even if the cache stays over `max_bytes` for a while.
+    """
+
+    def __init__(
+        self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES, lease: float = 120
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.lease = lease
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(language: str, source: str, flags=(), toolchain: str = ""):
+        """
+        Returns the hex digest identifying a compilation.
+        """
+        digest = hashlib.sha256()
+        for part in (language, toolchain, "\0".join(flags), source or ""):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the path of a cached artifact, or None on a miss.
+        """
+        path = self.root / key
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, artifact):
+        """
+        Copies a freshly compiled artifact (a file or a directory) into the cache and
+        returns the path of the cached copy.
+        """
+        staging = self.root / f".tmp-{uuid4()}"
+        if os.path.isdir(artifact):
+            shutil.copytree(artifact, staging)
+        else:
+            shutil.copy2(artifact, staging)
+        return self._commit(key, staging)
+
+    def put_bytes(self, key: str, data: bytes, mode: int = 0o755):
+        """
+        Stores a single-file artifact from memory, e.g. one copied out of a container.
+        """
+        staging = self.root / f".tmp-{uuid4()}"
+        with open(staging, "wb") as f:
+            f.write(data)
+        os.chmod(staging, mode)
+        return self._commit(key, staging)
+
+    def _commit(self, key: str, staging: Path):
+        path = self.root / key
+        try:
+            os.replace(staging, path)
+        except OSError:
+            # Another writer won the race for a directory entry; theirs is identical.
+            shutil.rmtree(staging, ignore_errors=True)
+        os.utime(path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in `max_bytes`, sparing
+        those still leased.
+        """
+        leased_since = time.time() - self.lease
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in self.root.iterdir():
+                if entry.name.startswith(".tmp-"):
+                    continue
+                size = _disk_usage(entry)
+                entries.append((_mtime(entry), size, entry))
+                total += size
+
+            entries.sort()
+            for mtime, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if mtime > leased_since:
+                    break  # Sorted by mtime, so every entry from here on is leased
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    entry.unlink(missing_ok=True)
+                total -= size
+
+
+def _mtime(path: Path):
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def _disk_usage(path: Path):
+    try:
+        if not path.is_dir():
+            return path.stat().st_size
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,51 @@
+// Builds nothing useful: it imports the standard library packages submissions commonly use,
+// so that building it at image build time fills GOCACHE with their compiled archives.
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"container/heap"
+	"container/list"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"math"
+	"math/big"
+	"math/bits"
+	"math/rand"
+	"os"
+	"regexp"
+	"sort"
+	"strconv"
+	"strings"
+	"sync"
+	"time"
+	"unicode"
+)
+
+var (
+	_ = bufio.NewReader
+	_ = bytes.NewBuffer
+	_ = heap.Init
+	_ = list.New
+	_ = json.Marshal
+	_ = errors.New
+	_ = io.EOF
+	_ = math.Max
+	_ = big.NewInt
+	_ = bits.OnesCount
+	_ = rand.Intn
+	_ = regexp.MustCompile
+	_ = sort.Ints
+	_ = strconv.Itoa
+	_ = strings.Fields
+	_ = sync.WaitGroup{}
+	_ = time.Now
+	_ = unicode.IsDigit
+)
+
+func main() {
+	fmt.Fprintln(os.Stdout, "warm")
+}
@@ -4,7 +4,12 @@ from typing import Literal
 supported_languages = ["java", "cpp", "py", "c", "js", "go"]
 
 
-def command_map(job_id: str, language: Literal["java", "cpp", "py", "c", "js", "go"]):
+def command_map(
+    job_id: str,
+    language: Literal["java", "cpp", "py", "c", "js", "go"],
+    submissions_dir: str = None,
+    outputs_dir: str = None,
+):
     """
     Takes in a job_id (a UUID assigned to a submission run task) and a programming language,
     returns the necessary commands that we need to execute the code provided.
@@ -12,49 +17,63 @@ def command_map(job_id: str, language: Literal["java", "cpp", "py", "c", "js", "
     :param job_id: A string representing the UUID of the job task we want to run.
     :param language: Valid language that we can execute. Current list of supported options is
     declared in this file.
+    :param submissions_dir: Directory holding the submitted source file. Defaults to ./submissions.
+    :param outputs_dir: Directory compiled binaries are written to. Defaults to ./outputs.
     """
     cwd = Path.cwd()
+    submissions = Path(submissions_dir) if submissions_dir else cwd / "submissions"
+    outputs = Path(outputs_dir) if outputs_dir else cwd / "outputs"
     languages = {
         "java": {
             "executeCodeCommand": "java",
-            "executionArgs": [str(cwd / "submissions" / f"{job_id}.java")],
+            "executionArgs": [str(submissions / f"{job_id}.java")],
             "compilerInfoCommand": "java --version",
         },
         "cpp": {
             "compileCodeCommand": "g++",
             "compilationArgs": [
-                str(cwd / "submissions" / f"{job_id}.cpp"),
+                str(submissions / f"{job_id}.cpp"),
                 "-o",
-                str(cwd / "outputs" / f"{job_id}.out"),
+                str(outputs / f"{job_id}.out"),
             ],
-            "executeCodeCommand": str(cwd / "outputs" / f"{job_id}.out"),
+            "executeCodeCommand": str(outputs / f"{job_id}.out"),
             "outputExt": "out",
+            "outputFile": str(outputs / f"{job_id}.out"),
             "compilerInfoCommand": "g++ --version",
         },
         "py": {
             "executeCodeCommand": "python3",
-            "executionArgs": [str(cwd / "submissions" / f"{job_id}.py")],
+            "executionArgs": [str(submissions / f"{job_id}.py")],
             "compilerInfoCommand": "python3 --version",
         },
         "c": {
             "compileCodeCommand": "gcc",
             "compilationArgs": [
-                str(cwd / "submissions" / f"{job_id}.c"),
+                str(submissions / f"{job_id}.c"),
                 "-o",
-                str(cwd / "outputs" / f"{job_id}.out"),
+                str(outputs / f"{job_id}.out"),
             ],
-            "executeCodeCommand": str(cwd / "outputs" / f"{job_id}.out"),
+            "executeCodeCommand": str(outputs / f"{job_id}.out"),
             "outputExt": "out",
+            "outputFile": str(outputs / f"{job_id}.out"),
             "compilerInfoCommand": "gcc --version",
         },
         "js": {
             "executeCodeCommand": "node",
-            "executionArgs": [str(cwd / "submissions" / f"{job_id}.js")],
+            "executionArgs": [str(submissions / f"{job_id}.js")],
             "compilerInfoCommand": "node --version",
         },
         "go": {
-            "executeCodeCommand": "go",
-            "executionArgs": ["run", str(cwd / "submissions" / f"{job_id}.go")],
+            "compileCodeCommand": "go",
+            "compilationArgs": [
+                "build",
+                "-o",
+                str(outputs / f"{job_id}.out"),
+                str(submissions / f"{job_id}.go"),
+            ],
+            "executeCodeCommand": str(outputs / f"{job_id}.out"),
+            "outputExt": "out",
+            "outputFile": str(outputs / f"{job_id}.out"),
             "compilerInfoCommand": "go version",
         },
     }
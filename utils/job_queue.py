@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    backend TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    """
+    A durable job queue in a SQLite database, shared by the API and any number of worker
+    processes (see worker.py) without an outside service.
+
+    Jobs move from "queued" to "running" when a worker claims them, then to "done" or
+    "failed". A claim is a lease: if the worker dies, the job is queued again once the lease
+    expires, up to `max_attempts` claims.
+
+    The database lives at JOB_QUEUE_PATH (a local temp file by default). It runs in WAL
+    mode, which needs a local filesystem, so the API and its workers share one host.
+    """
+
+    def __init__(self, path: str = None, lease: float = None, max_attempts: int = 2):
+        self.path = path or os.getenv("JOB_QUEUE_PATH") or os.path.join(
+            tempfile.gettempdir(), "glimpse-queue.db"
+        )
+        self.lease = lease if lease is not None else float(os.getenv("JOB_LEASE_SECONDS", 120))
+        self.max_attempts = max_attempts
+        self._db = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            # WAL lets the API read results while workers write
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def submit(self, backend: str, payload: dict):
+        """
+        Queues a job and returns its id.
+        """
+        job_id = str(uuid4())
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, backend, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, backend, json.dumps(payload), time.time()),
+            )
+        return job_id
+
+    def claim(self, worker: str, backends=("local", "pool")):
+        """
+        Takes the oldest queued job for one of `backends`, or one whose worker's lease ran out.
+        Returns (job_id, backend, payload), or None if there is nothing to do.
+        """
+        now = time.time()
+        placeholders = ",".join("?" for _ in backends)
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'The worker running this job was lost',"
+                " finished_at = ? WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = self._db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?,"
+                " lease_expires = ?, attempts = attempts + 1"
+                " WHERE id = ("
+                f"  SELECT id FROM jobs WHERE backend IN ({placeholders})"
+                "   AND (status = 'queued' OR (status = 'running' AND lease_expires < ?))"
+                "   ORDER BY created_at LIMIT 1"
+                ") RETURNING id, backend, payload",
+                (worker, now, now + self.lease, *backends, now),
+            ).fetchone()
+        if row is None:
+            return None
+        return row["id"], row["backend"], json.loads(row["payload"])
+
+    def complete(self, job_id: str, result: dict):
+        self._finish(job_id, "done", result=json.dumps(result))
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, "failed", error=error)
+
+    def _finish(self, job_id: str, status: str, result: str = None, error: str = None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?,"
+                " lease_expires = NULL WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+    def get(self, job_id: str):
+        """
+        Returns a job's status and, once finished, its result or error. None if unknown.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "backend": row["backend"],
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+
+    async def wait(self, job_id: str, timeout: float = 0):
+        """
+        Long-polls a job: returns it as soon as it finishes, or as it stands after `timeout`
+        seconds. The database is polled, since workers are other processes, and read on the
+        default executor, so a busy database doesn't stall the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        interval = 0.01
+        while True:
+            job = await loop.run_in_executor(None, self.get, job_id)
+            if job is None or job["status"] in ("done", "failed"):
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, 0.25)
+
+    def purge(self, max_age: float):
+        """
+        Deletes finished jobs older than `max_age` seconds. Returns how many were removed.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - max_age,),
+            )
+        return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
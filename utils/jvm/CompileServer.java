@@ -0,0 +1,116 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.OutputStreamWriter;
+import java.io.PrintStream;
+import java.io.Writer;
+import java.lang.reflect.Method;
+import java.net.URI;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Base64;
+import java.util.Collections;
+import java.util.List;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.SimpleJavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+
+/**
+ * Long-lived compile server for Java and Kotlin submissions (see utils/jvm_service.py).
+ *
+ * Compilers are loaded once and stay JIT-warm across requests. Requests are read from stdin,
+ * one per line: "LANGUAGE\tSOURCE_PATH\tOUTPUT_PATH". Java compiles to a class directory,
+ * Kotlin to a runnable jar. Each request is answered on stdout with one line:
+ * "EXIT_CODE\tMILLIS\tBASE64_DIAGNOSTICS".
+ */
+public class CompileServer {
+    private static final JavaCompiler JAVAC = ToolProvider.getSystemJavaCompiler();
+    private static final StandardJavaFileManager FILE_MANAGER =
+            JAVAC.getStandardFileManager(null, null, StandardCharsets.UTF_8);
+
+    private static Object kotlinCompiler;
+    private static Method kotlinExec;
+
+    public static void main(String[] args) throws Exception {
+        BufferedReader in =
+                new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        // Keep anything the compilers print themselves off the protocol stream
+        System.setOut(System.err);
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] request = line.split("\t", 3);
+            ByteArrayOutputStream diagnostics = new ByteArrayOutputStream();
+            long started = System.nanoTime();
+            int exitCode;
+            try {
+                if (request[0].equals("kt")) {
+                    exitCode = compileKotlin(request[1], request[2], diagnostics);
+                } else {
+                    exitCode = compileJava(request[1], request[2], diagnostics);
+                }
+            } catch (Throwable t) {
+                t.printStackTrace(new PrintStream(diagnostics, true));
+                exitCode = 1;
+            }
+            long millis = (System.nanoTime() - started) / 1_000_000;
+            out.println(exitCode + "\t" + millis + "\t"
+                    + Base64.getEncoder().encodeToString(diagnostics.toByteArray()));
+        }
+    }
+
+    private static int compileJava(String source, String output, OutputStream diagnostics)
+            throws Exception {
+        String code = new String(Files.readAllBytes(Paths.get(source)), StandardCharsets.UTF_8);
+        Files.createDirectories(Paths.get(output));
+        // Named like the file on disk, which callers name after the public class
+        JavaFileObject file = new SimpleJavaFileObject(
+                URI.create("string:///" + Paths.get(source).getFileName()),
+                JavaFileObject.Kind.SOURCE) {
+            @Override
+            public CharSequence getCharContent(boolean ignoreEncodingErrors) {
+                return code;
+            }
+        };
+        Writer writer = new OutputStreamWriter(diagnostics, StandardCharsets.UTF_8);
+        boolean ok = JAVAC.getTask(
+                writer,
+                FILE_MANAGER,
+                null,
+                Arrays.asList("-d", output, "-proc:none"),
+                null,
+                Collections.singletonList(file)).call();
+        writer.flush();
+        return ok ? 0 : 1;
+    }
+
+    private static int compileKotlin(String source, String output, OutputStream diagnostics)
+            throws Exception {
+        if (kotlinExec == null) {
+            // Loaded reflectively so the server also runs where only a JDK is installed
+            Class<?> compiler = Class.forName("org.jetbrains.kotlin.cli.jvm.K2JVMCompiler");
+            kotlinCompiler = compiler.getDeclaredConstructor().newInstance();
+            kotlinExec = compiler.getMethod("exec", PrintStream.class, String[].class);
+        }
+        List<String> args = new ArrayList<>(
+                Arrays.asList(source, "-include-runtime", "-d", output, "-nowarn"));
+        String kotlinHome = System.getProperty("kotlin.home");
+        if (kotlinHome != null) {
+            args.add("-kotlin-home");
+            args.add(kotlinHome);
+        }
+        PrintStream err = new PrintStream(diagnostics, true, "UTF-8");
+        Object exitCode = kotlinExec.invoke(kotlinCompiler, err, (Object) args.toArray(new String[0]));
+        err.flush();
+        return (Integer) exitCode.getClass().getMethod("getCode").invoke(exitCode);
+    }
+}
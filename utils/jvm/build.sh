@@ -0,0 +1,66 @@
+#!/bin/sh
+# Builds the JVM compile server and its class-data-sharing (AppCDS) archives at image build time.
+#
+#   utils/jvm/build.sh [OUT_DIR]    (default /opt/glimpse-jvm)
+#
+# Produces:
+#   OUT_DIR/classes      CompileServer classes
+#   OUT_DIR/classpath    classpath the server runs (and its archive was dumped) with
+#   OUT_DIR/compile.jsa  archive of the classes the compilers load, for the server's start
+#   OUT_DIR/run.jsa      archive of the JDK classes a submission loads, for every run
+#
+# The Kotlin compiler is included when KOTLIN_HOME is set.
+set -e
+
+out=${1:-/opt/glimpse-jvm}
+here=$(cd "$(dirname "$0")" && pwd)
+work=$(mktemp -d)
+trap 'rm -rf "$work"' EXIT
+
+mkdir -p "$out/classes"
+javac -d "$out/classes" "$here/CompileServer.java"
+
+classpath="$out/classes"
+server_flags=""
+if [ -n "$KOTLIN_HOME" ]; then
+    classpath="$classpath:$KOTLIN_HOME/lib/kotlin-compiler.jar"
+    server_flags="-Dkotlin.home=$KOTLIN_HOME"
+fi
+printf '%s' "$classpath" > "$out/classpath"
+
+cat > "$work/Main.java" <<'EOF'
+import java.util.*;
+
+public class Main {
+    public static void main(String[] args) {
+        Scanner scanner = new Scanner(System.in);
+        List<String> lines = new ArrayList<>();
+        while (scanner.hasNextLine()) lines.add(scanner.nextLine());
+        System.out.println(String.join("\n", lines));
+    }
+}
+EOF
+cat > "$work/Main.kt" <<'EOF'
+fun main() {
+    println(generateSequence(::readLine).joinToString("\n"))
+}
+EOF
+
+# Training run for the server: record what the compilers load, then archive it
+{
+    printf 'java\t%s\t%s\n' "$work/Main.java" "$work/classes"
+    if [ -n "$KOTLIN_HOME" ]; then
+        printf 'kt\t%s\t%s\n' "$work/Main.kt" "$work/Main.jar"
+    fi
+} | java -Xshare:off -XX:DumpLoadedClassList="$work/compile.classlist" $server_flags \
+    -cp "$classpath" CompileServer > /dev/null
+java -Xshare:dump -XX:SharedClassListFile="$work/compile.classlist" \
+    -XX:SharedArchiveFile="$out/compile.jsa" -cp "$classpath"
+
+# Training run for submissions. Only JDK classes are archived, so the archive is valid
+# whatever classpath a submission runs with.
+echo hello | java -Xshare:off -XX:DumpLoadedClassList="$work/run.classlist" \
+    -cp "$work/classes" Main > /dev/null
+grep -E '^(java|javax|jdk|sun)/' "$work/run.classlist" > "$work/run-jdk.classlist"
+java -Xshare:dump -XX:SharedClassListFile="$work/run-jdk.classlist" \
+    -XX:SharedArchiveFile="$out/run.jsa"
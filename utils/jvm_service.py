@@ -0,0 +1,129 @@
+import base64
+import os
+import selectors
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SERVER_SOURCE = str(Path(__file__).parent / "jvm" / "CompileServer.java")
+
+# Short-lived submissions gain little from the optimizing JIT and nothing from a parallel GC
+RUN_FLAGS = ["-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC"]
+
+
+class JvmCompileService:
+    """
+    Client for a long-lived compile server JVM (see jvm/CompileServer.java), which keeps javac
+    and the Kotlin compiler loaded and warm between requests instead of paying JVM startup and
+    compiler class loading on each one.
+
+    `build_dir` is what jvm/build.sh produced at image build time, including the CDS archives
+    used for the server's own start (compile.jsa) and for running submissions (run.jsa). Without
+    it the server is compiled on first use and runs without archives.
+
+    Requests are serialized; compiles are short once the server is warm.
+    """
+
+    def __init__(self, build_dir: str = None, java: str = "java", kotlin_home: str = None):
+        self.build_dir = Path(build_dir or os.getenv("JVM_SERVICE_DIR", "/opt/glimpse-jvm"))
+        self.java = java
+        self.kotlin_home = kotlin_home or os.getenv("KOTLIN_HOME")
+        self.process = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Returns a service if JVM_COMPILE_SERVICE is enabled, else None.
+        """
+        if os.getenv("JVM_COMPILE_SERVICE", "false").lower() != "true":
+            return None
+        return cls()
+
+    def run_flags(self):
+        """
+        JVM options for running a compiled submission.
+        """
+        archive = self.build_dir / "run.jsa"
+        if archive.exists():
+            return RUN_FLAGS + [f"-XX:SharedArchiveFile={archive}", "-Xshare:auto"]
+        return list(RUN_FLAGS)
+
+    def start(self):
+        if self.process and self.process.poll() is None:
+            return
+
+        classpath_file = self.build_dir / "classpath"
+        flags = []
+        if classpath_file.exists():
+            classpath = classpath_file.read_text().strip()
+            if (self.build_dir / "compile.jsa").exists():
+                flags += [f"-XX:SharedArchiveFile={self.build_dir / 'compile.jsa'}", "-Xshare:auto"]
+        else:
+            classpath = self._build_server()
+        if self.kotlin_home:
+            flags.append(f"-Dkotlin.home={self.kotlin_home}")
+
+        self.process = subprocess.Popen(
+            [self.java, *flags, "-cp", classpath, "CompileServer"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def compile(self, language: str, source: str, output: str, timeout: float = 20):
+        """
+        Compiles `source` into `output` (a class directory for Java, a jar for Kotlin).
+        Returns an (exit_code, diagnostics, compile_seconds) tuple.
+
+        Raises:
+            subprocess.TimeoutExpired: If the compile takes longer than `timeout`. The server
+                is restarted for the next request.
+        """
+        with self._lock:
+            self.start()
+            self.process.stdin.write(f"{language}\t{source}\t{output}\n".encode())
+            self.process.stdin.flush()
+            line = self._read_line(time.monotonic() + timeout)
+            if line is None:
+                self.process.kill()
+                self.process.wait()
+                raise subprocess.TimeoutExpired(f"compile {language}", timeout)
+
+        exit_code, millis, diagnostics = line.decode().rstrip("\n").split("\t")
+        return int(exit_code), base64.b64decode(diagnostics).decode(errors="replace"), int(millis) / 1000
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+    def _read_line(self, deadline: float):
+        """
+        Reads one response line from the server, or returns None if none arrives in time.
+        """
+        fd = self.process.stdout.fileno()
+        chunks = []
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    return None
+                data = os.read(fd, 65536)
+                if not data:
+                    raise RuntimeError("JVM compile server exited unexpectedly")
+                chunks.append(data)
+                if data.endswith(b"\n"):
+                    return b"".join(chunks)
+
+    def _build_server(self):
+        classes = os.path.join(tempfile.gettempdir(), "glimpse-jvm-classes")
+        if not os.path.exists(os.path.join(classes, "CompileServer.class")):
+            subprocess.run(["javac", "-d", classes, SERVER_SOURCE], check=True)
+        classpath = classes
+        if self.kotlin_home:
+            classpath += os.pathsep + os.path.join(self.kotlin_home, "lib", "kotlin-compiler.jar")
+        return classpath
@@ -0,0 +1,179 @@
+import bisect
+import copy
+import threading
+
+# Upper bounds (seconds) suited to container waits and program runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(copy.deepcopy(self._values).items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def _render_sample(self, key, value):
+        counts, total, observed = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = self._format_labels(key, [("le", repr(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', '+Inf')])} {observed}")
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {observed}")
+        return lines
+
+
+class Registry:
+    """
+    A minimal Prometheus-compatible metrics registry, rendered in the text exposition format.
+    Collectors run before each render, to refresh gauges that are cheaper to read on demand.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Registering a name again (e.g. from a module imported twice) shares the metric
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()):
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def render(self):
+        for collect in self._collectors:
+            collect()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# The process-wide registry served on /metrics
+registry = Registry()
+
+
+HTTP_RESPONSES = registry.counter(
+    "glimpse_http_responses_total", "HTTP responses by status code", ["status"]
+)
+COMPILE_SECONDS = registry.histogram(
+    "glimpse_compile_seconds",
+    "Compile phase latency, including compile cache lookups",
+    ["backend", "language"],
+)
+EXEC_SECONDS = registry.histogram(
+    "glimpse_exec_seconds", "Run phase latency", ["backend", "language"]
+)
+EXECUTION_TIMEOUTS = registry.counter(
+    "glimpse_execution_timeouts_total",
+    "Programs killed for exceeding their time limit",
+    ["backend", "language"],
+)
+
+
+def observe_run(backend: str, language: str, usage: dict):
+    """
+    Records the compile and run phases of a result's usage breakdown.
+    """
+    if usage.get("compile") is not None:
+        COMPILE_SECONDS.observe(usage["compile"], backend=backend, language=language)
+    if usage.get("run") is not None:
+        EXEC_SECONDS.observe(usage["run"], backend=backend, language=language)
+
+
+async def count_responses(request, call_next):
+    """
+    HTTP middleware counting responses by status, e.g. 429s from rate limiting and 503s
+    from an exhausted pool.
+    """
+    response = await call_next(request)
+    HTTP_RESPONSES.inc(status=response.status_code)
+    return response
@@ -0,0 +1,178 @@
+import os
+import resource
+import selectors
+import signal
+import time
+
+
+def spawn(argv, env=None, pass_fds=(), cpu_limit: int = None):
+    """
+    Starts `argv` in its own session, wired to fresh stdin/stdout/stderr pipes. The
+    descriptors in `pass_fds` become fds 3, 4, ... in the child. `cpu_limit` caps its CPU
+    seconds, see `limit_cpu`.
+
+    Unlike subprocess.Popen, nothing else ever reaps the child, so `wait` can collect its
+    rusage. Returns (pid, stdin_w, stdout_r, stderr_r).
+    """
+    stdin_r, stdin_w = os.pipe()
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    try:
+        pid = os.posix_spawnp(
+            argv[0],
+            argv,
+            os.environ if env is None else env,
+            file_actions=[
+                (os.POSIX_SPAWN_DUP2, stdin_r, 0),
+                (os.POSIX_SPAWN_DUP2, stdout_w, 1),
+                (os.POSIX_SPAWN_DUP2, stderr_w, 2),
+                *((os.POSIX_SPAWN_DUP2, fd, 3 + i) for i, fd in enumerate(pass_fds)),
+            ],
+            setsid=True,
+        )
+    except BaseException:
+        for fd in (stdin_w, stdout_r, stderr_r):
+            os.close(fd)
+        raise
+    finally:
+        for fd in (stdin_r, stdout_w, stderr_w):
+            os.close(fd)
+    if cpu_limit is not None:
+        limit_cpu(pid, cpu_limit)
+    return pid, stdin_w, stdout_r, stderr_r
+
+
+def limit_cpu(pid: int, seconds: int):
+    """
+    Sets RLIMIT_CPU on a running process, which its children inherit: SIGXCPU after
+    `seconds` of CPU time, SIGKILL a second later. Counts CPU time already used.
+    """
+    try:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (int(seconds), int(seconds) + 1))
+    except ProcessLookupError:
+        pass
+
+
+def limit_exceeded(timed_out: bool, usage: dict):
+    """
+    Names the limit that ended a run: "wall_time" if it was killed at its deadline,
+    "cpu_time" if it ran out of CPU time, else None.
+    """
+    if timed_out:
+        return "wall_time"
+    if usage.get("exit_signal") == signal.SIGXCPU:
+        return "cpu_time"
+    return None
+
+
+def run(argv, input: str = None, timeout: float = 30, env=None, cpu_limit: int = None):
+    """
+    Runs `argv` to completion, killing its whole process group if it exceeds `timeout`
+    (None for no limit) and capping its CPU time at `cpu_limit` seconds. Blocking.
+    Returns a (stdout, stderr, exit_code, timed_out, usage) tuple; see `usage`.
+    """
+    pid, stdin_w, stdout_r, stderr_r = spawn(argv, env, cpu_limit=cpu_limit)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    stdout, stderr, timed_out = communicate(stdin_w, stdout_r, stderr_r, input, deadline)
+    exit_code, rusage, timed_out_waiting = wait(pid, deadline)
+    return stdout, stderr, exit_code, timed_out or timed_out_waiting, rusage
+
+
+def wait(pid: int, deadline: float = None):
+    """
+    Reaps `pid`, killing its process group first if it is still running at `deadline`.
+    Returns an (exit_code, usage, timed_out) tuple.
+    """
+    timed_out = False
+    while True:
+        if deadline is None:
+            _, status, rusage = os.wait4(pid, 0)
+            break
+        reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+        if reaped:
+            break
+        if time.monotonic() >= deadline:
+            timed_out = True
+            kill_group(pid)
+            deadline = None
+            continue
+        time.sleep(0.001)
+    exit_code = os.waitstatus_to_exitcode(status)
+    return exit_code, usage(rusage, exit_code), timed_out
+
+
+def usage(rusage, exit_code: int):
+    """
+    The resource usage reported with every run: CPU seconds in user and kernel mode, peak
+    resident memory, and the signal that ended the process (None if it exited normally).
+
+    Linux carries the spawning process's peak RSS over an exec, so `max_rss_kb` is a
+    high-water mark that never reads below the memory of the process it was started from.
+    """
+    return {
+        "user_time": rusage.ru_utime,
+        "sys_time": rusage.ru_stime,
+        "max_rss_kb": rusage.ru_maxrss,
+        "exit_signal": -exit_code if exit_code is not None and exit_code < 0 else None,
+    }
+
+
+def communicate(stdin_w, stdout_r, stderr_r, input, deadline):
+    """
+    Feeds `input` to stdin_w and collects stdout_r / stderr_r until both reach EOF or the
+    deadline passes (None waits forever). Closes all three descriptors.
+    Returns (stdout, stderr, timed_out); on a timeout the caller still has to kill the process.
+    """
+    pending = (input or "").encode()
+    chunks = {stdout_r: [], stderr_r: []}
+    selector = selectors.DefaultSelector()
+    stdin_open = bool(pending)
+    if pending:
+        os.set_blocking(stdin_w, False)
+        selector.register(stdin_w, selectors.EVENT_WRITE)
+    else:
+        os.close(stdin_w)
+    for fd in chunks:
+        selector.register(fd, selectors.EVENT_READ)
+
+    timed_out = False
+    try:
+        while selector.get_map():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+            for key, _ in selector.select(remaining):
+                fd = key.fd
+                if fd == stdin_w:
+                    try:
+                        written = os.write(fd, pending[:65536])
+                    except BrokenPipeError:
+                        written = len(pending)
+                    pending = pending[written:]
+                    if not pending:
+                        selector.unregister(fd)
+                        os.close(fd)
+                        stdin_open = False
+                    continue
+                data = os.read(fd, 65536)
+                if data:
+                    chunks[fd].append(data)
+                else:
+                    selector.unregister(fd)
+    finally:
+        selector.close()
+        if stdin_open:
+            os.close(stdin_w)
+        for fd in chunks:
+            os.close(fd)
+    return b"".join(chunks[stdout_r]), b"".join(chunks[stderr_r]), timed_out
+
+
+def kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
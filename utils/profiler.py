@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread in this process at a fixed interval, without
+    instrumenting anything, so it can be switched on in a live server. One profile runs at
+    a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.005):
+        """
+        Samples for `seconds`, blocking the calling thread. Returns the number of samples
+        and how often each stack was seen, keyed by "thread;outermost;...;innermost" frames.
+
+        Raises:
+            RuntimeError: If a profile is already running.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(seconds, interval)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds, interval):
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(frames))] += 1
+            samples += 1
+            time.sleep(interval)
+        return {
+            "seconds": time.monotonic() - started,
+            "interval": interval,
+            "samples": samples,
+            "stacks": stacks,
+        }
+
+
+def collapsed(profile: dict):
+    """
+    Renders a profile in the collapsed-stack format read by flamegraph.pl and speedscope.
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].most_common())
+
+
+def summarize(profile: dict, top: int = 30):
+    """
+    The functions seen most often, on top of a thread's stack (self) and anywhere in it
+    (total), with how many thread stacks they were seen in.
+    """
+    own = Counter()
+    total = Counter()
+    for stack, count in profile["stacks"].items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return {
+        "seconds": profile["seconds"],
+        "interval": profile["interval"],
+        "samples": profile["samples"],
+        "self": [{"function": f, "count": n} for f, n in own.most_common(top)],
+        "total": [{"function": f, "count": n} for f, n in total.most_common(top)],
+    }
+
+
+# The process-wide profiler behind the admin profiling endpoint
+profiler = SamplingProfiler()
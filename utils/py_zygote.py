@@ -0,0 +1,169 @@
+"""
+Fork server ("zygote") for Python submissions.
+
+Run as `python3 py_zygote.py SOCKET_PATH [MODULE ...]`. The server imports the given modules
+once, then listens on a Unix socket. Each connection carries a JSON request naming the script
+to run, along with the stdin, stdout and stderr file descriptors to wire it to. The server
+forks a child per request, which starts with the interpreter and preloaded modules already
+warm, and replies with the child's pid, then with its exit code and resource usage once it
+has been reaped. The server exits, killing its children, once the process that started it
+is gone.
+
+This file only uses the standard library, as it runs under the submission interpreter.
+"""
+import builtins
+import importlib
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import traceback
+
+
+# How often, in seconds, the server checks that the process that started it is alive
+PARENT_CHECK_INTERVAL = 1.0
+
+
+def main():
+    socket_path = sys.argv[1]
+    parent = os.getppid()
+    for name in sys.argv[2:]:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass  # A missing optional module shouldn't take the server down
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(128)
+
+    # SIGCHLD wakes the selector through this pipe, so children are reaped without threads
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    children = {}
+
+    # Started in a session of its own, so nothing else stops the server when its parent dies
+    while os.getppid() == parent:
+        for key, _ in selector.select(PARENT_CHECK_INTERVAL):
+            if key.fileobj is server:
+                _accept(server, children, (server, wakeup_r, wakeup_w))
+            else:
+                os.read(wakeup_r, 4096)
+                _reap(children)
+
+    for pid in children:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    try:
+        os.unlink(socket_path)
+    except OSError:
+        pass
+
+
+def _accept(server, children, inherited):
+    conn, _ = server.accept()
+    try:
+        message, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+        request = json.loads(message)
+    except (OSError, ValueError):
+        conn.close()
+        return
+    if len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        return
+
+    pid = os.fork()
+    if pid == 0:
+        _run_child(request, fds, inherited + (conn,))
+
+    for fd in fds:
+        os.close(fd)
+    try:
+        conn.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+    except OSError:
+        pass
+    children[pid] = conn
+
+
+def _reap(children):
+    while True:
+        try:
+            pid, status, usage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        conn = children.pop(pid, None)
+        if conn is None:
+            continue
+        try:
+            conn.sendall(
+                json.dumps(
+                    {
+                        "exit_code": os.waitstatus_to_exitcode(status),
+                        "user_time": usage.ru_utime,
+                        "sys_time": usage.ru_stime,
+                        "max_rss_kb": usage.ru_maxrss,
+                    }
+                ).encode()
+                + b"\n"
+            )
+        except OSError:
+            pass
+        conn.close()
+
+
+def _run_child(request, fds, inherited):
+    exit_code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for obj in inherited:
+            obj.close() if hasattr(obj, "close") else os.close(obj)
+        # Own process group, so a timeout can kill everything the submission spawns
+        os.setsid()
+        for target, fd in zip((0, 1, 2), fds):
+            os.dup2(fd, target)
+            os.close(fd)
+
+        script = request["script"]
+        os.chdir(request.get("cwd") or os.path.dirname(script))
+        sys.argv = [script]
+        sys.path[0] = os.path.dirname(script)
+        with open(script) as f:
+            source = f.read()
+
+        globals_ = {"__name__": "__main__", "__file__": script, "__builtins__": builtins}
+        try:
+            exec(compile(source, script, "exec"), globals_)
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                exit_code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException as e:
+            # Leave out this frame so the traceback reads like a plain `python3 script.py`
+            traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import asyncio
+import copy
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    In-memory memoization of execution results with single-flight coalescing.
+
+    Results are keyed on a hash of the backend and the (language, code, input) triple and kept
+    for `ttl` seconds, bounded to `max_entries` in LRU order. While an execution for a key is in
+    flight, identical requests await that execution instead of starting their own. Failed
+    executions are shared with the requests waiting on them but never stored.
+
+    A `ttl` of 0 disables the cache entirely, so it is opt-in per deployment.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        # Read the environment here rather than at import, so values from .env apply
+        if ttl is None:
+            ttl = float(os.getenv("RESULT_CACHE_TTL", 0))
+        if max_entries is None:
+            max_entries = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def make_key(backend: str, language: str, code: str, input: str = None):
+        digest = hashlib.sha256()
+        for part in (backend, language, code or ""):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        # Distinguish "no input" from an empty string
+        digest.update(b"\1" if input is None else b"\2" + input.encode())
+        return digest.hexdigest()
+
+    async def get_or_run(self, key: str, run, cacheable=None):
+        """
+        Returns the cached result for `key`, or awaits `run()` to produce it.
+
+        Args:
+            key (str): A key from `make_key`.
+            run (Callable[[], Awaitable]): Performs the execution on a miss.
+            cacheable (Callable[[Any], bool]): Optionally decides whether a result may be stored.
+        """
+        if not self.enabled:
+            return await run()
+
+        while True:
+            cached = self._lookup(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+
+            self.coalesced += 1
+            try:
+                return copy.deepcopy(await asyncio.shield(pending))
+            except asyncio.CancelledError:
+                if pending.cancelled():
+                    # The leading request went away before finishing; take over from it.
+                    continue
+                raise
+
+        self.misses += 1
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        try:
+            result = await run()
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception()  # Mark as retrieved when nobody else was waiting
+            raise
+        else:
+            if cacheable is None or cacheable(result):
+                self._store(key, result)
+            pending.set_result(result)
+            return copy.deepcopy(result)
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(result)
+
+    def _store(self, key: str, result):
+        self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(result))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import random
+import sys
+from pathlib import Path
+
+from utils import processes
+
+LAUNCHER = str(Path(__file__).with_name("sandbox_init.py"))
+
+# Writable or private parts of the host filesystem the program sees as empty directories;
+# everything else is mounted read-only
+DEFAULT_HIDE = ("/tmp", "/dev/shm", "/var/tmp", "/run", "/home", "/root")
+
+# Runtimes that fit under an address-space limit. The JVM, V8 and Go reserve far more
+# virtual memory than they use, so they only get the other limits.
+ADDRESS_SPACE_LIMITED = ("c", "cpp", "py")
+
+
+class ProcessSandbox:
+    """
+    Runs programs isolated with Linux primitives directly instead of a container, at the
+    cost of a process launch (see sandbox_init.py for the setup).
+
+    Each run gets new mount, PID, network, IPC and UTS namespaces, a read-only view of the
+    host filesystem with fresh tmpfs mounts over `hide` (DEFAULT_HIDE: /tmp and /dev/shm,
+    where staged and cached submissions live, /var/tmp, /run and home directories) and only
+    the program's own files bound back read-only, rlimits on processes, open files, file
+    size and (for ADDRESS_SPACE_LIMITED runtimes) memory, a uid of its own from `uid_base`
+    on, and a seccomp filter blocking syscalls like mount, ptrace and unshare. Toolchains
+    must therefore live outside the hidden paths.
+
+    The process limit and the uid need root. Unless `allow_unprivileged`, runs fail when
+    not started as root; with it, a user namespace stands in and the program keeps our uid
+    and has no process limit. If namespaces are unavailable, runs fail unless
+    `require_namespaces` is off, in which case they get only the rlimits, uid and seccomp
+    filter.
+    """
+
+    def __init__(
+        self,
+        hide=DEFAULT_HIDE,
+        uid_base: int = 100000,
+        uid_range: int = 65536,
+        file_size_mb: int = 64,
+        require_namespaces: bool = True,
+        allow_unprivileged: bool = False,
+        python: str = sys.executable,
+    ):
+        self.hide = list(hide)
+        self.uid_base = uid_base
+        self.uid_range = uid_range
+        self.file_size_mb = file_size_mb
+        self.require_namespaces = require_namespaces
+        self.allow_unprivileged = allow_unprivileged
+        self.python = python
+        self.logger = logging.getLogger(__name__)
+        if allow_unprivileged and os.geteuid() != 0:
+            self.logger.warning("Sandboxing without root: programs keep our uid and have no process limit")
+
+    @classmethod
+    def from_env(cls, hide=()):
+        """
+        Builds a sandbox hiding DEFAULT_HIDE, `hide` and the paths in SANDBOX_HIDE.
+        """
+        extra = [path.strip() for path in os.getenv("SANDBOX_HIDE", "").split(",") if path.strip()]
+        return cls(
+            hide=[*DEFAULT_HIDE, *hide, *extra],
+            uid_base=int(os.getenv("SANDBOX_UID_BASE", 100000)),
+            require_namespaces=os.getenv("SANDBOX_REQUIRE_NAMESPACES", "true").lower() == "true",
+            allow_unprivileged=os.getenv("SANDBOX_ALLOW_UNPRIVILEGED", "false").lower() == "true",
+        )
+
+    def command(self, argv, language: str, profile: dict, cpu_limit: int = None):
+        """
+        Wraps `argv` in the launcher. Absolute paths among its arguments that exist (the
+        program, its script or class directory) stay visible, read-only.
+
+        Raises:
+            RuntimeError: If not running as root and `allow_unprivileged` is off.
+        """
+        if os.geteuid() != 0 and not self.allow_unprivileged:
+            raise RuntimeError(
+                "The process sandbox needs root; set SANDBOX_ALLOW_UNPRIVILEGED=true to run "
+                "programs under our own uid and without a process limit"
+            )
+        keep = sorted({arg for arg in argv if os.path.isabs(arg) and os.path.exists(arg)})
+        config = {
+            "hide": self.hide,
+            "keep": keep,
+            # Random rather than allocated, so API processes need no coordination; two runs
+            # drawing the same uid only share their process limit
+            "uid": self.uid_base + random.randrange(self.uid_range),
+            "pids": profile["pids"],
+            "tmp_mb": profile["tmp"],
+            "memory_mb": profile["memory"] if language in ADDRESS_SPACE_LIMITED else None,
+            "file_size_mb": self.file_size_mb,
+            "cpu_limit": cpu_limit,
+            "require_namespaces": self.require_namespaces,
+        }
+        return [self.python, "-I", "-S", LAUNCHER, json.dumps(config), *argv]
+
+    def run(self, argv, language: str, profile: dict, input: str = None, timeout: float = 30, cpu_limit: int = None):
+        """
+        Runs `argv` in a sandbox sized by a resource profile (see containers.resource_profile).
+        Blocking. Returns the same (stdout, stderr, exit_code, timed_out, usage) tuple as
+        `utils.processes.run`; an exit code of 125 means the sandbox could not be set up.
+        """
+        command = self.command(argv, language, profile, cpu_limit)
+        return processes.run(command, input, timeout, self.environment())
+
+    def environment(self):
+        # What the program gets instead of our environment
+        return {
+            "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+            "LANG": "C.UTF-8",
+            "HOME": "/tmp",
+            "TMPDIR": "/tmp",
+        }
@@ -0,0 +1,324 @@
+"""
+Sets up a sandbox and runs a program in it. Started by utils/sandbox.py as
+
+    python3 -I -S sandbox_init.py '<json config>' argv...
+
+and written against the standard library only, so it starts in a few milliseconds.
+
+The launcher unshares mount, PID, network, IPC and UTS namespaces (in a user namespace
+too when not root), then forks the new PID namespace's init. Init remounts every existing
+mount read-only, mounts a private /proc and size-limited tmpfs over the hidden paths (/tmp,
+/dev/shm, /var/tmp, /run, home directories, ...), binding back read-only just the files the
+program needs, and forks the program. The program gets rlimits, an
+unprivileged uid, no_new_privs and a seccomp filter before exec. When init exits, the
+kernel kills everything left in the namespace.
+
+The launcher exits like the program did, re-raising its signal if it was killed by one.
+"""
+
+import ctypes
+import json
+import os
+import resource
+import signal
+import struct
+import sys
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUTS = 0x04000000
+CLONE_NEWIPC = 0x08000000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWPID = 0x20000000
+CLONE_NEWNET = 0x40000000
+
+MS_RDONLY = 1
+MS_NOSUID = 2
+MS_NODEV = 4
+MS_NOEXEC = 8
+MS_REMOUNT = 32
+MS_BIND = 4096
+MS_REC = 16384
+MS_PRIVATE = 1 << 18
+# Mount flags a read-only remount has to keep, as reported by statvfs
+KEPT_FLAGS = MS_NOSUID | MS_NODEV | MS_NOEXEC | 1024 | 2048 | 4096
+
+PR_SET_PDEATHSIG = 1
+PR_SET_SECCOMP = 22
+PR_SET_NO_NEW_PRIVS = 38
+SECCOMP_MODE_FILTER = 2
+SECCOMP_RET_KILL_PROCESS = 0x80000000
+SECCOMP_RET_ERRNO = 0x00050000
+SECCOMP_RET_ALLOW = 0x7FFF0000
+
+# Exit code when the sandbox itself could not be set up
+SETUP_FAILED = 125
+
+# Syscalls that reconfigure the system, escape or inspect namespaces, or widen the kernel
+# attack surface; the program gets EPERM. Numbers per audit architecture.
+BLOCKED_SYSCALLS = {
+    # x86_64
+    0xC000003E: [
+        165, 166, 155, 161, 167, 168, 169, 170, 171, 175, 313, 176, 246, 320, 272, 308,
+        101, 310, 311, 321, 298, 323, 250, 248, 249, 304, 303, 163, 164, 227, 305, 159,
+        179, 103, 153, 172, 173, 212, 428, 429, 430, 431, 432, 433, 442, 438, 425, 426,
+        427,
+    ],
+    # aarch64
+    0xC00000B7: [
+        40, 39, 41, 51, 224, 225, 142, 161, 162, 105, 273, 106, 104, 294, 97, 268, 117,
+        270, 271, 280, 241, 282, 219, 217, 218, 265, 264, 89, 170, 112, 266, 171, 60, 116,
+        58, 18, 428, 429, 430, 431, 432, 433, 442, 438, 425, 426, 427,
+    ],
+}
+X32_SYSCALL_BIT = 0x40000000
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+
+def check(result, what):
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{what}: {os.strerror(errno)}")
+
+
+def mount(source, target, fstype, flags, data=None):
+    check(
+        libc.mount(
+            source.encode() if source else None,
+            target.encode(),
+            fstype.encode() if fstype else None,
+            ctypes.c_ulong(flags),
+            data.encode() if data else None,
+        ),
+        f"mount {target}",
+    )
+
+
+def unshare():
+    namespaces = CLONE_NEWNS | CLONE_NEWPID | CLONE_NEWNET | CLONE_NEWIPC | CLONE_NEWUTS
+    if os.geteuid() == 0:
+        check(libc.unshare(namespaces), "unshare")
+        return
+    # Unprivileged: a user namespace grants the rights to set up the others, and maps only
+    # our own uid, so the program can't gain anything we don't have
+    uid, gid = os.geteuid(), os.getegid()
+    check(libc.unshare(namespaces | CLONE_NEWUSER), "unshare")
+    with open("/proc/self/setgroups", "w") as f:
+        f.write("deny")
+    with open("/proc/self/uid_map", "w") as f:
+        f.write(f"{uid} {uid} 1")
+    with open("/proc/self/gid_map", "w") as f:
+        f.write(f"{gid} {gid} 1")
+
+
+def mount_points():
+    with open("/proc/self/mountinfo") as f:
+        # Field 5 is the mount point, with spaces and the like escaped as octal
+        return [line.split()[4].encode().decode("unicode_escape") for line in f]
+
+
+def read_only_mounts():
+    """
+    Makes every mount in the namespace read-only, so the program can write nothing on the
+    host but the tmpfs mounts created afterwards. A mount that can't be made read-only
+    fails the setup rather than being left writable.
+    """
+    for path in mount_points():
+        if path == "/proc" or path.startswith("/proc/"):
+            continue
+        flags = os.statvfs(path).f_flag & KEPT_FLAGS
+        mount(None, path, None, MS_BIND | MS_REMOUNT | MS_RDONLY | flags)
+
+
+def build_filesystem(config, kept):
+    """
+    Makes the host's filesystem read-only, hides the paths in config["hide"] under fresh
+    tmpfs mounts and binds the files the program needs back in, read-only. `kept` maps each
+    of those paths to an O_PATH fd opened before they were hidden.
+    """
+    mount(None, "/", None, MS_REC | MS_PRIVATE)
+    read_only_mounts()
+    try:
+        # Shows only the sandbox's processes. Refused in user namespaces where /proc has
+        # masked paths (e.g. inside a container); the PID namespace still applies.
+        mount("proc", "/proc", "proc", MS_NOSUID | MS_NODEV | MS_NOEXEC)
+    except OSError:
+        pass
+    hidden = []
+    for path in sorted({os.path.realpath(path) for path in config["hide"]}):
+        if os.path.isdir(path) and not any(path.startswith(parent + "/") for parent in hidden):
+            mount("tmpfs", path, "tmpfs", MS_NOSUID | MS_NODEV, f"size={config['tmp_mb']}m,mode=1777")
+            hidden.append(path)
+    for path, fd in kept.items():
+        if not any(path.startswith(parent + "/") for parent in hidden):
+            os.close(fd)
+            continue
+        if os.path.isdir(f"/proc/self/fd/{fd}"):
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "a").close()
+        mount(f"/proc/self/fd/{fd}", path, None, MS_BIND)
+        flags = os.statvfs(path).f_flag & KEPT_FLAGS
+        mount(None, path, None, MS_BIND | MS_REMOUNT | MS_RDONLY | MS_NOSUID | flags)
+        os.close(fd)
+
+
+def limit_resources(config):
+    def limit(which, value):
+        resource.setrlimit(which, (value, value))
+
+    limit(resource.RLIMIT_CORE, 0)
+    limit(resource.RLIMIT_NOFILE, 256)
+    limit(resource.RLIMIT_FSIZE, config["file_size_mb"] << 20)
+    if config.get("memory_mb"):
+        limit(resource.RLIMIT_AS, config["memory_mb"] << 20)
+    if config.get("cpu_limit"):
+        # SIGXCPU at the limit, SIGKILL a second later, as in utils/processes.limit_cpu
+        resource.setrlimit(resource.RLIMIT_CPU, (config["cpu_limit"], config["cpu_limit"] + 1))
+    # Counts all processes and threads of the uid, so only when each run gets a uid of its own
+    if os.geteuid() == 0:
+        limit(resource.RLIMIT_NPROC, config["pids"])
+
+
+def drop_privileges(config):
+    if os.geteuid() != 0:
+        return
+    uid = config["uid"]
+    os.setgroups([])
+    os.setresgid(uid, uid, uid)
+    os.setresuid(uid, uid, uid)
+
+
+def install_seccomp():
+    arch = {"x86_64": 0xC000003E, "aarch64": 0xC00000B7}.get(os.uname().machine)
+    check(libc.prctl(PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0), "no_new_privs")
+    if arch is None:
+        return
+
+    def stmt(code, k):
+        return struct.pack("HBBI", code, 0, 0, k)
+
+    def jump(code, k, jt, jf):
+        return struct.pack("HBBI", code, jt, jf, k)
+
+    BPF_LD_W_ABS = 0x20
+    BPF_JEQ_K = 0x15
+    BPF_JGE_K = 0x35
+    BPF_RET_K = 0x06
+    program = [
+        stmt(BPF_LD_W_ABS, 4),  # seccomp_data.arch
+        jump(BPF_JEQ_K, arch, 1, 0),
+        stmt(BPF_RET_K, SECCOMP_RET_KILL_PROCESS),
+        stmt(BPF_LD_W_ABS, 0),  # seccomp_data.nr
+    ]
+    if arch == 0xC000003E:
+        program += [jump(BPF_JGE_K, X32_SYSCALL_BIT, 0, 1), stmt(BPF_RET_K, SECCOMP_RET_KILL_PROCESS)]
+    for number in BLOCKED_SYSCALLS[arch]:
+        program += [jump(BPF_JEQ_K, number, 0, 1), stmt(BPF_RET_K, SECCOMP_RET_ERRNO | 1)]
+    program.append(stmt(BPF_RET_K, SECCOMP_RET_ALLOW))
+
+    filters = ctypes.create_string_buffer(b"".join(program))
+
+    class SockFprog(ctypes.Structure):
+        _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+    fprog = SockFprog(len(program), ctypes.addressof(filters))
+    check(libc.prctl(PR_SET_SECCOMP, SECCOMP_MODE_FILTER, ctypes.byref(fprog), 0, 0), "seccomp")
+
+
+def find_executable(name):
+    if "/" in name:
+        return name
+    for directory in os.get_exec_path():
+        path = os.path.join(directory, name)
+        if os.access(path, os.X_OK):
+            return path
+    raise FileNotFoundError(f"{name}: command not found")
+
+
+def run_program(config, executable, argv):
+    limit_resources(config)
+    os.chdir("/tmp")
+    drop_privileges(config)
+    install_seccomp()
+    os.execv(executable, argv)
+
+
+def init(config, executable, argv, kept, status_w):
+    """
+    PID 1 of the sandbox: sets up its filesystem, runs the program, reaps whatever it
+    leaves behind and reports the program's wait status to the launcher.
+    """
+    libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL, 0, 0, 0)
+    if config["namespaces"]:
+        build_filesystem(config, kept)
+        libc.sethostname(b"sandbox", 7)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_program(config, executable, argv)
+        except BaseException as e:
+            os.write(2, f"sandbox: {e}\n".encode())
+            os._exit(SETUP_FAILED)
+    # Reap orphans until the program exits; whatever is left dies with this process
+    while True:
+        reaped, status = os.waitpid(-1, 0)
+        if reaped == pid:
+            break
+    os.write(status_w, struct.pack("i", status))
+    os._exit(0)
+
+
+def main():
+    config = json.loads(sys.argv[1])
+    argv = sys.argv[2:]
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    # Looked up before anything is hidden or the uid drops: the lookup imports modules, and
+    # our own Python may live under a hidden path (e.g. pyenv or a venv in a home directory)
+    try:
+        executable = os.path.realpath(find_executable(argv[0]))
+    except FileNotFoundError as e:
+        os.write(2, f"sandbox: {e}\n".encode())
+        os._exit(127)
+    try:
+        unshare()
+        config["namespaces"] = True
+    except OSError as e:
+        if config["require_namespaces"]:
+            os.write(2, f"sandbox: namespaces unavailable ({e})\n".encode())
+            os._exit(SETUP_FAILED)
+        config["namespaces"] = False
+    kept = {}
+    if config["namespaces"]:
+        for path in [executable, *config["keep"]]:
+            kept[os.path.realpath(path)] = os.open(path, os.O_PATH)
+
+    status_r, status_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(status_r)
+        try:
+            init(config, executable, argv, kept, status_w)
+        except BaseException as e:
+            os.write(2, f"sandbox: {e}\n".encode())
+            os._exit(SETUP_FAILED)
+    os.close(status_w)
+    for fd in kept.values():
+        os.close(fd)
+    os.waitpid(pid, 0)
+    data = os.read(status_r, 4)
+    if len(data) < 4:
+        # Init was killed (e.g. by the deadline) before the program finished
+        os.kill(os.getpid(), signal.SIGKILL)
+    status = struct.unpack("i", data)[0]
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        signal.signal(sig, signal.SIG_DFL)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, [sig])
+        os.kill(os.getpid(), sig)
+    os._exit(os.waitstatus_to_exitcode(status))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import io
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+
+def _default_root():
+    # /dev/shm is a tmpfs on Linux, so staged sources and binaries never reach a disk
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return os.path.join(shm, "glimpse-jobs")
+    return os.path.join(tempfile.gettempdir(), "glimpse-jobs")
+
+
+def archive(files: dict, mode: int = 0o644):
+    """
+    Builds an in-memory tar archive from a {name: bytes} mapping, suitable for `put_archive`.
+    """
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name=name)
+            info.size = len(data)
+            info.mode = mode
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    return stream.getvalue()
+
+
+def submission_archive(job_id: str, language: str, code: str):
+    """
+    Returns a tar archive holding the submission as `<job_id>.<language>`, built straight
+    from memory for copying into a container.
+    """
+    return archive({f"{job_id}.{language}": (code or "").encode()})
+
+
+class SubmissionStaging:
+    """
+    Stages submissions that run on the host.
+
+    Each job gets a private directory under `root` (a tmpfs by default, GLIMPSE_STAGING_DIR
+    overrides it) holding the source file and whatever is compiled from it. Released
+    directories are removed by a background thread in batches, so requests never wait on
+    cleanup.
+    """
+
+    def __init__(self, root: str = None, batch_size: int = 64, flush_interval: float = 0.5):
+        self.root = root or os.getenv("GLIMPSE_STAGING_DIR") or _default_root()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(self.root, exist_ok=True)
+        self._released = queue.Queue()
+        threading.Thread(target=self._cleanup, name="staging-cleanup", daemon=True).start()
+
+    def new_job(self, language: str, code: str):
+        """
+        Writes a submission into a fresh job directory. The write goes to memory-backed
+        storage, so it is cheap enough to do on the event loop.
+        """
+        job_id = str(uuid4())
+        directory = os.path.join(self.root, job_id)
+        os.mkdir(directory)
+        file_name = f"{job_id}.{language}"
+        file_path = os.path.join(directory, file_name)
+        with open(file_path, "w") as f:
+            f.write(code or "")
+        return {
+            "jobID": job_id,
+            "fileName": file_name,
+            "filePath": file_path,
+            "directory": directory,
+        }
+
+    def release(self, job_id: str):
+        """
+        Queues a job's directory for removal.
+        """
+        self._released.put(os.path.join(self.root, job_id))
+
+    def purge(self, max_age: float = 0):
+        """
+        Removes job directories older than `max_age` seconds, e.g. ones left behind by a
+        process that crashed mid-request. Returns how many were removed.
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def _cleanup(self):
+        while True:
+            batch = [self._released.get()]
+            # Give other requests a moment to finish, then remove their directories together
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._released.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            for path in batch:
+                shutil.rmtree(path, ignore_errors=True)
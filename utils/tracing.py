@@ -0,0 +1,275 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+# The span that new spans nest under, per task or thread
+_current = contextvars.ContextVar("glimpse_span", default=None)
+
+
+class _NoopSpan:
+    """Stands in for a span that is not recorded (tracing off, or the trace not sampled)."""
+
+    trace_id = None
+    sampled = False
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _RemoteParent:
+    # The caller's span, from a W3C `traceparent` header
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+class Span:
+    """
+    A timed operation within a trace. Use as a context manager: spans started inside it, in
+    the same task or in threads it hands work to with `contextvars.copy_context()`, nest
+    under it. An exception escaping the block marks the span as failed.
+    """
+
+    sampled = True
+
+    def __init__(self, tracer, name: str, parent=None, kind: str = "internal", attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        # Spans are exported with the rest of their trace when its local root ends
+        self.root = parent.root if isinstance(parent, Span) else self
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start = time.time_ns()
+        self.end = None
+        self._finished = []
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.finish()
+        return False
+
+    def finish(self):
+        self.end = time.time_ns()
+        if self.root is self:
+            self.tracer.export([*self._finished, self])
+        elif self.root.end is None:
+            self.root._finished.append(self)
+        else:
+            # Outlived its root, e.g. a container being recycled after the response went out
+            self.tracer.export([self])
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start / 1e9,
+            "duration_ms": (self.end - self.start) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.kind == "server" else 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Tracer:
+    """
+    Records spans around the phases of a request and hands each finished trace to an
+    exporter. With no exporter, `span` returns a shared no-op, so instrumented code costs
+    next to nothing while tracing is off.
+
+    Traces are sampled at their root with probability `sample_rate`; spans under an
+    unsampled root are not recorded either.
+    """
+
+    def __init__(self, exporter=None, sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a tracer from TRACE_EXPORT ("log" or "otlp", unset to disable),
+        TRACE_OTLP_PATH and TRACE_SAMPLE_RATE.
+        """
+        mode = os.getenv("TRACE_EXPORT", "").lower()
+        exporter = None
+        if mode == "log":
+            exporter = LogExporter()
+        elif mode == "otlp":
+            exporter = OtlpFileExporter(
+                os.getenv("TRACE_OTLP_PATH")
+                or os.path.join(tempfile.gettempdir(), "glimpse-traces.jsonl")
+            )
+        elif mode:
+            raise ValueError(f"TRACE_EXPORT must be 'log' or 'otlp', got {mode!r}")
+        return cls(exporter, float(os.getenv("TRACE_SAMPLE_RATE", 1.0)))
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def span(self, name: str, traceparent: str = None, kind: str = "internal", **attributes):
+        """
+        Starts a span under the current one, or a new trace (continuing the caller's, if a
+        `traceparent` header is given) when there is none. Use it in a `with` block.
+        """
+        if self.exporter is None:
+            return NOOP_SPAN
+        parent = _current.get()
+        if parent is None and traceparent:
+            parent = _parse_traceparent(traceparent)
+        if parent is None:
+            if random.random() >= self.sample_rate:
+                return _Unsampled()
+        elif not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent, kind, attributes)
+
+    def export(self, spans):
+        try:
+            self.exporter.export(spans)
+        except Exception as e:
+            self.logger.error(f"Failed to export {len(spans)} spans: {e}")
+
+
+class _Unsampled(_NoopSpan):
+    # Marks its block as unsampled, so the spans inside it are skipped too
+    def __enter__(self):
+        self._token = _current.set(NOOP_SPAN)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+        return False
+
+
+class LogExporter:
+    """Logs each span as a line of JSON on the `glimpse.trace` logger."""
+
+    def __init__(self, logger: logging.Logger = None):
+        self.logger = logger or logging.getLogger("glimpse.trace")
+
+    def export(self, spans):
+        for span in spans:
+            self.logger.info(json.dumps(span.to_dict(), default=str))
+
+
+class OtlpFileExporter:
+    """
+    Appends each trace to `path` as one line of OTLP/JSON (an ExportTraceServiceRequest),
+    the format of the OpenTelemetry Collector's file exporter, so the file can be replayed
+    into any OTLP backend.
+    """
+
+    def __init__(self, path: str, service: str = "glimpse"):
+        self.path = path
+        self.resource = {"attributes": [_otlp_attribute("service.name", service)]}
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [{"scope": {"name": __name__}, "spans": [s.to_otlp() for s in spans]}],
+                }
+            ]
+        }
+        line = json.dumps(request, default=str) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def _parse_traceparent(header: str):
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return _RemoteParent(parts[1], parts[2], sampled)
+
+
+# The process-wide tracer, configured from the environment
+tracer = Tracer.from_env()
+
+
+async def trace_requests(request, call_next):
+    """
+    HTTP middleware opening a trace per request, continuing the caller's when it sends a
+    `traceparent` header, and returning the trace id in `X-Trace-Id`. For streamed
+    responses the span ends when the response starts.
+    """
+    if not tracer.enabled:
+        return await call_next(request)
+    with tracer.span(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent"),
+        kind="server",
+        **{"http.method": request.method, "http.target": request.url.path},
+    ) as span:
+        response = await call_next(request)
+        span.set(**{"http.status_code": response.status_code})
+        if response.status_code >= 500 and span.sampled:
+            span.error = f"HTTP {response.status_code}"
+    if span.trace_id:
+        response.headers["X-Trace-Id"] = span.trace_id
+    return response
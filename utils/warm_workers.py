@@ -0,0 +1,270 @@
+import json
+import os
+import queue
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from utils.processes import communicate, kill_group, limit_cpu, spawn, wait
+from utils.processes import run as run_process
+
+ZYGOTE_SCRIPT = str(Path(__file__).with_name("py_zygote.py"))
+
+# Seconds the fork server has to answer a run with the child's pid before it is taken for
+# hung and the run goes to a cold interpreter
+FORK_REPLY_TIMEOUT = 1.0
+
+# Waits for a script path on the given fd, then runs it as the main module. Everything
+# before that (interpreter startup, preloaded modules) happens while the process is a spare.
+NODE_BOOTSTRAP = """
+const fs = require("fs");
+const path = require("path");
+const Module = require("module");
+const [codeFd, ...preload] = process.argv.slice(1);
+for (const name of preload) {
+  try { require(name); } catch (e) {}
+}
+const script = path.resolve(fs.readFileSync(Number(codeFd), "utf8").trim());
+fs.closeSync(Number(codeFd));
+process.argv = [process.argv[0], script];
+Module._load(script, null, true);
+"""
+
+
+class PythonZygote:
+    """
+    Client for a warm Python fork server (see py_zygote.py). The server is started lazily and
+    restarted if it dies; every run gets a freshly forked child with the preloaded modules.
+    A run the server fails to take falls back to a cold interpreter.
+    """
+
+    def __init__(self, preload=(), python="python3", env=None):
+        self.preload = list(preload)
+        self.python = python
+        self.env = env
+        self.socket_path = os.path.join(tempfile.gettempdir(), f"glimpse-zygote-{uuid4()}.sock")
+        self.process = None
+        self._lock = threading.Lock()
+
+    def start(self, timeout=10):
+        with self._lock:
+            if self.process and self.process.poll() is None:
+                return
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.process = subprocess.Popen(
+                [self.python, ZYGOTE_SCRIPT, self.socket_path, *self.preload],
+                stdin=subprocess.DEVNULL,
+                env=self.env,
+                start_new_session=True,
+            )
+            deadline = time.monotonic() + timeout
+            while not os.path.exists(self.socket_path):
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("Python fork server failed to start")
+                time.sleep(0.005)
+
+    def run(self, script: str, input: str = None, timeout: float = 30, cpu_limit: int = None):
+        """
+        Runs a script in a forked child, with at most `cpu_limit` CPU seconds. Blocking.
+        Returns a (stdout, stderr, exit_code, timed_out, usage) tuple, with usage as in
+        `utils.processes.usage`.
+        """
+        self.start()
+        process = self.process
+        deadline = time.monotonic() + timeout
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        ours = [stdin_w, stdout_r, stderr_r]
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        replies = conn.makefile("rb")
+        try:
+            try:
+                conn.settimeout(FORK_REPLY_TIMEOUT)
+                conn.connect(self.socket_path)
+                request = json.dumps({"script": script}).encode()
+                socket.send_fds(conn, [request], [stdin_r, stdout_w, stderr_w])
+                reply = replies.readline()
+            except OSError:
+                reply = b""
+            finally:
+                for fd in (stdin_r, stdout_w, stderr_w):
+                    os.close(fd)
+            if not reply:
+                # The server died or hung; replace it for later runs and run this one cold
+                self._discard(process)
+                return run_process(
+                    [self.python, script],
+                    input,
+                    max(deadline - time.monotonic(), 0),
+                    self.env,
+                    cpu_limit,
+                )
+
+            pid = json.loads(reply)["pid"]
+            if cpu_limit is not None:
+                limit_cpu(pid, cpu_limit)
+            ours = []
+            stdout, stderr, timed_out = communicate(
+                stdin_w, stdout_r, stderr_r, input, deadline
+            )
+            if timed_out:
+                kill_group(pid)
+            conn.settimeout(max(deadline - time.monotonic(), 1))
+            try:
+                status = json.loads(replies.readline() or b"{}")
+            except socket.timeout:
+                kill_group(pid)
+                status = {}
+                timed_out = True
+        finally:
+            replies.close()
+            conn.close()
+            for fd in ours:
+                os.close(fd)
+
+        exit_code = status.get("exit_code")
+        usage = {
+            "user_time": status.get("user_time"),
+            "sys_time": status.get("sys_time"),
+            "max_rss_kb": status.get("max_rss_kb"),
+            "exit_signal": -exit_code if exit_code is not None and exit_code < 0 else None,
+        }
+        return stdout, stderr, exit_code, timed_out, usage
+
+    def _discard(self, process):
+        # Kills a server that failed a run, unless another run has replaced it already;
+        # the next run starts a new one
+        with self._lock:
+            if self.process is process and process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class NodeSpares:
+    """
+    Keeps `size` Node processes started ahead of time, each with the runtime and preloaded
+    modules loaded and blocked waiting for a script. Node can't fork a warm parent, so a
+    spare is consumed per run and replaced in the background.
+    """
+
+    def __init__(self, size=2, preload=(), node="node", env=None):
+        self.size = size
+        self.preload = list(preload)
+        self.node = node
+        self.env = env
+        self.spares = queue.Queue()
+        for _ in range(size):
+            threading.Thread(target=self._add_spare, daemon=True).start()
+
+    def _spawn(self):
+        # The script path arrives on fd 3
+        code_r, code_w = os.pipe()
+        try:
+            pid, stdin_w, stdout_r, stderr_r = spawn(
+                [self.node, "-e", NODE_BOOTSTRAP, "3", *self.preload],
+                env=self.env,
+                pass_fds=(code_r,),
+            )
+        except BaseException:
+            os.close(code_w)
+            raise
+        finally:
+            os.close(code_r)
+        return pid, code_w, (stdin_w, stdout_r, stderr_r)
+
+    def _add_spare(self):
+        self.spares.put(self._spawn())
+
+    def run(self, script: str, input: str = None, timeout: float = 30, cpu_limit: int = None):
+        """
+        Runs a script on a spare process (or a fresh one if none are ready), with at most
+        `cpu_limit` CPU seconds on top of what its startup used. Blocking.
+        Returns a (stdout, stderr, exit_code, timed_out, usage) tuple, with usage as in
+        `utils.processes.usage`.
+        """
+        try:
+            pid, code_w, pipes = self.spares.get_nowait()
+        except queue.Empty:
+            pid, code_w, pipes = self._spawn()
+        threading.Thread(target=self._add_spare, daemon=True).start()
+
+        deadline = time.monotonic() + timeout
+        if cpu_limit is not None:
+            limit_cpu(pid, cpu_limit + _cpu_seconds(pid))
+        os.write(code_w, script.encode())
+        os.close(code_w)
+        stdout, stderr, timed_out = communicate(*pipes, input, deadline)
+        exit_code, usage, timed_out_waiting = wait(pid, deadline)
+        return stdout, stderr, exit_code, timed_out or timed_out_waiting, usage
+
+    def stop(self):
+        while not self.spares.empty():
+            pid, code_w, pipes = self.spares.get_nowait()
+            os.close(code_w)
+            for fd in pipes:
+                os.close(fd)
+            kill_group(pid)
+            wait(pid)
+
+
+def _cpu_seconds(pid: int):
+    # CPU time a process has used so far, rounded up, from /proc/<pid>/stat (utime + stime)
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0
+    ticks = int(fields[11]) + int(fields[12])
+    return -(-ticks // os.sysconf("SC_CLK_TCK"))
+
+
+class WarmWorkers:
+    """
+    Warm interpreters for the languages whose wall time is dominated by startup.
+    Languages are enabled with WARM_WORKERS (e.g. "py,js"); modules to preload are listed in
+    WARM_PRELOAD_PY / WARM_PRELOAD_JS, and WARM_NODE_SPARES sets how many Node processes wait
+    ready. Submissions inherit `env` (the caller's environment by default).
+    """
+
+    def __init__(self, languages=(), preload_py=(), preload_js=(), node_spares=2, env=None):
+        self.workers = {}
+        if "py" in languages:
+            self.workers["py"] = PythonZygote(preload=preload_py, env=env)
+        if "js" in languages:
+            self.workers["js"] = NodeSpares(size=node_spares, preload=preload_js, env=env)
+
+    @classmethod
+    def from_env(cls, env=None):
+        def names(variable):
+            return [n.strip() for n in os.getenv(variable, "").split(",") if n.strip()]
+
+        return cls(
+            languages=names("WARM_WORKERS"),
+            preload_py=names("WARM_PRELOAD_PY"),
+            preload_js=names("WARM_PRELOAD_JS"),
+            node_spares=int(os.getenv("WARM_NODE_SPARES", 2)),
+            env=env,
+        )
+
+    def handles(self, language: str):
+        return language in self.workers
+
+    def run(self, language: str, script: str, input: str = None, timeout: float = 30, cpu_limit: int = None):
+        return self.workers[language].run(script, input, timeout, cpu_limit)
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
@@ -0,0 +1,120 @@
+"""
+Runs jobs submitted through the API's /jobs endpoints.
+
+Workers pull from the shared JobQueue (JOB_QUEUE_PATH), a SQLite database on this host, and
+scale across its cores with --processes:
+
+    python worker.py --processes 4 --concurrency 2 --backends local,pool
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+
+from dotenv import load_dotenv
+
+# Load .env before the local modules below read their configuration at import
+load_dotenv()
+
+from containers import pool_from_env
+from glimpse import run_code, run_code_pool
+from utils.job_queue import JobQueue
+
+logger = logging.getLogger("glimpse.worker")
+
+# Finished jobs are kept this long for clients to collect their results
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 3600))
+
+
+async def run_job(job_queue: JobQueue, job_id: str, backend: str, payload: dict, container_pool):
+    try:
+        if backend == "pool":
+            result = await run_code_pool(
+                payload["language"], payload["code"], payload.get("input"), container_pool
+            )
+        else:
+            result = await run_code(
+                payload["language"], payload["code"], payload.get("input"), sandbox=True if backend == "sandbox" else None
+            )
+    except Exception as e:
+        # HTTPExceptions from the pool carry their message in `detail`
+        job_queue.fail(job_id, getattr(e, "detail", None) or str(e))
+    else:
+        job_queue.complete(job_id, result)
+
+
+async def work(backends, concurrency: int, poll_interval: float = 0.05):
+    """
+    Claims and runs jobs, at most `concurrency` at a time, until cancelled.
+    """
+    job_queue = JobQueue()
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    container_pool = None
+    if "pool" in backends:
+        container_pool = pool_from_env()
+        container_pool.warm_up()
+
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+    loop = asyncio.get_running_loop()
+    next_purge = 0
+    logger.info(f"Worker {name} serving {','.join(backends)} with {concurrency} slots")
+    try:
+        while True:
+            if loop.time() >= next_purge:
+                job_queue.purge(JOB_RESULT_TTL)
+                next_purge = loop.time() + 60
+            await slots.acquire()
+            claimed = job_queue.claim(name, backends)
+            if claimed is None:
+                slots.release()
+                await asyncio.sleep(poll_interval)
+                continue
+            task = asyncio.create_task(run_job(job_queue, *claimed, container_pool))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        for task in running:
+            task.cancel()
+        if container_pool is not None:
+            container_pool.shutdown_pool()
+
+
+def serve(backends, concurrency: int):
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(work(backends, concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs queued Glimpse jobs.")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 1)))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", 2)), help="Jobs each process runs at once")
+    parser.add_argument("--backends", default=os.getenv("WORKER_BACKENDS", "local"), help="Comma-separated: local, pool, sandbox")
+    args = parser.parse_args(argv)
+    backends = tuple(name.strip() for name in args.backends.split(","))
+
+    # Each process starts fresh rather than inheriting the parent's threads
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=serve, args=(backends, args.concurrency), name=f"worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()